@@ -59,6 +59,64 @@ class Config:
     STORAGE_SECRET_KEY = os.environ.get("STORAGE_SECRET_KEY")
     STORAGE_BUCKET = os.environ.get("STORAGE_BUCKET")
 
+    # "spaces" (DigitalOcean Spaces) or "local" (files on this server's disk,
+    # served by /api/files); single-node setups and benchmarks can use local
+    STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "spaces")
+    LOCAL_STORAGE_ROOT = os.environ.get("LOCAL_STORAGE_ROOT") or str(
+        basedir / "storage"
+    )
+    LOCAL_STORAGE_BUCKET = os.environ.get("LOCAL_STORAGE_BUCKET", "local")
+    LOCAL_STORAGE_URL = os.environ.get(
+        "LOCAL_STORAGE_URL", "http://localhost:5001/api/files"
+    )
+    # Let the front proxy send local files (X-Sendfile) instead of the app
+    USE_X_SENDFILE = os.environ.get("USE_X_SENDFILE", "false").lower() == "true"
+    # Store images once per distinct content (objects/<sha256>) and share the
+    # object between StorageLocation records instead of uploading duplicates
+    STORAGE_CONTENT_ADDRESSED = (
+        os.environ.get("STORAGE_CONTENT_ADDRESSED", "false").lower() == "true"
+    )
+
+    # WebP derivatives rendered for each generated image (variant -> longest side)
+    IMAGE_DERIVATIVES_ENABLED = (
+        os.environ.get("IMAGE_DERIVATIVES_ENABLED", "true").lower() == "true"
+    )
+    IMAGE_DERIVATIVE_SIZES = {"thumb": 320, "medium": 1024}
+    IMAGE_DERIVATIVE_QUALITY = int(os.environ.get("IMAGE_DERIVATIVE_QUALITY", 80))
+    DERIVATIVE_WORKERS = int(os.environ.get("DERIVATIVE_WORKERS", 2))
+
+    # Remove deleted files' objects in a background thread, in batches
+    STORAGE_DEFERRED_DELETES = (
+        os.environ.get("STORAGE_DEFERRED_DELETES", "false").lower() == "true"
+    )
+
+    # Large uploads (model weights) go up in parts of this size, this many at once
+    STORAGE_MULTIPART_PART_SIZE = (
+        int(os.environ.get("STORAGE_MULTIPART_PART_MB", 16)) * 1024 * 1024
+    )
+    STORAGE_MULTIPART_CONCURRENCY = int(
+        os.environ.get("STORAGE_MULTIPART_CONCURRENCY", 8)
+    )
+    # Downloads to disk fetch ranges of the part size, this many at once
+    STORAGE_DOWNLOAD_CONCURRENCY = int(
+        os.environ.get("STORAGE_DOWNLOAD_CONCURRENCY", 8)
+    )
+
+    # Images opened (first chunk only) ahead of the one being written into a
+    # photobook ZIP export
+    EXPORT_PREFETCH = int(os.environ.get("EXPORT_PREFETCH", 4))
+
+    # Presigned download URLs are reused until this many seconds before expiry;
+    # enable the Redis tier to share them between processes
+    PRESIGNED_URL_CACHE_SIZE = int(os.environ.get("PRESIGNED_URL_CACHE_SIZE", 10000))
+    PRESIGNED_URL_REFRESH_MARGIN = int(
+        os.environ.get("PRESIGNED_URL_REFRESH_MARGIN", 300)
+    )
+    PRESIGNED_URL_REDIS_ENABLED = (
+        os.environ.get("PRESIGNED_URL_REDIS_ENABLED", "false").lower() == "true"
+    )
+    REDIS_URL_CACHE_DB = int(os.environ.get("REDIS_URL_CACHE_DB", 2))
+
     # Lambda GPU Settings
     LAMBDA_API_KEY = os.environ.get("LAMBDA_API_KEY")
     LAMBDA_INSTANCE_ID = os.environ.get("LAMBDA_INSTANCE_ID")
@@ -77,10 +135,85 @@ class Config:
         "us-east-2",
         "us-midwest-1",
     ]
-    LAMBDA_INSTANCE_TYPES = ["gpu_1x_gh200", "gpu_1x_h100_pcie", "gpu_1x_h100_sxm5"]
+    # Tried in order. Multi-GPU types such as gpu_8x_h100 run several jobs of
+    # a training batch (TRAINING_BATCH_SIZE) at once, one per GPU
+    LAMBDA_INSTANCE_TYPES = os.environ.get(
+        "LAMBDA_INSTANCE_TYPES", "gpu_1x_gh200,gpu_1x_h100_pcie,gpu_1x_h100_sxm5"
+    ).split(",")
+
+    # Environment cache reused across launches. LAMBDA_FILE_SYSTEMS maps regions
+    # to filesystems attached at launch ("us-east-1:pbai-east,..."), mounted
+    # under LAMBDA_FILE_SYSTEM_MOUNT. Elsewhere LAMBDA_ENV_CACHE_DIR is used if
+    # set, e.g. a directory prebuilt into the LAMBDA_IMAGE_ID image
+    LAMBDA_FILE_SYSTEMS = dict(
+        item.split(":", 1)
+        for item in os.environ.get("LAMBDA_FILE_SYSTEMS", "").split(",")
+        if ":" in item
+    )
+    LAMBDA_FILE_SYSTEM_MOUNT = os.environ.get("LAMBDA_FILE_SYSTEM_MOUNT", "/lambda/nfs")
+    LAMBDA_IMAGE_ID = os.environ.get("LAMBDA_IMAGE_ID")
+    LAMBDA_ENV_CACHE_DIR = os.environ.get("LAMBDA_ENV_CACHE_DIR")
+
+    # Training toolkit checked out on instances; the resolved commit is part
+    # of the environment cache fingerprint
+    AI_TOOLKIT_REPO = os.environ.get(
+        "AI_TOOLKIT_REPO", "https://github.com/amanzoni1/ai-toolkit.git"
+    )
+    AI_TOOLKIT_REF = os.environ.get("AI_TOOLKIT_REF")
+
+    # Lambda API client shared by all workers in a process: requests per
+    # second (with bursts), seconds GET responses are reused, timeouts
+    LAMBDA_API_RATE_LIMIT = float(os.environ.get("LAMBDA_API_RATE_LIMIT", 1.0))
+    LAMBDA_API_BURST = int(os.environ.get("LAMBDA_API_BURST", 5))
+    LAMBDA_API_CACHE_TTL = 2.0
+    LAMBDA_API_TIMEOUT = 30
+    LAMBDA_API_MAX_RETRIES = 3
+    LAMBDA_TERMINATE_TIMEOUT = 30
+
+    # Launched instances are polled together with one list call: every
+    # FAST_INTERVAL seconds during the usual boot window, then every
+    # SLOW_INTERVAL seconds
+    LAMBDA_POLL_FAST_INTERVAL = 3.0
+    LAMBDA_POLL_SLOW_INTERVAL = 15.0
+    LAMBDA_BOOT_WINDOW = 300
+    LAMBDA_POLL_MAX_FAILURES = 5
+
+    # GPU provider: "lambda", or "simulator" to load-test the pipeline offline.
+    # SIMULATOR_CONFIG overrides the defaults in services/compute_simulator.py
+    COMPUTE_BACKEND = os.environ.get("COMPUTE_BACKEND", "lambda")
+    SIMULATOR_CONFIG = {
+        "time_scale": float(os.environ.get("SIMULATOR_TIME_SCALE", 1.0)),
+    }
 
     # AI Training settings
     HF_TOKEN = os.environ.get("HF_TOKEN")
+    GENERATION_BATCH_SIZE = int(os.environ.get("GENERATION_BATCH_SIZE", 4))
+
+    # Model weights cached on worker hosts, keyed by checksum
+    WEIGHTS_CACHE_DIR = os.environ.get(
+        "WEIGHTS_CACHE_DIR", Path(tempfile.gettempdir()) / "weights_cache"
+    )
+    WEIGHTS_CACHE_MAX_BYTES = int(os.environ.get("WEIGHTS_CACHE_MAX_GB", 50)) * 1024**3
+
+    # Training jobs a worker claims per GPU instance, and how many of them use
+    # the GPU at once (1 runs them back-to-back)
+    TRAINING_BATCH_SIZE = int(os.environ.get("TRAINING_BATCH_SIZE", 1))
+    TRAINING_BATCH_CONCURRENCY = int(os.environ.get("TRAINING_BATCH_CONCURRENCY", 1))
+
+    # Training images are oriented, resized and re-encoded before upload.
+    # TRAINING_IMAGE_CROP is one of "none", "center" or "face"
+    TRAINING_IMAGE_RESOLUTION = 1024
+    TRAINING_IMAGE_CROP = os.environ.get("TRAINING_IMAGE_CROP", "none")
+    TRAINING_IMAGE_QUALITY = 95
+    PREPROCESS_WORKERS = int(os.environ.get("PREPROCESS_WORKERS", 4))
+
+    # Remote command timeouts in seconds (idle = no output for that long)
+    REMOTE_SETUP_IDLE_TIMEOUT = 600
+    REMOTE_SETUP_TIMEOUT = 1800
+    REMOTE_TRAINING_IDLE_TIMEOUT = 900
+    REMOTE_TRAINING_TIMEOUT = 3 * 3600
+    REMOTE_GENERATION_IDLE_TIMEOUT = 600
+    REMOTE_GENERATION_TIMEOUT = 3600
 
     # Redis configuration
     REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
@@ -105,6 +238,22 @@ class Config:
     JOB_CLEANUP_HOURS = 24
     JOB_RETENTION_DAYS = 7
 
+    # "threads" trains on worker threads; "asyncio" supervises every training
+    # as a task on one event loop, up to ASYNC_MAX_TRAINING_JOBS at once
+    WORKER_MODE = os.environ.get("WORKER_MODE", "threads")
+    ASYNC_MAX_TRAINING_JOBS = int(os.environ.get("ASYNC_MAX_TRAINING_JOBS", 100))
+
+    # Speculative GPU launches when a training upload starts (and to cover the
+    # recent upload rate), claimed by the next training job. Instances left
+    # unclaimed for PREWARM_IDLE_TIMEOUT seconds are terminated
+    PREWARM_ENABLED = os.environ.get("PREWARM_ENABLED", "false").lower() == "true"
+    PREWARM_MAX_INSTANCES = int(os.environ.get("PREWARM_MAX_INSTANCES", 2))
+    PREWARM_IDLE_TIMEOUT = int(os.environ.get("PREWARM_IDLE_TIMEOUT", 600))
+    PREWARM_CLAIM_WAIT = 30  # then the job launches its own instance
+    PREWARM_LAUNCH_ATTEMPTS = 3  # one pass over every type and region each
+    PREWARM_LAUNCH_BACKOFF = 60  # seconds before the second attempt, then doubled
+    PREWARM_FORECAST_WINDOW = 3600  # 0 disables rate-based prewarming
+
     # Alert settings
     ALERT_EMAIL_ENABLED = False
     ALERT_SLACK_ENABLED = False
@@ -124,6 +273,16 @@ class Config:
     # Upload limits
     MAX_CONTENT_LENGTH = 500 * 1024 * 1024  # 500MB max file size for model uploads
     ALLOWED_IMAGE_EXTENSIONS = {"png", "jpg", "jpeg", "webp"}
+
+    # Direct-to-storage training uploads (/api/model/training/uploads)
+    TRAINING_UPLOAD_MAX_FILES = 50
+    TRAINING_UPLOAD_MAX_BYTES = 50 * 1024 * 1024  # per image
+    TRAINING_UPLOAD_EXPIRY = 3600
+
+    # Resumable training uploads (/api/model/training/sessions)
+    UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+    UPLOAD_SESSION_TTL = 12 * 3600  # temp dirs of expired sessions are removed
+    REDIS_UPLOAD_DB = int(os.environ.get("REDIS_UPLOAD_DB", 3))
     ALLOWED_MODEL_EXTENSIONS = {"safetensors", "bin", "pt", "pth"}
 
     PRICING = {
@@ -0,0 +1,26 @@
+"""Index StorageLocation checksum for content-addressed lookups
+
+Revision ID: b52e7c1d9a4f
+Revises: 1dd20e353d0f
+Create Date: 2026-10-19 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b52e7c1d9a4f'
+down_revision = '1dd20e353d0f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('storage_locations', schema=None) as batch_op:
+        batch_op.create_index('idx_storage_locations_checksum', ['checksum'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('storage_locations', schema=None) as batch_op:
+        batch_op.drop_index('idx_storage_locations_checksum')
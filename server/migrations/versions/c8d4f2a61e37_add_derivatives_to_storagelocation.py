@@ -0,0 +1,35 @@
+"""Add parent and variant to StorageLocation for image derivatives
+
+Revision ID: c8d4f2a61e37
+Revises: b52e7c1d9a4f
+Create Date: 2026-10-19 11:03:27.540918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8d4f2a61e37'
+down_revision = 'b52e7c1d9a4f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('storage_locations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('parent_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('variant', sa.String(length=20), nullable=True))
+        batch_op.create_foreign_key(
+            'storage_locations_parent_id_fkey', 'storage_locations',
+            ['parent_id'], ['id'], ondelete='CASCADE'
+        )
+        batch_op.create_index('idx_storage_locations_parent', ['parent_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('storage_locations', schema=None) as batch_op:
+        batch_op.drop_index('idx_storage_locations_parent')
+        batch_op.drop_constraint('storage_locations_parent_id_fkey', type_='foreignkey')
+        batch_op.drop_column('variant')
+        batch_op.drop_column('parent_id')
@@ -8,7 +8,7 @@ from sqlalchemy.dialects.postgresql import JSONB
 from enum import Enum as PyEnum
 from typing import Optional, Dict, List
 from sqlalchemy.types import Enum as SAEnum
-from config import Config
+from services.theme_catalog import get_theme_catalog
 
 
 class CreditType(PyEnum):
@@ -116,6 +116,21 @@ class StorageLocation(db.Model, TimestampMixin):
     checksum = db.Column(db.String(64), nullable=True)
     metadata_json = db.Column(JSONB)
 
+    # Derivatives (thumbnails, web sizes) point at the original they came from
+    parent_id = db.Column(
+        db.Integer,
+        db.ForeignKey("storage_locations.id", ondelete="CASCADE"),
+        nullable=True,
+    )
+    variant = db.Column(db.String(20), nullable=True)
+
+    derivatives = db.relationship(
+        "StorageLocation",
+        backref=db.backref("parent", remote_side=[id]),
+        cascade="all, delete-orphan",
+        lazy=True,
+    )
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -126,6 +141,15 @@ class StorageLocation(db.Model, TimestampMixin):
             "content_type": self.content_type,
             "checksum": self.checksum,
             "metadata_json": self.metadata_json,
+            "parent_id": self.parent_id,
+            "variant": self.variant,
+        }
+
+    @property
+    def variant_paths(self) -> Dict[str, str]:
+        """Full paths of the derivatives, keyed by variant"""
+        return {
+            derivative.variant: derivative.full_path for derivative in self.derivatives
         }
 
     @property
@@ -226,6 +250,7 @@ class PhotoBook(db.Model, TimestampMixin):
                 {
                     "id": img.id,
                     "storage_path": img.storage_location.full_path,
+                    "variants": img.storage_location.variant_paths,
                     "prompt": img.prompt,
                 }
                 for img in self.images
@@ -238,9 +263,8 @@ class PhotoBook(db.Model, TimestampMixin):
     @property
     def theme_prompts(self) -> List[str]:
         """Get prompt strings for this theme from config."""
-        theme_data = Config.PHOTOSHOOT_THEMES.get(self.theme_name, {})
-        prompt_list = theme_data.get("prompts", [])
-        return [p["prompt"] for p in prompt_list]
+        theme = get_theme_catalog().get(self.theme_name)
+        return [p.base_prompt for p in theme.prompts] if theme else []
 
 
 class GeneratedImage(db.Model, TimestampMixin):
@@ -296,6 +320,8 @@ db.Index("idx_trained_models_user_id", TrainedModel.user_id)
 db.Index("idx_generation_jobs_user_id", GenerationJob.user_id)
 db.Index("idx_generation_jobs_status", GenerationJob.status)
 db.Index("idx_storage_locations_path", StorageLocation.path)
+db.Index("idx_storage_locations_checksum", StorageLocation.checksum)
+db.Index("idx_storage_locations_parent", StorageLocation.parent_id)
 db.Index("idx_generated_images_model", GeneratedImage.model_id)
 db.Index("idx_generated_images_user", GeneratedImage.user_id)
 db.Index("idx_generated_images_photobook", GeneratedImage.photobook_id)
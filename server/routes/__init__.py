@@ -6,6 +6,7 @@ from services.monitoring import StorageMonitor
 from services.credits import CreditService
 from services.auth import TokenManager
 from services.queue import JobQueue
+from services.upload_sessions import UploadSessionStore
 from services.worker import WorkerService
 from services.job_monitor import JobMonitor
 from services.alerts import AlertService
@@ -29,6 +30,7 @@ model_bp = Blueprint("model", __name__, url_prefix="/api/model")
 photoshoot_bp = Blueprint("photoshoot", __name__, url_prefix="/api/photoshoot")
 job_bp = Blueprint("job", __name__, url_prefix="/api/job")
 contact_bp = Blueprint("contact", __name__, url_prefix="/api/contact")
+files_bp = Blueprint("files", __name__, url_prefix="/api/files")
 
 
 # Service accessor functions
@@ -62,11 +64,21 @@ def get_job_queue():
     return current_app.config.get("job_queue")
 
 
+def get_upload_sessions():
+    """Get resumable upload session store from current app"""
+    return current_app.config.get("upload_sessions")
+
+
 def get_worker_service():
     """Get worker service from current app"""
     return current_app.config.get("worker_service")
 
 
+def get_prewarm_pool():
+    """Get speculative GPU launch pool from current app, None when disabled"""
+    return current_app.config.get("prewarm_pool")
+
+
 def get_job_monitor():
     """Get job monitor from current app"""
     return current_app.config.get("job_monitor")
@@ -132,8 +144,13 @@ def init_services(app):
         app.config["job_queue"] = job_queue
         logger.info("Initialized job queue")
 
+        upload_sessions = UploadSessionStore(app.config)
+        app.config["upload_sessions"] = upload_sessions
+        logger.info("Initialized upload session store")
+
         worker_service = WorkerService(app.config, app)
         app.config["worker_service"] = worker_service
+        app.config["prewarm_pool"] = worker_service.prewarm_pool
         logger.info("Initialized worker service")
 
         job_monitor = JobMonitor(app.config, job_queue)
@@ -183,6 +200,7 @@ def init_app(app):
     from .photoshoot import photoshoot_bp
     from .job import job_bp
     from .contact import contact_bp
+    from .files import files_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(user_bp)
@@ -192,4 +210,5 @@ def init_app(app):
     app.register_blueprint(photoshoot_bp)
     app.register_blueprint(job_bp)
     app.register_blueprint(contact_bp)
+    app.register_blueprint(files_bp)
     logger.info("Blueprints registered successfully")
@@ -0,0 +1,119 @@
+# server/routes/files.py
+
+from flask import request, jsonify, send_file
+from flask_cors import cross_origin
+import logging
+import time
+
+from . import files_bp
+from . import get_storage_service
+from services.storage_backends import LocalBackend
+
+logger = logging.getLogger(__name__)
+
+
+@files_bp.route("/<bucket>/<path:path>", methods=["GET"])
+@cross_origin()
+def serve_file(bucket: str, path: str):
+    """
+    Serve a file from local storage (STORAGE_BACKEND=local).
+    Access is granted by the signature in URLs made by the storage service.
+    send_file hands the open file to the server's sendfile support, or to the
+    front proxy when USE_X_SENDFILE is set.
+    """
+    backend = get_storage_service().backend
+    if not isinstance(backend, LocalBackend):
+        return jsonify({"message": "Not found"}), 404
+
+    try:
+        expires = int(request.args.get("expires", ""))
+    except ValueError:
+        return jsonify({"message": "Invalid link"}), 403
+    if not backend.verify(bucket, path, expires, request.args.get("signature", "")):
+        return jsonify({"message": "Invalid or expired link"}), 403
+
+    try:
+        file_path = backend.file_path(bucket, path)
+    except ValueError:
+        return jsonify({"message": "Not found"}), 404
+    if not file_path.is_file():
+        return jsonify({"message": "Not found"}), 404
+
+    # Public links never expire; presigned ones may be cached until they do
+    max_age = 365 * 24 * 3600 if expires == 0 else max(0, expires - int(time.time()))
+    return send_file(file_path, conditional=True, max_age=max_age)
+
+
+# Allowance for multipart boundaries and form fields around the file itself
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class LimitedStream:
+    """Read a file stream, failing as soon as it passes max_size bytes"""
+
+    def __init__(self, stream, max_size: int):
+        self.stream = stream
+        self.max_size = max_size
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise UploadTooLarge()
+        return data
+
+
+@files_bp.route("/<bucket>/<path:path>", methods=["POST"])
+@cross_origin()
+def upload_file(bucket: str, path: str):
+    """
+    Accept a form upload made with a target from the storage service, the
+    local stand-in for a presigned POST straight to object storage. The
+    signed policy in the query string and the declared body length are
+    checked before any of the body is read.
+    """
+    backend = get_storage_service().backend
+    if not isinstance(backend, LocalBackend) or bucket != backend.bucket:
+        return jsonify({"message": "Not found"}), 404
+
+    args = request.args
+    try:
+        expires = int(args.get("expires", ""))
+        max_size = int(args.get("max_size", ""))
+    except ValueError:
+        return jsonify({"message": "Invalid upload form"}), 403
+    content_type = args.get("Content-Type", "")
+    if not backend.verify_upload(
+        bucket, path, expires, max_size, content_type, args.get("signature", "")
+    ):
+        return jsonify({"message": "Invalid or expired upload form"}), 403
+
+    if request.content_length is None:
+        return jsonify({"message": "Content-Length required"}), 411
+    if request.content_length > max_size + UPLOAD_FORM_OVERHEAD:
+        return jsonify({"message": "File size not allowed"}), 413
+
+    if request.form.get("Content-Type", content_type) != content_type:
+        return jsonify({"message": "Content type does not match upload form"}), 403
+    file = request.files.get("file")
+    if not file:
+        return jsonify({"message": "No file provided"}), 400
+
+    try:
+        file_size, _ = backend.put_stream(
+            LimitedStream(file.stream, max_size), path, content_type
+        )
+    except UploadTooLarge:
+        return jsonify({"message": "File size not allowed"}), 413
+    except ValueError:
+        return jsonify({"message": "Not found"}), 404
+    if not file_size:
+        backend.delete(bucket, path)
+        return jsonify({"message": "File size not allowed"}), 413
+
+    return "", 204
@@ -3,7 +3,11 @@
 from flask import request, jsonify, current_app
 from flask_cors import cross_origin
 from werkzeug.utils import secure_filename
+from typing import Dict, Any, List, Optional
+import mimetypes
+import re
 import shutil
+import uuid
 from PIL import Image
 import logging
 
@@ -12,7 +16,15 @@ from .auth import token_required
 from app import db
 from models import TrainedModel, JobStatus, CreditType
 from services.queue import JobType
-from . import get_storage_service, get_job_queue, get_credit_service, get_temp_manager
+from services.upload_sessions import UploadSessionError
+from . import (
+    get_storage_service,
+    get_job_queue,
+    get_credit_service,
+    get_temp_manager,
+    get_prewarm_pool,
+    get_upload_sessions,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +36,17 @@ def allowed_file(filename: str, allowed_extensions: set = None) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in allowed_extensions
 
 
+def training_fields_error(name, sex, age_years, age_months) -> Optional[str]:
+    """Message for the first missing training form field, if any"""
+    if not name:
+        return "Name is required"
+    if not sex:
+        return "Sex is required"
+    if not age_years and not age_months:
+        return "Please provide either age in years or months"
+    return None
+
+
 @model_bp.route("/training", methods=["POST"])
 @cross_origin()
 @token_required
@@ -43,18 +66,18 @@ def create_model(current_user):
         age_months = data.get("ageMonths")
         sex = data.get("sex")
 
-        if not name:
-            return jsonify({"message": "Name is required"}), 400
-        if not sex:
-            return jsonify({"message": "Sex is required"}), 400
-        if not age_years and not age_months:
-            return (
-                jsonify({"message": "Please provide either age in years or months"}),
-                400,
-            )
+        error = training_fields_error(name, sex, age_years, age_months)
+        if error:
+            return jsonify({"message": error}), 400
         if not files:
             return jsonify({"message": "No files provided"}), 400
 
+        # Start a GPU launch while the images are saved and the job queued,
+        # only for requests that can become a training
+        prewarm_pool = get_prewarm_pool()
+        if prewarm_pool and current_user.has_credits(CreditType.MODEL):
+            prewarm_pool.request("training upload", key=current_user.id)
+
         # Create temporary directory for this job
         temp_dir = temp_manager.create_temp_dir()
 
@@ -149,6 +172,437 @@ def create_model(current_user):
         return jsonify({"message": f"Model creation failed: {str(e)}"}), 500
 
 
+@model_bp.route("/training/prewarm", methods=["POST"])
+@cross_origin()
+@token_required
+def prewarm_training(current_user):
+    """Hint that a training upload is about to start, e.g. when images are picked"""
+    prewarm_pool = get_prewarm_pool()
+    if not prewarm_pool:
+        return jsonify({"message": "Prewarming is disabled", "prewarming": False}), 200
+
+    if not current_user.has_credits(CreditType.MODEL):
+        return jsonify({"message": "Insufficient credits for model training"}), 403
+
+    prewarm_pool.request("client hint", key=current_user.id)
+    return jsonify({"message": "Prewarm requested", "prewarming": True}), 202
+
+
+def create_training_model(
+    current_user, name: str, age_years, age_months, sex: str, training_images: int
+) -> Optional[TrainedModel]:
+    """Charge a model credit and create the model, None without credits"""
+    with db.session.begin_nested():
+        # Check and deduct credits
+        if not get_credit_service().use_credits(current_user, CreditType.MODEL):
+            return None
+
+        model = TrainedModel(
+            user_id=current_user.id,
+            name=name,
+            version="1.0",
+            status=JobStatus.PENDING,
+            config={
+                "age_years": age_years,
+                "age_months": age_months,
+                "sex": sex,
+                "training_images": training_images,
+            },
+        )
+        db.session.add(model)
+
+    db.session.commit()
+    return model
+
+
+def enqueue_training_job(current_user, model: TrainedModel, payload: Dict[str, Any]):
+    """
+    Queue training of a created model with payload (training images and
+    temp_dir). Returns the route response.
+    """
+    job_id = get_job_queue().enqueue_job(
+        JobType.MODEL_TRAINING,
+        current_user.id,
+        {"model_id": model.id, "name": model.name, "config": model.config, **payload},
+    )
+
+    logger.info(
+        f"Queued training job {job_id} for user {current_user.id}, model {model.id}"
+    )
+
+    return (
+        jsonify(
+            {
+                "message": "Model training started successfully",
+                "model_id": model.id,
+                "job_id": job_id,
+                "training_images": model.config["training_images"],
+            }
+        ),
+        200,
+    )
+
+
+def queue_training_job(
+    current_user,
+    name: str,
+    age_years,
+    age_months,
+    sex: str,
+    payload: Dict[str, Any],
+    training_images: int,
+):
+    """
+    Charge a model credit, create the model and queue its training with
+    payload (training images and temp_dir). Returns the route response.
+    """
+    model = create_training_model(
+        current_user, name, age_years, age_months, sex, training_images
+    )
+    if not model:
+        return jsonify({"message": "Insufficient credits for model training"}), 403
+    return enqueue_training_job(current_user, model, payload)
+
+
+@model_bp.route("/training/uploads", methods=["POST"])
+@cross_origin()
+@token_required
+def create_training_upload(current_user):
+    """
+    Start a direct-to-storage training upload. Returns a presigned POST target
+    per file; once all are uploaded, call /training/finalize with upload_id.
+    """
+    files = (request.get_json(silent=True) or {}).get("files") or []
+    if not files:
+        return jsonify({"message": "No files provided"}), 400
+    if len(files) > current_app.config.get("TRAINING_UPLOAD_MAX_FILES", 50):
+        return jsonify({"message": "Too many files"}), 400
+    if not current_user.has_credits(CreditType.MODEL):
+        return jsonify({"message": "Insufficient credits for model training"}), 403
+
+    uploads = []
+    for index, file in enumerate(files):
+        filename = secure_filename(file.get("filename") or "")
+        content_type = file.get("content_type") or mimetypes.guess_type(filename)[0]
+        if not allowed_file(
+            filename, current_app.config["ALLOWED_IMAGE_EXTENSIONS"]
+        ) or not (content_type or "").startswith("image/"):
+            return jsonify({"message": "Invalid file type"}), 400
+        # Prefixed with the index so files with the same name stay apart
+        uploads.append(
+            {"filename": f"{index:03d}_{filename}", "content_type": content_type}
+        )
+
+    upload_id = uuid.uuid4().hex
+    expires_in = current_app.config.get("TRAINING_UPLOAD_EXPIRY", 3600)
+    targets = get_storage_service().create_upload_targets(
+        current_user.id,
+        upload_id,
+        uploads,
+        max_size=current_app.config.get("TRAINING_UPLOAD_MAX_BYTES", 50 * 1024**2),
+        expires_in=expires_in,
+    )
+
+    # The training follows the upload; start a GPU launch now
+    prewarm_pool = get_prewarm_pool()
+    if prewarm_pool:
+        prewarm_pool.request("training upload", key=current_user.id)
+
+    return (
+        jsonify({"upload_id": upload_id, "targets": targets, "expires_in": expires_in}),
+        200,
+    )
+
+
+@model_bp.route("/training/finalize", methods=["POST"])
+@cross_origin()
+@token_required
+def finalize_training_upload(current_user):
+    """
+    Create a model from images uploaded through /training/uploads. The files
+    are only checked to exist here; the training worker fetches and validates
+    them.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        upload_id = data.get("upload_id") or ""
+        filenames = data.get("files") or []
+        name = data.get("name")
+        age_years = data.get("ageYears")
+        age_months = data.get("ageMonths")
+        sex = data.get("sex")
+
+        error = training_fields_error(name, sex, age_years, age_months)
+        if error:
+            return jsonify({"message": error}), 400
+        if not re.fullmatch(r"[0-9a-f]{32}", upload_id):
+            return jsonify({"message": "Invalid upload id"}), 400
+        if not filenames:
+            return jsonify({"message": "No files provided"}), 400
+        for filename in filenames:
+            if secure_filename(filename) != filename or not allowed_file(
+                filename, current_app.config["ALLOWED_IMAGE_EXTENSIONS"]
+            ):
+                return jsonify({"message": "Invalid file type"}), 400
+
+        storage_service = get_storage_service()
+        paths = storage_service.upload_paths(current_user.id, upload_id, filenames)
+        missing = set(storage_service.missing_uploads(paths))
+        if missing:
+            return (
+                jsonify(
+                    {
+                        "message": "Files were not uploaded",
+                        "files": [
+                            filename
+                            for path, filename in zip(paths, filenames)
+                            if path in missing
+                        ],
+                    }
+                ),
+                400,
+            )
+
+        return queue_training_job(
+            current_user,
+            name,
+            age_years,
+            age_months,
+            sex,
+            {
+                "uploads": [
+                    {"path": path, "original_filename": filename}
+                    for path, filename in zip(paths, filenames)
+                ],
+                "temp_dir": str(get_temp_manager().create_temp_dir()),
+            },
+            training_images=len(filenames),
+        )
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Model creation error: {str(e)}")
+        return jsonify({"message": f"Model creation failed: {str(e)}"}), 500
+
+
+def owned_upload_session(session_id: str, current_user) -> Optional[Dict[str, Any]]:
+    """The caller's upload session, None if it does not exist or has expired"""
+    session = get_upload_sessions().get(session_id)
+    if not session or session["user_id"] != current_user.id:
+        return None
+    return session
+
+
+@model_bp.route("/training/sessions", methods=["POST"])
+@cross_origin()
+@token_required
+def create_upload_session(current_user):
+    """
+    Start a resumable training upload. Files ({"filename", "size", "sha256"?})
+    are then sent in chunk_size chunks to /training/sessions/<id>/files/<n>.
+    """
+    files = (request.get_json(silent=True) or {}).get("files") or []
+    if not current_user.has_credits(CreditType.MODEL):
+        return jsonify({"message": "Insufficient credits for model training"}), 403
+
+    session_files = []
+    for index, file in enumerate(files):
+        filename = secure_filename(file.get("filename") or "")
+        if not allowed_file(filename, current_app.config["ALLOWED_IMAGE_EXTENSIONS"]):
+            return jsonify({"message": "Invalid file type"}), 400
+        try:
+            size = int(file.get("size"))
+        except (TypeError, ValueError):
+            return jsonify({"message": f"Invalid size for {filename}"}), 400
+        session_files.append(
+            {
+                # Prefixed with the index so files with the same name stay apart
+                "name": f"{index:03d}_{filename}",
+                "original_filename": filename,
+                "size": size,
+                "sha256": file.get("sha256"),
+            }
+        )
+
+    temp_dir = get_temp_manager().create_temp_dir()
+    try:
+        session = get_upload_sessions().create(current_user.id, session_files, temp_dir)
+    except UploadSessionError as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return jsonify({"message": str(e)}), 400
+
+    prewarm_pool = get_prewarm_pool()
+    if prewarm_pool:
+        prewarm_pool.request("training upload", key=current_user.id)
+
+    return (
+        jsonify(
+            {
+                "session_id": session["session_id"],
+                "chunk_size": session["chunk_size"],
+                "files": [
+                    {"index": index, "filename": file["original_filename"]}
+                    for index, file in enumerate(session_files)
+                ],
+            }
+        ),
+        201,
+    )
+
+
+@model_bp.route("/training/sessions/<session_id>", methods=["GET"])
+@cross_origin()
+@token_required
+def get_upload_session(current_user, session_id: str):
+    """Chunk offsets still missing per file index, to resume an upload"""
+    session = owned_upload_session(session_id, current_user)
+    if not session:
+        return jsonify({"message": "Upload session not found"}), 404
+
+    missing = get_upload_sessions().missing_chunks(session)
+    return (
+        jsonify(
+            {
+                "session_id": session_id,
+                "chunk_size": session["chunk_size"],
+                "missing": {str(index): offsets for index, offsets in missing.items()},
+                "complete": not missing,
+            }
+        ),
+        200,
+    )
+
+
+@model_bp.route("/training/sessions/<session_id>/files/<int:index>", methods=["PUT"])
+@cross_origin()
+@token_required
+def upload_session_chunk(current_user, session_id: str, index: int):
+    """
+    Store one chunk: the raw body, at ?offset=, with its SHA256 in the
+    X-Chunk-SHA256 header. Chunks may arrive in any order and be resent.
+    """
+    session = owned_upload_session(session_id, current_user)
+    if not session:
+        return jsonify({"message": "Upload session not found"}), 404
+
+    try:
+        offset = int(request.args.get("offset", ""))
+    except ValueError:
+        return jsonify({"message": "Chunk offset is required"}), 400
+
+    try:
+        received = get_upload_sessions().write_chunk(
+            session,
+            index,
+            offset,
+            request.get_data(cache=False),
+            request.headers.get("X-Chunk-SHA256", ""),
+        )
+    except UploadSessionError as e:
+        return jsonify({"message": str(e)}), 400
+
+    return jsonify({"index": index, "offset": offset, "received": received}), 200
+
+
+@model_bp.route("/training/sessions/<session_id>", methods=["DELETE"])
+@cross_origin()
+@token_required
+def delete_upload_session(current_user, session_id: str):
+    """Abandon a resumable upload and remove what was uploaded"""
+    session = owned_upload_session(session_id, current_user)
+    if not session:
+        return jsonify({"message": "Upload session not found"}), 404
+
+    get_upload_sessions().delete(session)
+    return "", 204
+
+
+@model_bp.route("/training/sessions/<session_id>/finalize", methods=["POST"])
+@cross_origin()
+@token_required
+def finalize_upload_session(current_user, session_id: str):
+    """Create a model from a completed resumable upload"""
+    session = owned_upload_session(session_id, current_user)
+    if not session:
+        return jsonify({"message": "Upload session not found"}), 404
+
+    try:
+        data = request.get_json(silent=True) or {}
+        name = data.get("name")
+        age_years = data.get("ageYears")
+        age_months = data.get("ageMonths")
+        sex = data.get("sex")
+
+        error = training_fields_error(name, sex, age_years, age_months)
+        if error:
+            return jsonify({"message": error}), 400
+
+        # The session stays resumable until the images are valid and the
+        # credit is charged; only then does it end
+        upload_sessions = get_upload_sessions()
+        try:
+            parts = upload_sessions.verify(session)
+        except UploadSessionError as e:
+            return jsonify({"message": str(e)}), 400
+
+        # Only the headers are read here; the worker decodes every image
+        # before training and fails the job, with a refund, on a bad one
+        file_info: List[Dict[str, Any]] = []
+        final_paths = upload_sessions.final_paths(session)
+        for file, part, path in zip(session["files"], parts, final_paths):
+            try:
+                with Image.open(part) as img:
+                    file_info.append(
+                        {
+                            "path": str(path),
+                            "original_filename": file["original_filename"],
+                            "width": img.width,
+                            "height": img.height,
+                            "format": img.format,
+                        }
+                    )
+            except Exception as e:
+                return (
+                    jsonify(
+                        {
+                            "message": f"Invalid training image "
+                            f"{file['original_filename']}: {str(e)}"
+                        }
+                    ),
+                    400,
+                )
+
+        model = create_training_model(
+            current_user, name, age_years, age_months, sex, len(file_info)
+        )
+        if not model:
+            return jsonify({"message": "Insufficient credits for model training"}), 403
+
+        completed = False
+        try:
+            upload_sessions.complete(session)
+            completed = True
+            return enqueue_training_job(
+                current_user,
+                model,
+                {"file_info": file_info, "temp_dir": session["temp_dir"]},
+            )
+        except Exception:
+            # No job will train the model; once the session has ended nothing
+            # else removes its files either
+            model.status = JobStatus.FAILED
+            db.session.commit()
+            get_credit_service().refund_credits(current_user, CreditType.MODEL)
+            if completed:
+                shutil.rmtree(session["temp_dir"], ignore_errors=True)
+            raise
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Model creation error: {str(e)}")
+        return jsonify({"message": f"Model creation failed: {str(e)}"}), 500
+
+
 @model_bp.route("/<int:model_id>/cleanup", methods=["POST"])
 @token_required
 def cleanup_training_images(current_user, model_id):
@@ -161,8 +615,10 @@ def cleanup_training_images(current_user, model_id):
         return jsonify({"message": "Cannot cleanup incomplete model"}), 400
 
     storage_service = get_storage_service()
-    for image in model.training_images:
-        storage_service.delete_file(image.storage_location)
+    if not storage_service.delete_files(
+        [image.storage_location for image in model.training_images]
+    ):
+        return jsonify({"message": "Failed to clean up training images"}), 500
 
     return jsonify({"message": "Training images cleaned up"}), 200
 
@@ -1,14 +1,18 @@
 # server/routes/photoshoot.py
 
-from flask import request, jsonify
+from flask import request, jsonify, Response, current_app, stream_with_context
 from flask_cors import cross_origin
+from functools import partial
 import logging
+import mimetypes
+import re
 
 from . import photoshoot_bp
 from .auth import token_required
 from app import db
 from models import TrainedModel, PhotoBook, JobStatus, CreditType, GeneratedImage
 from . import get_storage_service
+from services.zip_export import stream_zip
 
 logger = logging.getLogger(__name__)
 
@@ -102,13 +106,28 @@ def get_photobook_images(current_user, photobook_id: int):
 
         storage_service = get_storage_service()
 
-        # Build array of presigned URLs
-        images = []
-        for img in photobook.images:
-            presigned_url = storage_service.get_download_url(
-                img.storage_location, expires_in=3600  # 1 hour (adjust as needed)
-            )
-            images.append({"id": img.id, "url": presigned_url, "prompt": img.prompt})
+        # Presigned URLs for every image and its derivatives at once,
+        # mostly served from cache
+        photobook_images = list(photobook.images)
+        locations = []
+        for img in photobook_images:
+            locations.append(img.storage_location)
+            locations.extend(img.storage_location.derivatives)
+        urls = storage_service.get_download_urls(
+            locations, expires_in=3600  # 1 hour (adjust as needed)
+        )
+        images = [
+            {
+                "id": img.id,
+                "url": urls[img.storage_location.id],
+                "variants": {
+                    derivative.variant: urls[derivative.id]
+                    for derivative in img.storage_location.derivatives
+                },
+                "prompt": img.prompt,
+            }
+            for img in photobook_images
+        ]
 
         return (
             jsonify(
@@ -126,6 +145,56 @@ def get_photobook_images(current_user, photobook_id: int):
         return jsonify({"message": str(e)}), 500
 
 
+@photoshoot_bp.route("/photobooks/<int:photobook_id>/export", methods=["GET"])
+@cross_origin()
+@token_required
+def export_photobook(current_user, photobook_id: int):
+    """
+    Download every image of a COMPLETED & unlocked photobook as one ZIP,
+    streamed as it is built so nothing is buffered on disk or in memory.
+    """
+    try:
+        photobook = PhotoBook.query.get_or_404(photobook_id)
+
+        # Ensure ownership
+        if photobook.user_id != current_user.id:
+            return jsonify({"message": "Unauthorized"}), 403
+
+        # Ensure photobook is completed/unlocked
+        if photobook.status != JobStatus.COMPLETED or not photobook.is_unlocked:
+            return jsonify({"message": "Photobook not available"}), 403
+
+        storage_service = get_storage_service()
+        folder = re.sub(r"[^A-Za-z0-9_\- ]+", "", photobook.name or "").strip() or (
+            f"photobook_{photobook_id}"
+        )
+
+        entries = []
+        for number, img in enumerate(photobook.images, start=1):
+            location = img.storage_location
+            extension = mimetypes.guess_extension(location.content_type or "") or ""
+            entries.append(
+                (
+                    f"{folder}/image_{number:02d}{extension}",
+                    partial(storage_service.stream_file, location),
+                    img.created_at.timetuple()[:6] if img.created_at else None,
+                )
+            )
+
+        archive = stream_zip(
+            entries, prefetch=current_app.config.get("EXPORT_PREFETCH", 4)
+        )
+        return Response(
+            stream_with_context(archive),
+            mimetype="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="{folder}.zip"'},
+        )
+
+    except Exception as e:
+        logger.error(f"Error exporting photobook {photobook_id}: {str(e)}")
+        return jsonify({"message": str(e)}), 500
+
+
 @photoshoot_bp.route("/photobooks/<int:photobook_id>/unlock", methods=["POST"])
 @cross_origin()
 @token_required
@@ -181,18 +250,14 @@ def delete_photobook(current_user, photobook_id: int):
         # Retrieve and cache the storage locations for each image.
         image_storage_locations = [img.storage_location for img in photobook.images]
 
-        # Delete all associated generated image records.
+        # Delete the image records and the photobook, then the files in bulk;
+        # delete_files commits all of it as one transaction.
         for image in list(photobook.images):
             db.session.delete(image)
-        db.session.commit()
-
-        # Now delete each storage location from storage and the DB.
-        for location in image_storage_locations:
-            storage_service.delete_file(location)
-
-        # Finally, delete the photobook record.
         db.session.delete(photobook)
-        db.session.commit()
+
+        if not storage_service.delete_files(image_storage_locations):
+            return jsonify({"message": "Failed to delete photobook"}), 500
 
         return jsonify({"message": "Photobook deleted successfully"}), 200
     except Exception as e:
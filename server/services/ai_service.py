@@ -1,61 +1,94 @@
 # server/services/ai_service.py
 
+import hashlib
 import json
 import logging
-import requests
+import os
+import re
 import time
+import threading
 import concurrent.futures
-from pathlib import Path
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath
+from queue import Queue, Empty
 import shutil
-from typing import Dict, Any, List, Optional, Tuple
+import shlex
+import tarfile
+from typing import Dict, Any, List, Optional, Tuple, Callable, Iterator
 import subprocess
 
+from .compute import (
+    ComputeBackend,
+    ComputeInstance,
+    create_compute_backend,
+    gpu_count_for_type,
+)
+from .image_preprocessing import ImagePreprocessor
+from .lambda_client import (
+    LambdaAPIException,
+    LambdaHTTPError,
+    LambdaTimeout,
+    get_instance_watcher,
+    get_lambda_client,
+)
+from .theme_catalog import get_theme_catalog
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-class LambdaAPIException(Exception):
-    """Custom exception for Lambda API errors."""
+# Marker for machine-readable status lines printed by remote commands
+STATUS_MARKER = "##PBAI_STATUS##"
+
+# tqdm-style progress, e.g. "model_1:  45%|####5  | 450/1000 [05:00<06:00, ...]"
+PROGRESS_PATTERN = re.compile(r"(\d+)/(\d+) \[")
+LOSS_PATTERN = re.compile(r"loss:\s*([0-9.]+(?:e[+-]?\d+)?)", re.IGNORECASE)
+
+# Installed on top of the toolkit's requirements for initial photobooks
+GENERATION_PACKAGES = "transformers accelerate peft diffusers safetensors"
+
+# Bump to rebuild every cached environment, e.g. after changing how they are built
+ENV_CACHE_VERSION = 1
+
+
+class RemoteCommandError(LambdaAPIException):
+    """Remote command finished without reporting success."""
+
+    def __init__(self, message: str, exit_code: Optional[int] = None, output: str = ""):
+        super().__init__(message)
+        self.exit_code = exit_code
+        self.output = output
+
+
+class RemoteCommandTimeout(RemoteCommandError):
+    """Remote command went silent or ran past its time budget."""
 
     pass
 
 
-class LambdaInstance:
-    def __init__(self, instance_id: str, config: Dict[str, Any]):
+class LambdaInstance(ComputeInstance):
+    def __init__(
+        self,
+        instance_id: str,
+        config: Dict[str, Any],
+        instance_type: Optional[str] = None,
+    ):
         self.instance_id = instance_id
         self.config = config
-        self.api_key = config["LAMBDA_API_KEY"]
-        self.base_url = "https://cloud.lambdalabs.com/api/v1"
+        self.instance_type = instance_type
+        self.gpu_count = gpu_count_for_type(instance_type)
+        self.client = get_lambda_client(config)
+        self.watcher = get_instance_watcher(config)
         self.instance_ip = None
         self.ssh_key_path = config["LAMBDA_SSH_KEY_PATH"]
 
     def _make_request(
         self, method: str, endpoint: str, data: Optional[Dict] = None
     ) -> Dict:
-        """Make request to Lambda API with better error handling."""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
-
-        url = f"{self.base_url}/{endpoint}"
-        try:
-            response = requests.request(
-                method=method,
-                url=url,
-                headers=headers,
-                json=data,
-                timeout=30,  # Add timeout
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.Timeout:
-            logger.error("Lambda API request timed out")
-            raise LambdaAPIException("Request timed out")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Lambda API request failed: {str(e)}")
-            raise LambdaAPIException(f"Request failed: {str(e)}")
+        """Make request to Lambda API through the shared client."""
+        return self.client.request(method, endpoint, data)
 
     def get_instance_details(self) -> Dict[str, Any]:
         """Get instance details with retries."""
@@ -68,19 +101,30 @@ class LambdaInstance:
                     raise
                 time.sleep(2**attempt)  # Exponential backoff
 
+    def _ssh_options(self) -> List[str]:
+        """Common options for non-interactive SSH/SCP connections."""
+        return [
+            "-i",
+            self.ssh_key_path,
+            "-o",
+            "StrictHostKeyChecking=no",
+            "-o",
+            "UserKnownHostsFile=/dev/null",
+            "-o",
+            "ConnectTimeout=30",
+            "-o",
+            "ServerAliveInterval=30",
+            "-o",
+            "ServerAliveCountMax=4",
+        ]
+
     def upload_file_scp(self, local_path: str, remote_path: str):
         """Upload file to instance using SCP."""
         instance_ip = self.instance_ip
-        ssh_key = self.ssh_key_path
         try:
             scp_command = [
                 "scp",
-                "-i",
-                ssh_key,
-                "-o",
-                "StrictHostKeyChecking=no",
-                "-o",
-                "UserKnownHostsFile=/dev/null",
+                *self._ssh_options(),
                 local_path,
                 f"ubuntu@{instance_ip}:{remote_path}",
             ]
@@ -94,16 +138,10 @@ class LambdaInstance:
     def download_file_scp(self, remote_path: str, local_path: str):
         """Download file from instance using SCP."""
         instance_ip = self.instance_ip
-        ssh_key = self.ssh_key_path
         try:
             scp_command = [
                 "scp",
-                "-i",
-                ssh_key,
-                "-o",
-                "StrictHostKeyChecking=no",
-                "-o",
-                "UserKnownHostsFile=/dev/null",
+                *self._ssh_options(),
                 f"ubuntu@{instance_ip}:{remote_path}",
                 local_path,
             ]
@@ -114,77 +152,252 @@ class LambdaInstance:
             logger.error(f"SCP download failed: {e}")
             raise LambdaAPIException(f"SCP download failed: {e}") from e
 
-    def execute_command_ssh(self, command: str) -> str:
-        """Execute command on instance via SSH."""
-        instance_ip = self.instance_ip
-        ssh_key = self.ssh_key_path
+    def download_dir_stream(
+        self,
+        remote_dir: str,
+        local_dir: Path,
+        on_file: Optional[Callable[[Path], None]] = None,
+    ) -> List[Path]:
+        """
+        Pull a whole remote directory as a single tar stream over SSH.
+
+        Files are unpacked as they arrive and handed to on_file one by one,
+        so callers can start processing the first files while the rest of
+        the archive is still in flight.
+        """
+        local_dir = Path(local_dir)
+        local_dir.mkdir(parents=True, exist_ok=True)
+        ssh_command = [
+            "ssh",
+            *self._ssh_options(),
+            f"ubuntu@{self.instance_ip}",
+            f"tar -C {shlex.quote(remote_dir)} -cf - .",
+        ]
+
+        logger.info(f"Streaming {remote_dir} from {self.instance_ip} to {local_dir}")
+        local_paths: List[Path] = []
+        process = subprocess.Popen(
+            ssh_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
         try:
-            ssh_command = [
-                "ssh",
-                "-i",
-                ssh_key,
-                "-o",
-                "StrictHostKeyChecking=no",
-                "-o",
-                "UserKnownHostsFile=/dev/null",
-                f"ubuntu@{instance_ip}",
-                command,
-            ]
-            logger.info(f"Executing command on {instance_ip}: {command}")
-            result = subprocess.run(
-                ssh_command,
-                check=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                shell=False,
-            )
-            logger.debug(f"Command output: {result.stdout}")
-            if result.stderr:
-                logger.warning(f"Command stderr: {result.stderr}")
-            return result.stdout
-        except subprocess.CalledProcessError as e:
-            logger.error(f"SSH command failed: {e.stderr}")
-            raise LambdaAPIException(f"SSH command failed: {e.stderr}") from e
+            with tarfile.open(fileobj=process.stdout, mode="r|") as archive:
+                for member in archive:
+                    if not member.isfile():
+                        continue
 
-    def wait_for_completion(self, timeout: int = 3600):
-        """Wait for instance to be ready with improved status checking."""
-        logger.info(f"Waiting for instance {self.instance_id} to become active")
-        start_time = time.time()
+                    # Never write outside local_dir, whatever the archive says
+                    relative = PurePosixPath(member.name)
+                    if relative.is_absolute() or ".." in relative.parts:
+                        logger.warning(f"Skipping unsafe archive entry {member.name}")
+                        continue
 
-        while time.time() - start_time < timeout:
-            try:
-                status_response = self.get_instance_details()
-                current_status = (
-                    status_response.get("data", {}).get("status", "").strip().lower()
-                )
+                    target = local_dir.joinpath(*relative.parts)
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    partial = target.with_name(f".{target.name}.part")
+                    with archive.extractfile(member) as src, open(partial, "wb") as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+                    partial.replace(target)
+
+                    local_paths.append(target)
+                    if on_file:
+                        on_file(target)
+
+            stderr = process.stderr.read().decode(errors="replace")
+            if process.wait() != 0:
+                raise LambdaAPIException(f"Directory download failed: {stderr}")
+        except tarfile.TarError as e:
+            process.kill()
+            raise LambdaAPIException(f"Directory download failed: {e}") from e
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+        logger.info(f"Downloaded {len(local_paths)} files from {remote_dir}")
+        return local_paths
+
+    @staticmethod
+    def _pump_output(stream, lines: Queue):
+        """Split raw command output into lines on newlines and carriage returns."""
+        pending = b""
+        try:
+            for chunk in iter(lambda: os.read(stream.fileno(), 65536), b""):
+                pending += chunk
+                *complete, pending = re.split(rb"[\r\n]", pending)
+                for line in complete:
+                    if line:
+                        lines.put(line.decode(errors="replace"))
+            if pending:
+                lines.put(pending.decode(errors="replace"))
+        finally:
+            lines.put(None)
 
-                if current_status == "active":
-                    self.instance_ip = status_response.get("data", {}).get("ip")
-                    if not self.instance_ip:
-                        raise LambdaAPIException("Instance IP not found")
-                    logger.info(
-                        f"Instance {self.instance_id} is active at {self.instance_ip}"
+    def stream_command_ssh(
+        self,
+        command: str,
+        idle_timeout: Optional[float] = None,
+        total_timeout: Optional[float] = None,
+    ) -> Iterator[str]:
+        """
+        Execute command on instance via SSH, yielding output lines as they arrive.
+
+        The command is wrapped so that it always ends with a status line carrying
+        its exit code. The process is killed and RemoteCommandTimeout raised if no
+        output arrives for idle_timeout seconds or the command runs longer than
+        total_timeout seconds; RemoteCommandError is raised on a non-zero exit.
+        """
+        wrapped = (
+            f"{command.rstrip()}\n"
+            f'__rc=$?; printf \'{STATUS_MARKER} {{"exit_code": %d}}\\n\' "$__rc"; '
+            f"exit $__rc"
+        )
+        ssh_command = [
+            "ssh",
+            *self._ssh_options(),
+            f"ubuntu@{self.instance_ip}",
+            wrapped,
+        ]
+
+        logger.info(f"Executing command on {self.instance_ip}: {command}")
+        process = subprocess.Popen(
+            ssh_command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        lines: Queue = Queue()
+        reader = threading.Thread(
+            target=self._pump_output, args=(process.stdout, lines), daemon=True
+        )
+        reader.start()
+        started = time.monotonic()
+
+        try:
+            while True:
+                wait_for = idle_timeout
+                if total_timeout is not None:
+                    remaining = total_timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        raise RemoteCommandTimeout(
+                            f"Command exceeded total timeout of {total_timeout}s"
+                        )
+                    wait_for = (
+                        remaining if wait_for is None else min(wait_for, remaining)
                     )
-                    return
-                elif current_status in ["error", "failed", "terminated"]:
-                    raise LambdaAPIException(
-                        f"Instance failed with status: {current_status}"
+
+                try:
+                    line = lines.get(timeout=wait_for)
+                except Empty:
+                    elapsed = time.monotonic() - started
+                    if total_timeout is not None and elapsed >= total_timeout:
+                        raise RemoteCommandTimeout(
+                            f"Command exceeded total timeout of {total_timeout}s"
+                        )
+                    raise RemoteCommandTimeout(
+                        f"Command produced no output for {idle_timeout}s"
                     )
 
-                time.sleep(5)
-            except LambdaAPIException as e:
-                logger.error(f"Error checking instance status: {str(e)}")
-                raise
+                if line is None:
+                    break
+                yield line
+
+            exit_code = process.wait()
+            if exit_code != 0:
+                raise RemoteCommandError(
+                    f"Command exited with code {exit_code}", exit_code=exit_code
+                )
+        finally:
+            if process.poll() is None:
+                logger.warning(f"Killing remote command on {self.instance_ip}")
+                process.kill()
+                process.wait()
+            reader.join(timeout=5)
+
+    def run_command_ssh(
+        self,
+        command: str,
+        idle_timeout: Optional[float] = None,
+        total_timeout: Optional[float] = None,
+        on_line: Optional[Callable[[str], None]] = None,
+        keep_output: bool = True,
+    ) -> Dict[str, Any]:
+        """
+        Run a remote command to completion and check its reported status.
 
-        raise LambdaAPIException("Instance startup timeout")
+        Returns a dict with the command output, its exit code and any status
+        payloads the command printed. Success requires both a zero exit code
+        and the trailing status line; a dropped connection that never delivers
+        the status line is treated as a failure. With keep_output=False only
+        the last lines are kept, for chatty long-running commands.
+        """
+        output = deque(maxlen=None if keep_output else 200)
+        statuses: List[Dict[str, Any]] = []
 
+        try:
+            for line in self.stream_command_ssh(command, idle_timeout, total_timeout):
+                if line.startswith(STATUS_MARKER):
+                    try:
+                        statuses.append(json.loads(line[len(STATUS_MARKER) :]))
+                    except ValueError:
+                        logger.warning(f"Unparseable status line: {line}")
+                    continue
+
+                output.append(line)
+                if on_line:
+                    on_line(line)
+        except RemoteCommandError as e:
+            e.output = "\n".join(output)
+            logger.error(f"SSH command failed: {str(e)}\n{e.output[-2000:]}")
+            raise
+
+        final = next((st for st in reversed(statuses) if "exit_code" in st), None)
+        if final is None or final["exit_code"] != 0:
+            raise RemoteCommandError(
+                "Command finished without a success status",
+                exit_code=final["exit_code"] if final else None,
+                output="\n".join(output),
+            )
+
+        result = "\n".join(output)
+        logger.debug(f"Command output: {result}")
+        return {"output": result, "exit_code": 0, "status": statuses}
+
+    def execute_command_ssh(
+        self,
+        command: str,
+        idle_timeout: Optional[float] = 300,
+        total_timeout: Optional[float] = 1800,
+    ) -> str:
+        """Execute command on instance via SSH and return its output."""
+        return self.run_command_ssh(command, idle_timeout, total_timeout)["output"]
+
+    # ComputeInstance interface
+    run_command = run_command_ssh
+    execute_command = execute_command_ssh
+    upload_file = upload_file_scp
+    download_file = download_file_scp
+    download_dir = download_dir_stream
+
+    def wait_for_completion(self, timeout: int = 3600):
+        """Wait for instance to be ready, via the shared instance watcher."""
+        logger.info(f"Waiting for instance {self.instance_id} to become active")
+        # The watcher fails the future at the deadline; the margin only guards
+        # against a watcher that stops resolving altogether
+        try:
+            data = self.watcher.watch(self.instance_id, timeout).result(
+                timeout=timeout + self.watcher.slow_interval * 2
+            )
+        except concurrent.futures.TimeoutError:
+            raise LambdaAPIException("Instance startup timeout")
+        self.instance_ip = data["ip"]
+
+
+class LambdaBackend(ComputeBackend):
+    """Lambda Cloud GPU instances driven over SSH/SCP"""
 
-class AIService:
     def __init__(self, config: Dict[str, Any]):
         self.config = config
-        self.base_url = "https://cloud.lambdalabs.com/api/v1"
-        self.api_key = config["LAMBDA_API_KEY"]
+        self.client = get_lambda_client(config)
 
         # Region and instance configuration
         self.regions = (
@@ -198,33 +411,49 @@ class AIService:
             else config["LAMBDA_INSTANCE_TYPES"].split(",")
         )
 
-        # Local paths
-        self.base_path = Path("/tmp/ai_training")
-        self.datasets_path = self.base_path / "datasets"
-        self.datasets_path.mkdir(parents=True, exist_ok=True)
-
-        # Remote paths
-        self.remote_base = "/home/ubuntu"
-        self.remote_workspace = f"{self.remote_base}/ai-toolkit"
-
-    def launch_instance(self) -> LambdaInstance:
+    def _launch_payload(self, instance_type: str, region: str) -> Dict[str, Any]:
+        """Launch request body, attaching the region's cache filesystem if any"""
+        payload = {
+            "region_name": region,
+            "instance_type_name": instance_type,
+            "quantity": 1,
+            "ssh_key_names": [self.config["LAMBDA_SSH_KEY_NAME"]],
+        }
+        file_system = (self.config.get("LAMBDA_FILE_SYSTEMS") or {}).get(region)
+        if file_system:
+            payload["file_system_names"] = [file_system]
+        if self.config.get("LAMBDA_IMAGE_ID"):
+            payload["image"] = {"id": self.config["LAMBDA_IMAGE_ID"]}
+        return payload
+
+    def _env_cache_dir(self, region: str) -> Optional[str]:
+        """Environment cache on an instance launched in region, if it has one"""
+        file_system = (self.config.get("LAMBDA_FILE_SYSTEMS") or {}).get(region)
+        if file_system:
+            mount = self.config.get("LAMBDA_FILE_SYSTEM_MOUNT", "/lambda/nfs")
+            return f"{mount}/{file_system}/photobook-env-cache"
+        return self.config.get("LAMBDA_ENV_CACHE_DIR")
+
+    def launch(self, max_passes: Optional[int] = None) -> LambdaInstance:
         """
         Launch an instance by:
         1) Iterating over each instance_type in self.instance_types (in order).
         2) For each instance_type, iterating over self.regions (in order).
         3) For each attempt, sleep 2 seconds to avoid rapid-fire calls.
-        4) If a 429 Too Many Requests error occurs, wait 20 seconds then continue.
+        4) If a 429 Too Many Requests error outlasts the client's retries, continue; the
+            shared rate limiter keeps every worker backed off meanwhile.
         5) If an insufficient capacity error is encountered (error code contains "insufficient-capacity"),
             log it and continue to the next region.
         6) All other errors are logged and recorded.
-        7) If no instance is launched after trying every combination, wait 10 minutes and restart the loop.
+        7) If no instance is launched after trying every combination, wait 10 minutes and restart the loop,
+            or raise LambdaAPIException once max_passes passes have failed.
 
         Returns:
             LambdaInstance: The instance object once successfully launched (i.e. "active").
         """
         short_sleep_per_attempt = 1
-        retry_on_429_seconds = 20
         big_wait_no_capacity_seconds = 600
+        passes = 0
 
         while True:
             all_errors = []  # Track errors across attempts
@@ -235,23 +464,10 @@ class AIService:
                     time.sleep(short_sleep_per_attempt)  # Sleep between each try
 
                     try:
-                        response = requests.post(
-                            f"{self.base_url}/instance-operations/launch",
-                            headers={"Authorization": f"Bearer {self.api_key}"},
-                            json={
-                                "region_name": region,
-                                "instance_type_name": instance_type,
-                                "quantity": 1,
-                                "ssh_key_names": [self.config["LAMBDA_SSH_KEY_NAME"]],
-                            },
-                            timeout=30,
+                        resp_json = self.client.post(
+                            "instance-operations/launch",
+                            self._launch_payload(instance_type, region),
                         )
-                        # If response has error status, raise an HTTPError
-                        if response.status_code >= 400:
-                            response.raise_for_status()
-
-                        # Successful response
-                        resp_json = response.json()
                         instance_ids = resp_json.get("data", {}).get("instance_ids", [])
                         if not instance_ids:
                             raise LambdaAPIException(
@@ -259,24 +475,23 @@ class AIService:
                             )
 
                         instance_id = instance_ids[0]
-                        instance = LambdaInstance(instance_id, self.config)
+                        instance = LambdaInstance(
+                            instance_id, self.config, instance_type
+                        )
+                        instance.env_cache_dir = self._env_cache_dir(region)
                         instance.wait_for_completion()
                         logger.info(
                             f"Successfully launched {instance_type} in {region} with ID={instance_id}"
                         )
                         return instance
 
-                    except requests.exceptions.HTTPError as http_err:
-                        status_code = http_err.response.status_code
-                        try:
-                            err_json = http_err.response.json()
-                        except Exception:
-                            err_json = {}
+                    except LambdaHTTPError as http_err:
+                        status_code = http_err.status_code
 
                         if status_code == 400:
                             # Expecting error JSON like: {"error": {"code": "instance-operations/launch/insufficient-capacity", ...}}
-                            error_data = err_json.get("error", {})
-                            error_code = error_data.get("code", "")
+                            error_data = http_err.error
+                            error_code = http_err.code
                             if "insufficient-capacity" in error_code:
                                 logger.warning(
                                     f"Capacity error in {region} for {instance_type}: API error: {error_data}"
@@ -312,12 +527,11 @@ class AIService:
 
                         elif status_code == 429:
                             logger.warning(
-                                f"Got 429 Too Many Requests for {instance_type} in {region}. Sleeping {retry_on_429_seconds}s."
+                                f"Got 429 Too Many Requests for {instance_type} in {region}."
                             )
                             all_errors.append(
                                 f"{instance_type} in {region}: 429 Too Many Requests"
                             )
-                            time.sleep(retry_on_429_seconds)
                             # Continue to try other regions/instance types.
                             continue
 
@@ -330,22 +544,13 @@ class AIService:
                             )
                             continue
 
-                    except requests.exceptions.Timeout:
+                    except LambdaTimeout:
                         logger.warning(
                             f"Request timed out for {instance_type} in {region}."
                         )
                         all_errors.append(f"{instance_type} in {region}: Timeout")
                         continue
 
-                    except requests.exceptions.RequestException as rex:
-                        logger.error(
-                            f"RequestException for {instance_type} in {region}: {rex}"
-                        )
-                        all_errors.append(
-                            f"{instance_type} in {region}: RequestException {rex}"
-                        )
-                        continue
-
                     except LambdaAPIException as lae:
                         logger.warning(
                             f"LambdaAPIException for {instance_type} in {region}: {lae}"
@@ -365,27 +570,218 @@ class AIService:
                         )
                         continue
 
+            passes += 1
+            if max_passes is not None and passes >= max_passes:
+                raise LambdaAPIException(
+                    f"Failed to launch instance in {passes} passes. Errors: {all_errors}"
+                )
+
             logger.error(
                 f"Failed to launch instance with any configuration in this pass. "
                 f"Errors: {all_errors}. Sleeping {big_wait_no_capacity_seconds}s then retrying."
             )
             time.sleep(big_wait_no_capacity_seconds)
 
-    def _setup_training_environment(self, instance: LambdaInstance):
+    def terminate(self, instance: ComputeInstance):
+        """Terminate a Lambda instance"""
+        logger.info(f"Terminating instance {instance.instance_id}")
+        self.client.post(
+            "instance-operations/terminate",
+            {"instance_ids": [instance.instance_id]},
+            timeout=self.config.get("LAMBDA_TERMINATE_TIMEOUT", 30),
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lambda API latency and error counts per endpoint"""
+        return {
+            "lambda_api": self.client.get_stats(),
+            "instance_watcher": get_instance_watcher(self.config).get_stats(),
+        }
+
+
+class AIService:
+    def __init__(
+        self, config: Dict[str, Any], backend: Optional[ComputeBackend] = None
+    ):
+        self.config = config
+
+        # GPU provider (Lambda Cloud unless COMPUTE_BACKEND says otherwise)
+        self.backend = backend or create_compute_backend(config)
+
+        # Training images are normalized on the worker before upload
+        self.preprocessor = ImagePreprocessor(config)
+        self.theme_catalog = get_theme_catalog(config["PHOTOSHOOT_THEMES"])
+
+        # Local paths
+        self.base_path = Path("/tmp/ai_training")
+        self.datasets_path = self.base_path / "datasets"
+        self.datasets_path.mkdir(parents=True, exist_ok=True)
+
+        # Remote paths
+        self.remote_base = "/home/ubuntu"
+        self.remote_workspace = f"{self.remote_base}/ai-toolkit"
+        # Exports for training and generation written by the setup command
+        self.remote_env_file = f"{self.remote_base}/.photobook_env"
+
+        # Toolkit checkout; AI_TOOLKIT_REF pins a branch, tag or commit
+        self.toolkit_repo = config.get(
+            "AI_TOOLKIT_REPO", "https://github.com/amanzoni1/ai-toolkit.git"
+        )
+        self.toolkit_ref = config.get("AI_TOOLKIT_REF") or "HEAD"
+
+    def launch_instance(self) -> ComputeInstance:
+        """Launch an instance on the configured compute backend"""
+        return self.backend.launch()
+
+    # Remote commands, shared with the asyncio engine
+
+    def env_fingerprint(self) -> str:
+        """
+        Digest of everything a cached environment is built from on the worker
+        side. The setup command mixes in the toolkit commit the ref resolves
+        to and the instance's Python, so moving the ref rebuilds the cache.
+        """
+        spec = json.dumps(
+            [
+                ENV_CACHE_VERSION,
+                self.toolkit_repo,
+                self.toolkit_ref,
+                GENERATION_PACKAGES,
+                self.config.get("LAMBDA_IMAGE_ID"),
+            ]
+        )
+        return hashlib.sha256(spec.encode()).hexdigest()[:16]
+
+    def _training_setup_command(self, cache_dir: Optional[str] = None) -> str:
+        """
+        Check out the toolkit and install its environment.
+
+        With a cache_dir the checkout and venv (including the generation
+        packages) are built once per fingerprint under cache_dir/envs, under
+        a file lock so instances sharing a filesystem build it only once,
+        and later launches just copy the checkout and link the venv. The pip
+        and Hugging Face caches live there too, so the base model is
+        downloaded once.
+        """
+        if not cache_dir:
+            return f"""
+        : > {self.remote_env_file} && \
+        cd {self.remote_base} && \
+        git clone {self.toolkit_repo} && \
+        cd ai-toolkit && \
+        git checkout {self.toolkit_ref} && \
+        git submodule update --init --recursive && \
+        python3 -m venv --system-site-packages venv && \
+        source venv/bin/activate && \
+        pip install -r requirements.txt
+        """
+
+        return f"""
+        CACHE={shlex.quote(cache_dir)} && \
+        export PIP_CACHE_DIR=$CACHE/pip HF_HOME=$CACHE/huggingface && \
+        mkdir -p $CACHE/envs $PIP_CACHE_DIR $HF_HOME && \
+        COMMIT=$(git ls-remote {self.toolkit_repo} {self.toolkit_ref} | head -n1 | cut -f1) && \
+        FINGERPRINT=$(echo "{self.env_fingerprint()} $COMMIT $(python3 -V)" | sha256sum | cut -c1-16) && \
+        ENV_DIR=$CACHE/envs/$FINGERPRINT && \
+        (
+            flock 9 && \
+            if [ ! -f $ENV_DIR/.ready ]; then
+                echo "Building environment $FINGERPRINT" && \
+                rm -rf $ENV_DIR && \
+                git clone {self.toolkit_repo} $ENV_DIR/src && \
+                cd $ENV_DIR/src && \
+                git checkout ${{COMMIT:-{self.toolkit_ref}}} && \
+                git submodule update --init --recursive && \
+                python3 -m venv --system-site-packages $ENV_DIR/venv && \
+                source $ENV_DIR/venv/bin/activate && \
+                pip install -r requirements.txt {GENERATION_PACKAGES} && \
+                touch $ENV_DIR/.ready
+            fi
+        ) 9>$CACHE/envs/$FINGERPRINT.lock && \
+        rm -rf {self.remote_workspace} && \
+        cp -a $ENV_DIR/src {self.remote_workspace} && \
+        ln -sfn $ENV_DIR/venv {self.remote_workspace}/venv && \
+        echo "export PIP_CACHE_DIR=$PIP_CACHE_DIR HF_HOME=$HF_HOME" > {self.remote_env_file} && \
+        echo "Using environment $FINGERPRINT"
+        """
+
+    def _generation_setup_command(self, cache_dir: Optional[str] = None) -> str:
+        """Install the generation packages, already in a cached environment"""
+        if cache_dir:
+            return f"""
+        cd {self.remote_workspace} && \
+        source venv/bin/activate && \
+        python -c "import transformers, accelerate, peft, diffusers, safetensors"
+        """
+
+        return f"""
+        cd {self.remote_workspace} && \
+        source venv/bin/activate && \
+        pip install --no-cache-dir {GENERATION_PACKAGES}
+        """
+
+    def _training_config_command(
+        self, model_name: str, remote_config: str, remote_dataset_path: str
+    ) -> str:
+        """Write a job's copy of base_training_short.yaml"""
+        return f"""
+        cd {self.remote_workspace} && \
+        mkdir -p configs {remote_dataset_path} && \
+        sed -e 's/name: ".*"/name: "{model_name}"/' \
+            -e 's#folder_path: ".*"#folder_path: "{remote_dataset_path}"#' \
+            base_training_short.yaml > {remote_config}
+        """
+
+    def _training_command(self, remote_config: str, gpu: Optional[int] = None) -> str:
+        return f"""
+        cd {self.remote_workspace} && \
+        source venv/bin/activate && \
+        source {self.remote_env_file} && \
+        {self._gpu_env(gpu)}export HF_TOKEN='{self.config["HF_TOKEN"]}' && \
+        python run.py {remote_config}
+        """
+
+    def _generation_command(
+        self,
+        remote_manifest: str,
+        model_path: str,
+        manifest: Dict[str, Any],
+        gpu: Optional[int] = None,
+    ) -> str:
+        """
+        Run generate_batch.py over the whole manifest. Toolkit checkouts whose
+        script predates MANIFEST_PATH still get one run per theme with the
+        PROMPTS/OUTPUT_DIR variables they expect.
+        """
+        per_theme = " && ".join(
+            f"PROMPTS={shlex.quote(json.dumps(theme['prompts']))} "
+            f"OUTPUT_DIR={shlex.quote(theme['output_dir'])} "
+            "python generation/generate_batch.py"
+            for theme in manifest["themes"]
+        )
+        return f"""
+        cd {self.remote_workspace} && \
+        source venv/bin/activate && \
+        source {self.remote_env_file} && \
+        {self._gpu_env(gpu)}export HF_TOKEN='{self.config["HF_TOKEN"]}' && \
+        export MANIFEST_PATH="{remote_manifest}" && \
+        export MODEL_PATH="{model_path}" && \
+        if grep -q MANIFEST_PATH generation/generate_batch.py; then \
+            python generation/generate_batch.py; \
+        else \
+            {per_theme or "true"}; \
+        fi
+        """
+
+    def _setup_training_environment(self, instance: ComputeInstance):
         """Setup training environment with the specified steps."""
         try:
-            # Commands to execute on the instance
-            setup_commands = f"""
-            cd {self.remote_base} && \
-            git clone https://github.com/amanzoni1/ai-toolkit.git && \
-            cd ai-toolkit && \
-            git submodule update --init --recursive && \
-            python3 -m venv --system-site-packages venv && \
-            source venv/bin/activate && \
-            pip install -r requirements.txt
-            """
             logger.info("Executing setup commands on the instance...")
-            command_result = instance.execute_command_ssh(setup_commands)
+            command_result = instance.execute_command(
+                self._training_setup_command(instance.env_cache_dir),
+                idle_timeout=self.config.get("REMOTE_SETUP_IDLE_TIMEOUT", 600),
+                total_timeout=self.config.get("REMOTE_SETUP_TIMEOUT", 1800),
+            )
             logger.debug(f"Setup command output: {command_result}")
             logger.info("Environment setup completed successfully.")
         except LambdaAPIException as e:
@@ -395,17 +791,15 @@ class AIService:
             logger.error(f"Environment setup failed: {str(e)}")
             raise
 
-    def _setup_generation_environment(self, instance: LambdaInstance):
+    def _setup_generation_environment(self, instance: ComputeInstance):
         """Setup generation environment"""
         try:
-            setup_commands = f"""
-            cd {self.remote_workspace} && \
-            source venv/bin/activate && \
-            pip install --no-cache-dir transformers accelerate peft diffusers safetensors
-            """
-
             logger.info("Setting up generation environment...")
-            command_result = instance.execute_command_ssh(setup_commands)
+            command_result = instance.execute_command(
+                self._generation_setup_command(instance.env_cache_dir),
+                idle_timeout=self.config.get("REMOTE_SETUP_IDLE_TIMEOUT", 600),
+                total_timeout=self.config.get("REMOTE_SETUP_TIMEOUT", 1800),
+            )
             logger.info("Generation environment setup completed")
         except Exception as e:
             logger.error(f"Generation environment setup failed: {str(e)}")
@@ -420,24 +814,24 @@ class AIService:
             shutil.rmtree(dataset_path)
         dataset_path.mkdir(parents=True)
 
-        processed_files = []
-
         try:
+            pairs = []
             for idx, info in enumerate(file_info):
                 source_path = Path(info["path"])
                 if not source_path.exists():
                     raise FileNotFoundError(f"Source file not found: {source_path}")
 
-                # Copy and validate image
-                image_path = dataset_path / f"image_{idx:04d}.jpg"
-                shutil.copy2(source_path, image_path)
-                processed_files.append(str(image_path))
+                pairs.append((source_path, dataset_path / f"image_{idx:04d}.jpg"))
 
                 # Create caption
                 caption_path = dataset_path / f"image_{idx:04d}.txt"
                 with open(caption_path, "w") as f:
                     f.write("an image of [trigger]")
 
+            # Orient, resize and re-encode locally so less goes over the wire
+            results = self.preprocessor.process_images(pairs)
+            processed_files = [result["path"] for result in results]
+
             return dataset_path, processed_files
 
         except Exception as e:
@@ -448,56 +842,396 @@ class AIService:
 
     def generate_theme_images(
         self,
-        instance: LambdaInstance,
+        instance: ComputeInstance,
         model_path: str,
         theme_name: str,
         prompts: List[str],
+        on_image: Optional[Callable[[str, int, str], None]] = None,
     ) -> List[str]:
-        """Generate images for a theme and return local paths"""
-        try:
-            # Setup output directory
-            output_dir = f"{self.remote_base}/generated_images/{theme_name}"
-            instance.execute_command_ssh(f"mkdir -p {output_dir}")
-
-            # Run generation using repository script
-            generation_cmd = f"""
-            cd {self.remote_workspace} && \
-            source venv/bin/activate && \
-            export HF_TOKEN='{self.config["HF_TOKEN"]}' && \
-            export PROMPTS='{json.dumps(prompts)}' && \
-            export OUTPUT_DIR="{output_dir}" && \
-            export MODEL_PATH="{model_path}" && \
-            python generation/generate_batch.py
-            """
-
-            logger.info(f"Starting generation for theme: {theme_name}")
-            result = instance.execute_command_ssh(generation_cmd)
-
-            if "Error" in result:
-                logger.error(f"Generation output: {result}")
-                raise Exception(f"Generation failed for theme {theme_name}")
-
-            # Download generated images
-            local_paths = []
-            local_dir = self.base_path / f"theme_images/{theme_name}"
-            local_dir.mkdir(parents=True, exist_ok=True)
-
-            logger.info(f"Downloading generated images for theme {theme_name}")
-            for i in range(len(prompts)):
-                remote_path = f"{output_dir}/gen_{i:03d}.png"
-                local_path = local_dir / f"gen_{i:03d}.png"
-                instance.download_file_scp(remote_path, str(local_path))
-                local_paths.append(str(local_path))
+        """Generate images for a single theme and return local paths"""
+        theme_images = self.generate_all_theme_images(
+            instance=instance,
+            model_path=model_path,
+            theme_prompts={theme_name: prompts},
+            run_name=theme_name,
+            on_image=on_image,
+        )
+        return theme_images.get(theme_name, [])
+
+    def _generation_run(
+        self,
+        theme_prompts: Dict[str, List[str]],
+        run_name: str,
+        gpu: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Manifest, paths and prepare command for one generation run"""
+        part_name = run_name if gpu is None else f"{run_name}_gpu{gpu}"
+        remote_root = f"{self.remote_base}/generated_images/{run_name}"
+        if gpu is not None:
+            remote_root = f"{remote_root}/gpu{gpu}"
+        manifest = {
+            "batch_size": self.config.get("GENERATION_BATCH_SIZE", 4),
+            "themes": [
+                {
+                    "name": theme_name,
+                    "output_dir": f"{remote_root}/{theme_name}",
+                    "prompts": prompts,
+                }
+                for theme_name, prompts in theme_prompts.items()
+            ],
+        }
+        output_dirs = " ".join(
+            shlex.quote(theme["output_dir"]) for theme in manifest["themes"]
+        )
+        return {
+            "part_name": part_name,
+            "remote_root": remote_root,
+            "manifest": manifest,
+            "local_manifest": self.base_path / "manifests" / f"{part_name}.json",
+            "remote_manifest": f"{self.remote_base}/manifests/{part_name}.json",
+            "prepare_command": (
+                f"rm -rf {shlex.quote(remote_root)} && "
+                f"mkdir -p {self.remote_base}/manifests {output_dirs}"
+            ),
+        }
+
+    def _image_collector(
+        self,
+        theme_prompts: Dict[str, List[str]],
+        on_image: Optional[Callable[[str, int, str], None]] = None,
+    ) -> Tuple[Callable[[Path], None], Callable[[], Dict[str, List[str]]]]:
+        """
+        An on_file handler for downloaded images and a function returning
+        what it collected, as theme name to paths in prompt order.
+        """
+        images: Dict[str, Dict[int, str]] = {name: {} for name in theme_prompts}
+
+        def handle_file(path: Path):
+            theme_name = path.parent.name
+            index = self._image_index(path)
+            if index is None or theme_name not in images:
+                return
+            images[theme_name][index] = str(path)
+            if on_image:
+                on_image(theme_name, index, str(path))
+
+        def collect() -> Dict[str, List[str]]:
+            theme_images = {
+                theme_name: [paths[i] for i in sorted(paths)]
+                for theme_name, paths in images.items()
+            }
+            for theme_name, paths in theme_images.items():
+                expected = len(theme_prompts[theme_name])
+                if len(paths) != expected:
+                    logger.warning(
+                        f"Theme {theme_name} produced {len(paths)}/{expected} images"
+                    )
+            return theme_images
+
+        return handle_file, collect
+
+    def generate_all_theme_images(
+        self,
+        instance: ComputeInstance,
+        model_path: str,
+        theme_prompts: Dict[str, List[str]],
+        run_name: str,
+        on_image: Optional[Callable[[str, int, str], None]] = None,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+        gpu: Optional[int] = None,
+    ) -> Dict[str, List[str]]:
+        """
+        Generate images for every theme with a single generation run.
+
+        The base model and LoRA weights are loaded once and the script works
+        through a manifest of all themes, batching prompts to fill the GPU and
+        writing each theme into its own output directory. If on_image is given
+        it is called as on_image(theme_name, index, path) for every image as
+        soon as it has been downloaded. If gpu is given the run is pinned to
+        that device and keeps its remote files apart from other parts of the
+        same run.
+
+        Returns:
+            Dict[str, List[str]]: Theme name to local image paths, in prompt order
+        """
+        run = self._generation_run(theme_prompts, run_name, gpu)
+        part_name = run["part_name"]
+        remote_root = run["remote_root"]
+        local_manifest = run["local_manifest"]
 
+        try:
+            # Ship the manifest and prepare one output directory per theme
+            local_manifest.parent.mkdir(parents=True, exist_ok=True)
+            local_manifest.write_text(json.dumps(run["manifest"]))
+            instance.execute_command(run["prepare_command"])
+            instance.upload_file(str(local_manifest), run["remote_manifest"])
+
+            # Run generation for all themes using repository script
+            total = sum(len(prompts) for prompts in theme_prompts.values())
             logger.info(
-                f"Successfully generated {len(local_paths)} images for {theme_name}"
+                f"Starting generation of {total} images across {len(theme_prompts)} themes"
+            )
+            instance.run_command(
+                self._generation_command(
+                    run["remote_manifest"], model_path, run["manifest"], gpu
+                ),
+                idle_timeout=self.config.get("REMOTE_GENERATION_IDLE_TIMEOUT", 600),
+                total_timeout=self.config.get("REMOTE_GENERATION_TIMEOUT", 3600),
+                on_line=self._progress_parser("generating", on_progress),
+                keep_output=False,
             )
-            return local_paths
+
+            # Stream every theme directory back in one go
+            local_root = self.base_path / "theme_images" / run_name
+            handle_file, collect = self._image_collector(theme_prompts, on_image)
+
+            logger.info(f"Downloading generated images for run {part_name}")
+            instance.download_dir(remote_root, local_root, on_file=handle_file)
+            theme_images = collect()
+
+            logger.info(f"Successfully generated {total} images for run {part_name}")
+            return theme_images
 
         except Exception as e:
-            logger.error(f"Theme generation failed for {theme_name}: {str(e)}")
+            logger.error(f"Theme generation failed for run {part_name}: {str(e)}")
             raise
 
+        finally:
+            local_manifest.unlink(missing_ok=True)
+
+    def generate_images(
+        self, model_id: int, user_id: int, model_path: str, prompts: List[str]
+    ) -> List[str]:
+        """
+        Generate images for prompts with an existing model's weights.
+
+        model_path is a local weights file; it is uploaded to a fresh instance
+        and the prompts run as a single theme through generate_all_theme_images.
+
+        Returns:
+            List[str]: Local image paths, in prompt order
+        """
+        run_name = f"model_{model_id}_{int(time.time())}"
+        instance = None
+        try:
+            logger.info(
+                f"Generating {len(prompts)} images with model {model_id} for user {user_id}"
+            )
+            instance = self.launch_instance()
+            self._setup_generation_environment(instance)
+
+            remote_model_path = f"{self.remote_base}/models/{run_name}.safetensors"
+            instance.execute_command(f"mkdir -p {self.remote_base}/models")
+            instance.upload_file(model_path, remote_model_path)
+
+            theme_images = self.generate_all_theme_images(
+                instance, remote_model_path, {"generated": prompts}, run_name
+            )
+            return theme_images["generated"]
+
+        finally:
+            if instance:
+                try:
+                    self.backend.terminate(instance)
+                except Exception as e:
+                    logger.error(f"Failed to terminate instance: {str(e)}")
+
+    @staticmethod
+    def _gpu_env(gpu: Optional[int]) -> str:
+        """Shell prefix pinning a command to one GPU, empty when unpinned"""
+        return "" if gpu is None else f"export CUDA_VISIBLE_DEVICES={gpu} && "
+
+    def _gpu_slots(self, instance: ComputeInstance) -> Queue:
+        """
+        Slots for GPU work on an instance, TRAINING_BATCH_CONCURRENCY per GPU.
+        Each slot holds the device to pin to, or None on single-GPU instances;
+        devices are interleaved so every GPU gets work before any doubles up.
+        """
+        per_gpu = max(1, self.config.get("TRAINING_BATCH_CONCURRENCY", 1))
+        gpus = list(range(instance.gpu_count)) if instance.gpu_count > 1 else [None]
+        slots = Queue()
+        for _ in range(per_gpu):
+            for gpu in gpus:
+                slots.put(gpu)
+        return slots
+
+    @contextmanager
+    def _gpu_slot(self, slots: Queue) -> Iterator[Optional[int]]:
+        """Hold one GPU slot for the duration of the block"""
+        gpu = slots.get()
+        try:
+            yield gpu
+        finally:
+            slots.put(gpu)
+
+    def _generate_on_free_gpus(
+        self,
+        instance: ComputeInstance,
+        model_path: str,
+        theme_prompts: Dict[str, List[str]],
+        run_name: str,
+        slots: Queue,
+        on_image: Optional[Callable[[str, int, str], None]] = None,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> Dict[str, List[str]]:
+        """
+        Generate a run's themes on every GPU that is free.
+
+        Waits for one slot and also takes any other idle GPUs, then splits the
+        themes so each device gets a similar number of images. Themes of a
+        part that fails come back empty.
+        """
+        held = [slots.get()]
+        try:
+            while held[0] is not None and len(held) < len(theme_prompts):
+                try:
+                    gpu = slots.get_nowait()
+                except Empty:
+                    break
+                if gpu in held:
+                    slots.put(gpu)
+                    break
+                held.append(gpu)
+
+            if len(held) == 1:
+                return self.generate_all_theme_images(
+                    instance=instance,
+                    model_path=model_path,
+                    theme_prompts=theme_prompts,
+                    run_name=run_name,
+                    on_image=on_image,
+                    on_progress=on_progress,
+                    gpu=held[0],
+                )
+
+            # Largest themes first, each onto the least loaded GPU
+            parts: List[Dict[str, List[str]]] = [{} for _ in held]
+            sizes = [0] * len(held)
+            for theme_name, prompts in sorted(
+                theme_prompts.items(), key=lambda item: -len(item[1])
+            ):
+                part = sizes.index(min(sizes))
+                parts[part][theme_name] = prompts
+                sizes[part] += len(prompts)
+
+            # Report progress summed over the parts
+            total = sum(sizes)
+            done = {gpu: 0 for gpu in held}
+            progress_lock = threading.Lock()
+
+            def part_progress(gpu: int):
+                if on_progress is None:
+                    return None
+
+                def report(progress: Dict[str, Any]):
+                    with progress_lock:
+                        done[gpu] = progress["step"]
+                        step = sum(done.values())
+                    on_progress(
+                        {
+                            **progress,
+                            "step": step,
+                            "total_steps": total,
+                            "percent": round(100.0 * step / total, 1),
+                        }
+                    )
+
+                return report
+
+            logger.info(f"Splitting generation for run {run_name} across GPUs {held}")
+            theme_images: Dict[str, List[str]] = {}
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(held), thread_name_prefix=f"generate-{run_name}"
+            ) as executor:
+                futures = [
+                    (
+                        executor.submit(
+                            self.generate_all_theme_images,
+                            instance,
+                            model_path,
+                            part,
+                            run_name,
+                            on_image,
+                            part_progress(gpu),
+                            gpu,
+                        ),
+                        part,
+                    )
+                    for gpu, part in zip(held, parts)
+                ]
+                for future, part in futures:
+                    try:
+                        theme_images.update(future.result())
+                    except Exception as e:
+                        logger.error(
+                            f"Generation part for {list(part)} failed: {str(e)}"
+                        )
+                        theme_images.update({theme_name: [] for theme_name in part})
+
+            return {
+                theme_name: theme_images[theme_name] for theme_name in theme_prompts
+            }
+
+        finally:
+            for gpu in held:
+                slots.put(gpu)
+
+    @staticmethod
+    def _progress_parser(
+        stage: str,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]],
+        min_interval: float = 5.0,
+    ) -> Optional[Callable[[str], None]]:
+        """
+        Build an on_line callback that turns tqdm-style step counters into
+        progress records, reporting at most once every min_interval seconds.
+        """
+        if on_progress is None:
+            return None
+
+        last_report = {"time": 0.0, "step": None}
+
+        def parse_line(line: str):
+            match = PROGRESS_PATTERN.search(line)
+            if not match:
+                return
+            step, total_steps = int(match.group(1)), int(match.group(2))
+            now = time.monotonic()
+            finished = step == total_steps
+            if step == last_report["step"] or (
+                not finished and now - last_report["time"] < min_interval
+            ):
+                return
+
+            progress = {
+                "stage": stage,
+                "step": step,
+                "total_steps": total_steps,
+                "percent": round(100.0 * step / total_steps, 1) if total_steps else 0,
+            }
+            loss = LOSS_PATTERN.search(line)
+            if loss:
+                progress["loss"] = float(loss.group(1))
+
+            last_report.update(time=now, step=step)
+            try:
+                on_progress(progress)
+            except Exception as e:
+                logger.warning(f"Progress callback failed: {str(e)}")
+
+        return parse_line
+
+    @staticmethod
+    def _image_index(path: Path) -> Optional[int]:
+        """Return N for a generated gen_NNN.png file, None for anything else."""
+        name = Path(path).name
+        if not (name.startswith("gen_") and name.endswith(".png")):
+            return None
+        try:
+            return int(name[4:-4])
+        except ValueError:
+            return None
+
     def adapt_prompt(
         self, base_prompt: str, user_sex: str, user_age_years: float
     ) -> str:
@@ -506,25 +1240,9 @@ class AIService:
         For example:
         - If user_sex='M': GENDER_NOUN='boy', PRONOUN='he'
         - If user_sex='F': GENDER_NOUN='girl', PRONOUN='she'
-        - Age might be '4 y.o.' if user_age_years=4, or '5 y.o.' etc.
+        - Age might be '4.00 y.o.' if user_age_years=4
         """
-        # Basic gender logic
-        if user_sex == "M":
-            GENDER_NOUN = "boy"
-            PRONOUN = "he"
-        elif user_sex == "F":
-            GENDER_NOUN = "girl"
-            PRONOUN = "she"
-
-        # Convert float to integer for simpler display
-        age_str = f"{user_age_years:.2f} y.o."
-
-        # Perform all replacements
-        updated = base_prompt.replace("{GENDER_NOUN}", GENDER_NOUN)
-        updated = updated.replace("{PRONOUN}", PRONOUN)
-        updated = updated.replace("{AGE}", age_str)
-
-        return updated
+        return self.theme_catalog.format_prompt(base_prompt, user_sex, user_age_years)
 
     def safe_int(self, value: Any, default: int) -> int:
         """
@@ -538,171 +1256,321 @@ class AIService:
         except (ValueError, TypeError):
             return default
 
+    def _fetch_weights(
+        self,
+        instance: ComputeInstance,
+        remote_path: str,
+        local_path: Path,
+        on_weights: Optional[Callable[[str], None]] = None,
+    ):
+        """Download trained weights and hand them to on_weights"""
+        started = time.monotonic()
+        instance.download_file(remote_path, str(local_path))
+        logger.info(
+            f"Downloaded weights to {local_path} in {time.monotonic() - started:.1f}s"
+        )
+        if on_weights:
+            on_weights(str(local_path))
+
+    def _theme_prompts(self, training_config: Dict) -> Dict[str, List[str]]:
+        """Final prompts for every theme the subject is eligible for"""
+        user_sex = training_config.get("sex", "M")
+        age_years = self.safe_int(training_config.get("age_years"), 4)
+        age_months = self.safe_int(training_config.get("age_months"), 0)
+        user_age_years = age_years + (age_months / 12.0)
+
+        manifest = self.theme_catalog.build_manifest(user_sex, user_age_years)
+        theme_prompts: Dict[str, List[str]] = {
+            theme_name: [entry.prompt for entry in entries]
+            for theme_name, entries in manifest.items()
+        }
+        logger.info(
+            f"{len(theme_prompts)} themes eligible for "
+            f"sex={user_sex}, age={user_age_years:.2f}"
+        )
+        return theme_prompts
+
     def train_model(
-        self, model_id: int, user_id: int, training_config: Dict
+        self,
+        model_id: int,
+        user_id: int,
+        training_config: Dict,
+        on_image: Optional[Callable[[str, int, str], None]] = None,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+        on_weights: Optional[Callable[[str], None]] = None,
     ) -> Tuple[str, Dict[str, List[str]]]:
         """Train model and generate initial photobooks.
+
+        on_image, if given, receives (theme_name, index, local_path) for each
+        generated image as soon as it lands on the worker. on_progress, if
+        given, receives progress records parsed from the remote output.
+        on_weights, if given, receives the local weights path as soon as the
+        download finishes, on a background thread while generation runs; an
+        exception it raises fails the training.
+
         Returns:
             Tuple[str, Dict[str, List[str]]]: Tuple containing:
                 - Path to trained model weights
                 - Dictionary mapping theme names to lists of generated image paths
         """
+        result = self.train_models(
+            [
+                {
+                    "model_id": model_id,
+                    "user_id": user_id,
+                    "training_config": training_config,
+                    "on_image": on_image,
+                    "on_progress": on_progress,
+                    "on_weights": on_weights,
+                }
+            ]
+        )[0]
+        if result["error"]:
+            raise result["error"]
+        return result["weights_path"], result["theme_images"]
+
+    def train_models(self, jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Train several models on one instance and generate their photobooks.
+
+        Each job holds model_id, user_id and training_config plus the optional
+        on_image, on_progress and on_weights callbacks of train_model. Launch
+        and environment setup are paid once per batch; every job then gets its
+        own config file, dataset directory and output names. Jobs are spread
+        over the instance's GPUs with CUDA_VISIBLE_DEVICES, at most
+        TRAINING_BATCH_CONCURRENCY per GPU (1 runs them back-to-back), and a
+        job's generation also takes any GPUs left idle. A failing job does not
+        affect the others.
+
+        Returns:
+            List[Dict[str, Any]]: One result per job, in order, with model_id,
+            weights_path, theme_images and error (None on success)
+        """
+        results = [
+            {
+                "model_id": job["model_id"],
+                "weights_path": None,
+                "theme_images": {},
+                "error": None,
+            }
+            for job in jobs
+        ]
+        model_ids = ", ".join(str(job["model_id"]) for job in jobs)
         instance = None
-        dataset_path = None
-        temp_weights_path = None
-        theme_images: Dict[str, List[str]] = {}
+        dataset_paths: Dict[int, Path] = {}
 
         try:
-            logger.info(f"Starting model {model_id} training preparation")
-
-            # time.sleep(5)
-            # raise Exception("Simulated failure for testing refund logic")
+            logger.info(f"Starting training preparation for models {model_ids}")
 
-            # Launch instance and prepare dataset concurrently
-            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            # Launch instance and prepare datasets concurrently
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(jobs) + 1
+            ) as executor:
                 instance_future = executor.submit(self.launch_instance)
-                dataset_future = executor.submit(
-                    self.prepare_dataset, model_id, training_config["file_info"]
-                )
+                dataset_futures = [
+                    executor.submit(
+                        self.prepare_dataset,
+                        job["model_id"],
+                        job["training_config"]["file_info"],
+                    )
+                    for job in jobs
+                ]
+
+                for job, result, future in zip(jobs, results, dataset_futures):
+                    try:
+                        dataset_paths[job["model_id"]], _ = future.result()
+                    except Exception as e:
+                        logger.error(
+                            f"Dataset preparation failed for model {job['model_id']}: {str(e)}"
+                        )
+                        result["error"] = e
 
                 instance = instance_future.result()
-                dataset_path, _ = dataset_future.result()
 
-            # Setup training environment first
+            pending = [
+                (job, result)
+                for job, result in zip(jobs, results)
+                if result["error"] is None
+            ]
+            if not pending:
+                return results
+
+            # Setup training environment once for the whole batch
             logger.info("Setting up training environment...")
             self._setup_training_environment(instance)
 
-            # Update base_training.yaml with model info
-            logger.info("Updating training configuration")
-            model_name = f"model_{model_id}"
-            update_config_cmd = f"""
-            cd {self.remote_workspace} && \
-            sed -i 's/name: ".*"/name: "{model_name}"/' base_training_short.yaml
-            """
-            instance.execute_command_ssh(update_config_cmd)
+            # The generation environment is set up by the first job to need it
+            generation_lock = threading.Lock()
+            generation_ready = threading.Event()
+
+            def ensure_generation_environment():
+                with generation_lock:
+                    if not generation_ready.is_set():
+                        self._setup_generation_environment(instance)
+                        generation_ready.set()
+
+            slots = self._gpu_slots(instance)
+            if instance.gpu_count > 1:
+                logger.info(f"Scheduling across {instance.gpu_count} GPUs")
+
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(pending), thread_name_prefix="training-run"
+            ) as executor:
+                futures = [
+                    (
+                        executor.submit(
+                            self._run_training_job,
+                            instance,
+                            job,
+                            dataset_paths[job["model_id"]],
+                            slots,
+                            ensure_generation_environment,
+                        ),
+                        result,
+                    )
+                    for job, result in pending
+                ]
+
+                for future, result in futures:
+                    try:
+                        result["weights_path"], result["theme_images"] = future.result()
+                    except Exception as e:
+                        logger.error(
+                            f"Training error for model {result['model_id']}: {str(e)}"
+                        )
+                        result["error"] = e
+
+            return results
+
+        except Exception as e:
+            # Instance-level failure: every job without an outcome fails with it
+            logger.error(f"Training batch error for models {model_ids}: {str(e)}")
+            for result in results:
+                if result["error"] is None and result["weights_path"] is None:
+                    result["error"] = e
+            return results
+
+        finally:
+            # Cleanup
+            if instance:
+                try:
+                    self.backend.terminate(instance)
+                except Exception as e:
+                    logger.error(f"Failed to terminate instance: {str(e)}")
+
+            for dataset_path in dataset_paths.values():
+                if dataset_path.exists():
+                    try:
+                        shutil.rmtree(dataset_path)
+                    except Exception as e:
+                        logger.error(f"Cleanup error: {str(e)}")
 
-            # Create dataset directory and upload dataset
-            logger.info("Uploading dataset")
-            remote_dataset_path = f"{self.remote_workspace}/dataset"
-            instance.execute_command_ssh(f"mkdir -p {remote_dataset_path}")
+    def _run_training_job(
+        self,
+        instance: ComputeInstance,
+        job: Dict[str, Any],
+        dataset_path: Path,
+        slots: Queue,
+        ensure_generation_environment: Callable[[], None],
+    ) -> Tuple[str, Dict[str, List[str]]]:
+        """Train one model of a batch and generate its initial photobooks"""
+        model_id = job["model_id"]
+        training_config = job["training_config"]
+        on_progress = job.get("on_progress")
+        weights_future = None
+
+        # Per-job names keep runs sharing an instance apart
+        model_name = f"model_{model_id}"
+        remote_config = f"configs/{model_name}.yaml"
+        remote_dataset_path = f"{self.remote_workspace}/datasets/{model_name}"
+
+        try:
+            # Write this job's copy of base_training_short.yaml
+            logger.info(f"Updating training configuration for {model_name}")
+            instance.execute_command(
+                self._training_config_command(
+                    model_name, remote_config, remote_dataset_path
+                )
+            )
 
             # Upload dataset files
-            dataset_files = list(dataset_path.glob("*"))
-            for file_path in dataset_files:
-                instance.upload_file_scp(
+            logger.info(f"Uploading dataset for {model_name}")
+            for file_path in dataset_path.glob("*"):
+                instance.upload_file(
                     str(file_path), f"{remote_dataset_path}/{file_path.name}"
                 )
 
             # Run training
-            logger.info("Starting training")
-            train_cmd = f"""
-            cd {self.remote_workspace} && \
-            source venv/bin/activate && \
-            export HF_TOKEN='{self.config["HF_TOKEN"]}' && \
-            python run.py base_training_short.yaml
-            """
-            result = instance.execute_command_ssh(train_cmd)
-            logger.debug(f"Training command output: {result}")
-
-            # Check for training success
-            if "Error" in result or "Exception" in result:
-                log_result = instance.execute_command_ssh(
-                    f"cat {self.remote_workspace}/training.log"
-                )
-                raise Exception(f"Training failed with log:\n{log_result}")
+            with self._gpu_slot(slots) as gpu:
+                logger.info(f"Starting training for {model_name} on GPU {gpu or 0}")
+                train_cmd = self._training_command(remote_config, gpu)
+                try:
+                    instance.run_command(
+                        train_cmd,
+                        idle_timeout=self.config.get(
+                            "REMOTE_TRAINING_IDLE_TIMEOUT", 900
+                        ),
+                        total_timeout=self.config.get(
+                            "REMOTE_TRAINING_TIMEOUT", 3 * 3600
+                        ),
+                        on_line=self._progress_parser("training", on_progress),
+                        keep_output=False,
+                    )
+                except RemoteCommandError as e:
+                    raise Exception(f"Training failed ({str(e)}) with log:\n{e.output}")
 
             # Download weights file
-            logger.info("Downloading trained weights")
+            logger.info(f"Downloading trained weights for {model_name}")
             remote_model_path = (
                 f"{self.remote_workspace}/output/{model_name}/{model_name}.safetensors"
             )
             temp_weights_path = self.base_path / f"{model_name}.safetensors"
-            instance.download_file_scp(remote_model_path, str(temp_weights_path))
+
+            # Pull the weights in the background so on_weights can publish
+            # them while the GPU is still setting up and generating
+            weights_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f"weights-{model_id}"
+            )
+            weights_future = weights_executor.submit(
+                self._fetch_weights,
+                instance,
+                remote_model_path,
+                temp_weights_path,
+                job.get("on_weights"),
+            )
+            weights_executor.shutdown(wait=False)
 
             # Then setup generation environment
             logger.info("Setting up generation environment...")
-            self._setup_generation_environment(instance)
+            ensure_generation_environment()
 
             # Generate photobooks for each theme
-            logger.info("Generating initial photobooks")
-            all_themes = self.config["PHOTOSHOOT_THEMES"]
-
-            user_sex = training_config.get("sex", "M")
-            age_years = self.safe_int(training_config.get("age_years"), 4)
-            age_months = self.safe_int(training_config.get("age_months"), 0)
-            user_age_years = age_years + (age_months / 12.0)
-
-            for theme_name, theme_data in all_themes.items():
-                theme_gender = theme_data["gender"]
-                min_age = theme_data["age_min"]
-                max_age = theme_data["age_max"]
-
-                # Gender filter
-                if theme_gender != "U" and theme_gender != user_sex:
-                    logger.info(f"Skipping {theme_name} for user_sex={user_sex}")
-                    continue
-
-                # Age filter
-                if user_age_years < min_age or user_age_years > max_age:
-                    logger.info(f"Skipping {theme_name} due to age {user_age_years}")
-                    continue
+            logger.info(f"Generating initial photobooks for {model_name}")
+            theme_prompts = self._theme_prompts(training_config)
 
-                try:
-                    logger.info(f"Generating images for theme: {theme_name}")
-
-                    prompt_items = theme_data["prompts"]
-
-                    expanded_prompts: List[str] = []
-                    for item in prompt_items:
-                        base_prompt = item["prompt"]
-                        how_many = item["count"]
-
-                        for _ in range(how_many):
-                            final_prompt = self.adapt_prompt(
-                                base_prompt, user_sex, user_age_years
-                            )
-                            expanded_prompts.append(final_prompt)
-
-                    # Now pass expanded_prompts to your generate function
-                    image_paths = self.generate_theme_images(
-                        instance=instance,
-                        model_path=remote_model_path,
-                        theme_name=theme_name,
-                        prompts=expanded_prompts,
-                    )
-                    theme_images[theme_name] = image_paths
+            # Generate every eligible theme in one run so the model loads once
+            try:
+                theme_images = self._generate_on_free_gpus(
+                    instance=instance,
+                    model_path=remote_model_path,
+                    theme_prompts=theme_prompts,
+                    run_name=model_name,
+                    slots=slots,
+                    on_image=job.get("on_image"),
+                    on_progress=on_progress,
+                )
+            except Exception as e:
+                logger.error(
+                    f"Failed to generate initial photobooks: {str(e)}",
+                    exc_info=True,
+                )
+                theme_images = {theme_name: [] for theme_name in theme_prompts}
 
-                except Exception as e:
-                    logger.error(
-                        f"Failed to generate theme {theme_name}: {str(e)}",
-                        exc_info=True,
-                    )
-                    # Skip this theme, continue with next
-                    theme_images[theme_name] = []
-                    continue
+            # Surface a failed download or publish before reporting success
+            weights_future.result()
 
             return str(temp_weights_path), theme_images
 
-        except Exception as e:
-            logger.error(f"Training error for model {model_id}: {str(e)}")
-            raise
-
         finally:
-            # Cleanup
-            if instance:
-                try:
-                    logger.info("Terminating instance")
-                    response = requests.post(
-                        f"{self.base_url}/instance-operations/terminate",
-                        headers={"Authorization": f"Bearer {self.api_key}"},
-                        json={"instance_ids": [instance.instance_id]},
-                    )
-                    response.raise_for_status()
-                except Exception as e:
-                    logger.error(f"Failed to terminate instance: {str(e)}")
-
-            if dataset_path and dataset_path.exists():
-                try:
-                    shutil.rmtree(dataset_path)
-                except Exception as e:
-                    logger.error(f"Cleanup error: {str(e)}")
+            # The weights transfer needs the instance until it finishes
+            if weights_future:
+                concurrent.futures.wait([weights_future])
@@ -0,0 +1,786 @@
+# server/services/ai_service_async.py
+
+import asyncio
+import json
+import logging
+import re
+import shutil
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, Callable, AsyncIterator
+
+import aiohttp
+
+from .ai_service import (
+    AIService,
+    LambdaAPIException,
+    LambdaBackend,
+    LambdaInstance,
+    RemoteCommandError,
+    RemoteCommandTimeout,
+    STATUS_MARKER,
+)
+from .compute import create_compute_backend, gpu_count_for_type
+from .lambda_client import (
+    LambdaClient,
+    LambdaHTTPError,
+    LambdaTimeout,
+    get_instance_watcher,
+    get_lambda_client,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def lambda_request(
+    client: LambdaClient,
+    session: aiohttp.ClientSession,
+    method: str,
+    endpoint: str,
+    data: Optional[Dict] = None,
+) -> Dict:
+    """
+    LambdaClient.request over aiohttp: the same rate limiter, GET cache and
+    metrics, so threaded and asyncio workers share one request budget.
+    """
+    body = client.cached(method, endpoint)
+    if body is not None:
+        return body
+
+    url = f"{client.base_url}/{endpoint}"
+    timeout = aiohttp.ClientTimeout(total=client.timeout)
+    for attempt in range(client.max_retries + 1):
+        await asyncio.sleep(client.rate_limiter.reserve())
+
+        started = time.monotonic()
+        try:
+            async with session.request(
+                method, url, json=data, timeout=timeout
+            ) as response:
+                client.record(method, endpoint, started, response.status)
+                status = response.status
+                retry_after = response.headers.get("Retry-After")
+                try:
+                    body = await response.json(content_type=None)
+                except ValueError:
+                    body = {}
+        except asyncio.TimeoutError:
+            client.record(method, endpoint, started, None)
+            logger.error(f"Lambda API request {method} {endpoint} timed out")
+            raise LambdaTimeout("Request timed out")
+        except aiohttp.ClientError as e:
+            client.record(method, endpoint, started, None)
+            logger.error(f"Lambda API request failed: {str(e)}")
+            raise LambdaAPIException(f"Request failed: {str(e)}")
+
+        if status == 429 and attempt < client.max_retries:
+            await asyncio.sleep(client.rate_limited(retry_after, attempt))
+            continue
+
+        if status >= 400:
+            error = (body or {}).get("error", {})
+            if status == 429:
+                client.rate_limited(retry_after, attempt)
+            raise LambdaHTTPError(
+                f"HTTP error {status} for {method} {endpoint}: {error}", status, error
+            )
+
+        client.store(method, endpoint, body)
+        return body
+
+
+class AsyncLambdaInstance:
+    """
+    Coroutine counterpart of LambdaInstance.
+
+    API calls share the backend's aiohttp session and SSH/SCP run as asyncio
+    subprocesses, so an instance that is booting, training or generating
+    costs a coroutine instead of an OS thread.
+    """
+
+    def __init__(
+        self,
+        instance_id: str,
+        config: Dict[str, Any],
+        session: aiohttp.ClientSession,
+        instance_type: Optional[str] = None,
+    ):
+        self.instance_id = instance_id
+        self.config = config
+        self.session = session
+        self.instance_type = instance_type
+        self.gpu_count = gpu_count_for_type(instance_type)
+        self.env_cache_dir: Optional[str] = None
+        self.client = get_lambda_client(config)
+        self.instance_ip = None
+        self.ssh_key_path = config["LAMBDA_SSH_KEY_PATH"]
+
+    _ssh_options = LambdaInstance._ssh_options
+
+    async def _make_request(
+        self, method: str, endpoint: str, data: Optional[Dict] = None
+    ) -> Dict:
+        """Make request to Lambda API through the shared client."""
+        return await lambda_request(self.client, self.session, method, endpoint, data)
+
+    async def get_instance_details(self) -> Dict[str, Any]:
+        """Get instance details with retries."""
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                return await self._make_request("GET", f"instances/{self.instance_id}")
+            except LambdaAPIException:
+                if attempt == max_retries - 1:
+                    raise
+                await asyncio.sleep(2**attempt)  # Exponential backoff
+
+    async def wait_for_completion(self, timeout: int = 3600):
+        """Wait for instance to be ready, via the shared instance watcher."""
+        logger.info(f"Waiting for instance {self.instance_id} to become active")
+        watcher = get_instance_watcher(self.config)
+        future = watcher.watch(self.instance_id, timeout)
+        try:
+            data = await asyncio.wait_for(
+                asyncio.wrap_future(future), timeout + watcher.slow_interval * 2
+            )
+        except asyncio.TimeoutError:
+            raise LambdaAPIException("Instance startup timeout")
+        self.instance_ip = data["ip"]
+
+    async def _scp(self, source: str, destination: str, action: str):
+        process = await asyncio.create_subprocess_exec(
+            "scp", *self._ssh_options(), source, destination
+        )
+        exit_code = await process.wait()
+        if exit_code != 0:
+            logger.error(f"SCP {action} failed with exit code {exit_code}")
+            raise LambdaAPIException(f"SCP {action} failed with exit code {exit_code}")
+
+    async def upload_file(self, local_path: str, remote_path: str):
+        """Upload file to instance using SCP."""
+        logger.info(f"Uploading {local_path} to {self.instance_ip}:{remote_path}")
+        await self._scp(
+            local_path, f"ubuntu@{self.instance_ip}:{remote_path}", "upload"
+        )
+
+    async def download_file(self, remote_path: str, local_path: str):
+        """Download file from instance using SCP."""
+        logger.info(f"Downloading {remote_path} from {self.instance_ip}")
+        await self._scp(
+            f"ubuntu@{self.instance_ip}:{remote_path}", local_path, "download"
+        )
+
+    async def download_dir(
+        self,
+        remote_dir: str,
+        local_dir: Path,
+        on_file: Optional[Callable[[Path], None]] = None,
+    ) -> List[Path]:
+        """
+        Stream a remote directory as tar over SSH. Unpacking is blocking file
+        I/O, so it runs on a worker thread for the length of the transfer, and
+        on_file is called from that thread.
+        """
+        instance = LambdaInstance(self.instance_id, self.config, self.instance_type)
+        instance.instance_ip = self.instance_ip
+        return await asyncio.to_thread(
+            instance.download_dir_stream, remote_dir, local_dir, on_file
+        )
+
+    async def stream_command(
+        self,
+        command: str,
+        idle_timeout: Optional[float] = None,
+        total_timeout: Optional[float] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Execute command on instance via SSH, yielding output lines as they
+        arrive. Same status line and timeout rules as
+        LambdaInstance.stream_command_ssh.
+        """
+        wrapped = (
+            f"{command.rstrip()}\n"
+            f'__rc=$?; printf \'{STATUS_MARKER} {{"exit_code": %d}}\\n\' "$__rc"; '
+            f"exit $__rc"
+        )
+
+        logger.info(f"Executing command on {self.instance_ip}: {command}")
+        process = await asyncio.create_subprocess_exec(
+            "ssh",
+            *self._ssh_options(),
+            f"ubuntu@{self.instance_ip}",
+            wrapped,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        pending = b""
+
+        try:
+            while True:
+                wait_for = idle_timeout
+                if total_timeout is not None:
+                    remaining = total_timeout - (loop.time() - started)
+                    if remaining <= 0:
+                        raise RemoteCommandTimeout(
+                            f"Command exceeded total timeout of {total_timeout}s"
+                        )
+                    wait_for = (
+                        remaining if wait_for is None else min(wait_for, remaining)
+                    )
+
+                try:
+                    chunk = await asyncio.wait_for(
+                        process.stdout.read(65536), timeout=wait_for
+                    )
+                except asyncio.TimeoutError:
+                    elapsed = loop.time() - started
+                    if total_timeout is not None and elapsed >= total_timeout:
+                        raise RemoteCommandTimeout(
+                            f"Command exceeded total timeout of {total_timeout}s"
+                        )
+                    raise RemoteCommandTimeout(
+                        f"Command produced no output for {idle_timeout}s"
+                    )
+
+                if not chunk:
+                    break
+                pending += chunk
+                *complete, pending = re.split(rb"[\r\n]", pending)
+                for line in complete:
+                    if line:
+                        yield line.decode(errors="replace")
+
+            if pending:
+                yield pending.decode(errors="replace")
+
+            exit_code = await process.wait()
+            if exit_code != 0:
+                raise RemoteCommandError(
+                    f"Command exited with code {exit_code}", exit_code=exit_code
+                )
+        finally:
+            if process.returncode is None:
+                logger.warning(f"Killing remote command on {self.instance_ip}")
+                process.kill()
+                await process.wait()
+
+    async def run_command(
+        self,
+        command: str,
+        idle_timeout: Optional[float] = None,
+        total_timeout: Optional[float] = None,
+        on_line: Optional[Callable[[str], None]] = None,
+        keep_output: bool = True,
+    ) -> Dict[str, Any]:
+        """Run a remote command to completion and check its reported status."""
+        output = deque(maxlen=None if keep_output else 200)
+        statuses: List[Dict[str, Any]] = []
+
+        try:
+            async for line in self.stream_command(command, idle_timeout, total_timeout):
+                if line.startswith(STATUS_MARKER):
+                    try:
+                        statuses.append(json.loads(line[len(STATUS_MARKER) :]))
+                    except ValueError:
+                        logger.warning(f"Unparseable status line: {line}")
+                    continue
+
+                output.append(line)
+                if on_line:
+                    on_line(line)
+        except RemoteCommandError as e:
+            e.output = "\n".join(output)
+            logger.error(f"SSH command failed: {str(e)}\n{e.output[-2000:]}")
+            raise
+
+        final = next((st for st in reversed(statuses) if "exit_code" in st), None)
+        if final is None or final["exit_code"] != 0:
+            raise RemoteCommandError(
+                "Command finished without a success status",
+                exit_code=final["exit_code"] if final else None,
+                output="\n".join(output),
+            )
+
+        return {"output": "\n".join(output), "exit_code": 0, "status": statuses}
+
+    async def execute_command(
+        self,
+        command: str,
+        idle_timeout: Optional[float] = 300,
+        total_timeout: Optional[float] = 1800,
+    ) -> str:
+        """Execute command on instance via SSH and return its output."""
+        result = await self.run_command(command, idle_timeout, total_timeout)
+        return result["output"]
+
+
+class AsyncLambdaBackend:
+    """Lambda Cloud instances launched and terminated over one aiohttp session"""
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.client = get_lambda_client(config)
+        self.session: Optional[aiohttp.ClientSession] = None
+
+        # Region and instance configuration
+        self.regions = (
+            config["LAMBDA_REGIONS"]
+            if isinstance(config["LAMBDA_REGIONS"], list)
+            else config["LAMBDA_REGIONS"].split(",")
+        )
+        self.instance_types = (
+            config["LAMBDA_INSTANCE_TYPES"]
+            if isinstance(config["LAMBDA_INSTANCE_TYPES"], list)
+            else config["LAMBDA_INSTANCE_TYPES"].split(",")
+        )
+
+    _launch_payload = LambdaBackend._launch_payload
+    _env_cache_dir = LambdaBackend._env_cache_dir
+
+    def _session(self) -> aiohttp.ClientSession:
+        """Session bound to the running loop, created on first use"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                headers={"Authorization": f"Bearer {self.client.api_key}"}
+            )
+        return self.session
+
+    async def launch(self) -> AsyncLambdaInstance:
+        """
+        Launch an instance, trying every instance type and region in order
+        like LambdaBackend.launch, and wait until it is active.
+        """
+        short_sleep_per_attempt = 1
+        big_wait_no_capacity_seconds = 600
+        session = self._session()
+
+        while True:
+            all_errors = []  # Track errors across attempts
+
+            for instance_type in self.instance_types:
+                for region in self.regions:
+                    logger.info(f"Attempting to launch {instance_type} in {region}.")
+                    await asyncio.sleep(short_sleep_per_attempt)
+
+                    try:
+                        resp_json = await lambda_request(
+                            self.client,
+                            session,
+                            "POST",
+                            "instance-operations/launch",
+                            self._launch_payload(instance_type, region),
+                        )
+                        instance_ids = resp_json.get("data", {}).get("instance_ids", [])
+                        if not instance_ids:
+                            raise LambdaAPIException(
+                                "No instance_ids returned in the successful response!"
+                            )
+
+                        instance = AsyncLambdaInstance(
+                            instance_ids[0], self.config, session, instance_type
+                        )
+                        instance.env_cache_dir = self._env_cache_dir(region)
+                        try:
+                            await instance.wait_for_completion()
+                        except BaseException:
+                            # Billed from here on, so a boot timeout or a
+                            # cancelled caller must not leave it running
+                            await self._release(instance)
+                            raise
+                        logger.info(
+                            f"Successfully launched {instance_type} in {region} with ID={instance.instance_id}"
+                        )
+                        return instance
+
+                    except LambdaHTTPError as http_err:
+                        if "insufficient-capacity" in http_err.code:
+                            logger.warning(
+                                f"Capacity error in {region} for {instance_type}: API error: {http_err.error}"
+                            )
+                            all_errors.append(
+                                f"{instance_type} in {region}: insufficient capacity"
+                            )
+                        else:
+                            logger.error(
+                                f"HTTP error {http_err.status_code} for {instance_type} in {region}: {http_err.error}"
+                            )
+                            all_errors.append(
+                                f"{instance_type} in {region}: HTTP error {http_err.status_code} {http_err.code}"
+                            )
+
+                    except LambdaTimeout:
+                        logger.warning(
+                            f"Request timed out for {instance_type} in {region}."
+                        )
+                        all_errors.append(f"{instance_type} in {region}: Timeout")
+
+                    except LambdaAPIException as lae:
+                        logger.warning(
+                            f"LambdaAPIException for {instance_type} in {region}: {lae}"
+                        )
+                        all_errors.append(
+                            f"{instance_type} in {region}: LambdaAPIException {lae}"
+                        )
+
+            logger.error(
+                f"Failed to launch instance with any configuration in this pass. "
+                f"Errors: {all_errors}. Sleeping {big_wait_no_capacity_seconds}s then retrying."
+            )
+            await asyncio.sleep(big_wait_no_capacity_seconds)
+
+    async def terminate(self, instance: AsyncLambdaInstance):
+        """Terminate a Lambda instance"""
+        logger.info(f"Terminating instance {instance.instance_id}")
+        await lambda_request(
+            self.client,
+            self._session(),
+            "POST",
+            "instance-operations/terminate",
+            {"instance_ids": [instance.instance_id]},
+        )
+
+    async def _release(self, instance: AsyncLambdaInstance):
+        """Terminate an instance that never reached the caller"""
+        try:
+            await asyncio.shield(self.terminate(instance))
+        except Exception as e:
+            logger.error(f"Failed to terminate instance {instance.instance_id}: {e}")
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lambda API latency and error counts per endpoint"""
+        return {
+            "lambda_api": self.client.get_stats(),
+            "instance_watcher": get_instance_watcher(self.config).get_stats(),
+        }
+
+
+class ThreadedInstance:
+    """Coroutine facade over a blocking ComputeInstance"""
+
+    def __init__(self, instance, owner=None):
+        self.instance = instance
+        self.owner = owner  # blocking backend to release it through, if not ours
+        self.instance_id = instance.instance_id
+        self.gpu_count = instance.gpu_count
+        self.env_cache_dir = instance.env_cache_dir
+
+    async def run_command(self, *args, **kwargs) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.instance.run_command, *args, **kwargs)
+
+    async def execute_command(self, *args, **kwargs) -> str:
+        return await asyncio.to_thread(self.instance.execute_command, *args, **kwargs)
+
+    async def upload_file(self, local_path: str, remote_path: str):
+        await asyncio.to_thread(self.instance.upload_file, local_path, remote_path)
+
+    async def download_file(self, remote_path: str, local_path: str):
+        await asyncio.to_thread(self.instance.download_file, remote_path, local_path)
+
+    async def download_dir(self, *args, **kwargs) -> List[Path]:
+        return await asyncio.to_thread(self.instance.download_dir, *args, **kwargs)
+
+
+class ThreadedBackend:
+    """
+    Coroutine facade over a blocking ComputeBackend, so the simulator can
+    drive the asyncio engine. Each call borrows a thread while it runs.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def launch(self) -> ThreadedInstance:
+        return ThreadedInstance(await asyncio.to_thread(self.backend.launch))
+
+    async def terminate(self, instance: ThreadedInstance):
+        await asyncio.to_thread(self.backend.terminate, instance.instance)
+
+    async def close(self):
+        pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self.backend.get_stats() if hasattr(self.backend, "get_stats") else {}
+
+
+def create_async_compute_backend(config: Dict[str, Any]):
+    """Async backend for COMPUTE_BACKEND, wrapping blocking ones in threads"""
+    if config.get("COMPUTE_BACKEND", "lambda") == "lambda":
+        return AsyncLambdaBackend(config)
+    return ThreadedBackend(create_compute_backend(config))
+
+
+class AsyncAIService(AIService):
+    """
+    asyncio variant of AIService, for supervising many trainings from one
+    event loop instead of a thread per job.
+
+    Dataset preparation, remote commands, manifests and prompts are shared
+    with AIService. launch_instance, the environment setups,
+    generate_all_theme_images and train_model are coroutines here. Callbacks
+    stay plain functions; on_image and on_weights run on worker threads so
+    they may block.
+    """
+
+    def __init__(self, config: Dict[str, Any], backend=None, prewarm_pool=None):
+        super().__init__(
+            config, backend=backend or create_async_compute_backend(config)
+        )
+        self.prewarm_pool = prewarm_pool
+
+    async def launch_instance(self):
+        """
+        Take a warm instance from the worker's PrewarmPool if it has one,
+        otherwise launch on the configured compute backend.
+        """
+        if self.prewarm_pool:
+            claim = asyncio.ensure_future(asyncio.to_thread(self.prewarm_pool.claim))
+            try:
+                claimed = await asyncio.shield(claim)
+            except asyncio.CancelledError:
+                # The claim finishes in its thread anyway; give back what it took
+                claimed = await claim
+                if claimed:
+                    await asyncio.to_thread(self.prewarm_pool.terminate, claimed)
+                raise
+            if claimed:
+                return ThreadedInstance(claimed, owner=self.prewarm_pool)
+        return await self.backend.launch()
+
+    async def terminate_instance(self, instance):
+        """Release an instance through whichever backend it came from"""
+        if getattr(instance, "owner", None):
+            await asyncio.to_thread(instance.owner.terminate, instance.instance)
+        else:
+            await self.backend.terminate(instance)
+
+    async def _setup_training_environment(self, instance):
+        """Setup training environment."""
+        logger.info("Executing setup commands on the instance...")
+        await instance.execute_command(
+            self._training_setup_command(instance.env_cache_dir),
+            idle_timeout=self.config.get("REMOTE_SETUP_IDLE_TIMEOUT", 600),
+            total_timeout=self.config.get("REMOTE_SETUP_TIMEOUT", 1800),
+        )
+        logger.info("Environment setup completed successfully.")
+
+    async def _setup_generation_environment(self, instance):
+        """Setup generation environment"""
+        logger.info("Setting up generation environment...")
+        await instance.execute_command(
+            self._generation_setup_command(instance.env_cache_dir),
+            idle_timeout=self.config.get("REMOTE_SETUP_IDLE_TIMEOUT", 600),
+            total_timeout=self.config.get("REMOTE_SETUP_TIMEOUT", 1800),
+        )
+        logger.info("Generation environment setup completed")
+
+    async def generate_all_theme_images(
+        self,
+        instance,
+        model_path: str,
+        theme_prompts: Dict[str, List[str]],
+        run_name: str,
+        on_image: Optional[Callable[[str, int, str], None]] = None,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+        gpu: Optional[int] = None,
+    ) -> Dict[str, List[str]]:
+        """Generate images for every theme with a single generation run."""
+        run = self._generation_run(theme_prompts, run_name, gpu)
+        local_manifest = run["local_manifest"]
+
+        try:
+            local_manifest.parent.mkdir(parents=True, exist_ok=True)
+            local_manifest.write_text(json.dumps(run["manifest"]))
+            await instance.execute_command(run["prepare_command"])
+            await instance.upload_file(str(local_manifest), run["remote_manifest"])
+
+            total = sum(len(prompts) for prompts in theme_prompts.values())
+            logger.info(
+                f"Starting generation of {total} images across {len(theme_prompts)} themes"
+            )
+            await instance.run_command(
+                self._generation_command(
+                    run["remote_manifest"], model_path, run["manifest"], gpu
+                ),
+                idle_timeout=self.config.get("REMOTE_GENERATION_IDLE_TIMEOUT", 600),
+                total_timeout=self.config.get("REMOTE_GENERATION_TIMEOUT", 3600),
+                on_line=self._progress_parser("generating", on_progress),
+                keep_output=False,
+            )
+
+            local_root = self.base_path / "theme_images" / run_name
+            handle_file, collect = self._image_collector(theme_prompts, on_image)
+            logger.info(f"Downloading generated images for run {run['part_name']}")
+            await instance.download_dir(
+                run["remote_root"], local_root, on_file=handle_file
+            )
+            return collect()
+
+        except Exception as e:
+            logger.error(
+                f"Theme generation failed for run {run['part_name']}: {str(e)}"
+            )
+            raise
+
+        finally:
+            local_manifest.unlink(missing_ok=True)
+
+    async def _fetch_weights(
+        self,
+        instance,
+        remote_path: str,
+        local_path: Path,
+        on_weights: Optional[Callable[[str], None]] = None,
+    ):
+        """Download trained weights and hand them to on_weights"""
+        started = time.monotonic()
+        await instance.download_file(remote_path, str(local_path))
+        logger.info(
+            f"Downloaded weights to {local_path} in {time.monotonic() - started:.1f}s"
+        )
+        if on_weights:
+            await asyncio.to_thread(on_weights, str(local_path))
+
+    async def train_model(
+        self,
+        model_id: int,
+        user_id: int,
+        training_config: Dict,
+        on_image: Optional[Callable[[str, int, str], None]] = None,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+        on_weights: Optional[Callable[[str], None]] = None,
+    ) -> Tuple[str, Dict[str, List[str]]]:
+        """Train model and generate initial photobooks, see AIService.train_model"""
+        instance = None
+        launch_task = None
+        dataset_path = None
+        weights_task = None
+        model_name = f"model_{model_id}"
+        remote_config = f"configs/{model_name}.yaml"
+        remote_dataset_path = f"{self.remote_workspace}/datasets/{model_name}"
+
+        try:
+            logger.info(f"Starting model {model_id} training preparation")
+
+            # Launch instance and prepare dataset concurrently. The launch is
+            # a task of its own so a cancellation cannot drop its instance
+            launch_task = asyncio.ensure_future(self.launch_instance())
+            launched, prepared = await asyncio.gather(
+                launch_task,
+                asyncio.to_thread(
+                    self.prepare_dataset, model_id, training_config["file_info"]
+                ),
+                return_exceptions=True,
+            )
+            if not isinstance(launched, BaseException):
+                instance = launched
+            if not isinstance(prepared, BaseException):
+                dataset_path, _ = prepared
+            for result in (launched, prepared):
+                if isinstance(result, BaseException):
+                    raise result
+
+            await self._setup_training_environment(instance)
+
+            logger.info(f"Updating training configuration for {model_name}")
+            await instance.execute_command(
+                self._training_config_command(
+                    model_name, remote_config, remote_dataset_path
+                )
+            )
+
+            logger.info(f"Uploading dataset for {model_name}")
+            uploads = asyncio.Semaphore(4)
+
+            async def upload(file_path: Path):
+                async with uploads:
+                    await instance.upload_file(
+                        str(file_path), f"{remote_dataset_path}/{file_path.name}"
+                    )
+
+            await asyncio.gather(*(upload(path) for path in dataset_path.glob("*")))
+
+            logger.info(f"Starting training for {model_name}")
+            try:
+                await instance.run_command(
+                    self._training_command(remote_config),
+                    idle_timeout=self.config.get("REMOTE_TRAINING_IDLE_TIMEOUT", 900),
+                    total_timeout=self.config.get("REMOTE_TRAINING_TIMEOUT", 3 * 3600),
+                    on_line=self._progress_parser("training", on_progress),
+                    keep_output=False,
+                )
+            except RemoteCommandError as e:
+                raise Exception(f"Training failed ({str(e)}) with log:\n{e.output}")
+
+            # Pull the weights while the GPU sets up and generates
+            remote_model_path = (
+                f"{self.remote_workspace}/output/{model_name}/{model_name}.safetensors"
+            )
+            temp_weights_path = self.base_path / f"{model_name}.safetensors"
+            weights_task = asyncio.create_task(
+                self._fetch_weights(
+                    instance, remote_model_path, temp_weights_path, on_weights
+                )
+            )
+
+            await self._setup_generation_environment(instance)
+
+            logger.info(f"Generating initial photobooks for {model_name}")
+            theme_prompts = self._theme_prompts(training_config)
+            try:
+                theme_images = await self.generate_all_theme_images(
+                    instance=instance,
+                    model_path=remote_model_path,
+                    theme_prompts=theme_prompts,
+                    run_name=model_name,
+                    on_image=on_image,
+                    on_progress=on_progress,
+                )
+            except Exception as e:
+                logger.error(
+                    f"Failed to generate initial photobooks: {str(e)}",
+                    exc_info=True,
+                )
+                theme_images = {theme_name: [] for theme_name in theme_prompts}
+
+            # Surface a failed download or publish before reporting success
+            await weights_task
+
+            return str(temp_weights_path), theme_images
+
+        except Exception as e:
+            logger.error(f"Training error for model {model_id}: {str(e)}")
+            raise
+
+        finally:
+            # The weights transfer needs the instance until it finishes
+            if weights_task:
+                await asyncio.wait([weights_task])
+
+            if instance is None and launch_task:
+                # Cancelled mid-launch: a launch still booting releases its own
+                # instance, one that already returned is terminated below
+                if not launch_task.done():
+                    launch_task.cancel()
+                await asyncio.wait([launch_task])
+                if not launch_task.cancelled() and not launch_task.exception():
+                    instance = launch_task.result()
+
+            if instance:
+                try:
+                    await asyncio.shield(self.terminate_instance(instance))
+                except Exception as e:
+                    logger.error(f"Failed to terminate instance: {str(e)}")
+
+            if dataset_path and dataset_path.exists():
+                try:
+                    await asyncio.to_thread(shutil.rmtree, dataset_path)
+                except Exception as e:
+                    logger.error(f"Cleanup error: {str(e)}")
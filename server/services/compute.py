@@ -0,0 +1,97 @@
+# server/services/compute.py
+
+import logging
+import re
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Callable
+
+logger = logging.getLogger(__name__)
+
+
+# Provider instance type names carry the GPU count, e.g. "gpu_8x_h100"
+GPU_COUNT_PATTERN = re.compile(r"gpu_(\d+)x_")
+
+
+def gpu_count_for_type(instance_type: str) -> int:
+    """Number of GPUs in an instance type, 1 if the name does not say"""
+    match = GPU_COUNT_PATTERN.match(instance_type or "")
+    return int(match.group(1)) if match else 1
+
+
+class ComputeInstance(ABC):
+    """A launched machine that can run commands and exchange files with the worker"""
+
+    instance_id: str
+    gpu_count: int = 1
+    # Directory on the instance that outlives it (an attached filesystem or
+    # one baked into the image), used to reuse environments between launches
+    env_cache_dir: Optional[str] = None
+
+    @abstractmethod
+    def run_command(
+        self,
+        command: str,
+        idle_timeout: Optional[float] = None,
+        total_timeout: Optional[float] = None,
+        on_line: Optional[Callable[[str], None]] = None,
+        keep_output: bool = True,
+    ) -> Dict[str, Any]:
+        """Run a command to completion, raising RemoteCommandError on failure"""
+
+    @abstractmethod
+    def execute_command(
+        self,
+        command: str,
+        idle_timeout: Optional[float] = 300,
+        total_timeout: Optional[float] = 1800,
+    ) -> str:
+        """Run a short command and return its output"""
+
+    @abstractmethod
+    def upload_file(self, local_path: str, remote_path: str):
+        """Copy a local file onto the instance"""
+
+    @abstractmethod
+    def download_file(self, remote_path: str, local_path: str):
+        """Copy a file from the instance to the worker"""
+
+    @abstractmethod
+    def download_dir(
+        self,
+        remote_dir: str,
+        local_dir: Path,
+        on_file: Optional[Callable[[Path], None]] = None,
+    ) -> List[Path]:
+        """Copy a whole directory, calling on_file as each file lands"""
+
+
+class ComputeBackend(ABC):
+    """Provider of GPU instances for training and generation"""
+
+    @abstractmethod
+    def launch(self, max_passes: Optional[int] = None) -> ComputeInstance:
+        """
+        Launch an instance and block until it accepts commands. Without
+        capacity this keeps retrying, or raises after max_passes rounds.
+        """
+
+    @abstractmethod
+    def terminate(self, instance: ComputeInstance):
+        """Release an instance"""
+
+
+def create_compute_backend(config: Dict[str, Any]) -> ComputeBackend:
+    """Build the backend selected by COMPUTE_BACKEND"""
+    backend = config.get("COMPUTE_BACKEND", "lambda")
+
+    if backend == "lambda":
+        from .ai_service import LambdaBackend
+
+        return LambdaBackend(config)
+    elif backend == "simulator":
+        from .compute_simulator import SimulatedBackend
+
+        return SimulatedBackend(config)
+    else:
+        raise ValueError(f"Invalid compute backend: {backend}")
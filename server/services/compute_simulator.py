@@ -0,0 +1,336 @@
+# server/services/compute_simulator.py
+
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Callable, Union
+
+from PIL import Image
+
+from .ai_service import LambdaAPIException, RemoteCommandError, RemoteCommandTimeout
+from .compute import ComputeBackend, ComputeInstance
+
+logger = logging.getLogger(__name__)
+
+# A duration is either a fixed number of seconds or a distribution spec such as
+# {"dist": "lognormal", "median": 120, "sigma": 0.3}
+Duration = Union[int, float, Dict[str, Any]]
+
+DEFAULT_SIMULATOR_CONFIG: Dict[str, Any] = {
+    "time_scale": 1.0,
+    "seed": None,
+    "root": str(Path(tempfile.gettempdir()) / "ai_simulator"),
+    "launch_latency": {"dist": "lognormal", "median": 150, "sigma": 0.3},
+    "capacity_error_rate": 0.2,
+    "capacity_retry_delay": {"dist": "uniform", "low": 5, "high": 20},
+    "setup_duration": {"dist": "normal", "mean": 240, "stddev": 30},
+    "training_duration": {"dist": "lognormal", "median": 1200, "sigma": 0.2},
+    "training_steps": 1000,
+    "training_failure_rate": 0.02,
+    "image_duration": {"dist": "normal", "mean": 4, "stddev": 0.5},
+    "generation_failure_rate": 0.01,
+    "transfer_mbps": 400,
+    "weights_size_mb": 16,
+    "image_size": 512,
+    "gpus_per_instance": 1,
+}
+
+
+def sample_duration(spec: Duration, rng: random.Random) -> float:
+    """Draw a non-negative duration in seconds from a number or distribution spec"""
+    if isinstance(spec, (int, float)):
+        return max(0.0, float(spec))
+
+    dist = spec.get("dist", "fixed")
+    if dist == "fixed":
+        value = spec["value"]
+    elif dist == "uniform":
+        value = rng.uniform(spec["low"], spec["high"])
+    elif dist == "normal":
+        value = rng.gauss(spec["mean"], spec["stddev"])
+    elif dist == "lognormal":
+        value = spec["median"] * math.exp(rng.gauss(0, spec["sigma"]))
+    elif dist == "exponential":
+        value = rng.expovariate(1.0 / spec["mean"])
+    else:
+        raise ValueError(f"Invalid duration distribution: {dist}")
+
+    return max(0.0, float(value))
+
+
+class SimulatedInstance(ComputeInstance):
+    """
+    Stand-in for a GPU instance backed by a local sandbox directory.
+
+    Remote paths are mapped under the sandbox. Commands are recognized by the
+    scripts they invoke: training sleeps for a sampled duration while printing
+    tqdm-style progress and then writes a weights file, generation reads the
+    manifest and writes one PNG per prompt, setup just takes time. Anything
+    else succeeds immediately.
+    """
+
+    def __init__(self, backend: "SimulatedBackend", rng: random.Random):
+        self.backend = backend
+        self.settings = backend.settings
+        self.rng = rng
+        self.instance_id = f"sim-{uuid.uuid4().hex[:12]}"
+        self.instance_ip = "127.0.0.1"
+        self.gpu_count = self.settings["gpus_per_instance"]
+        self.root = Path(self.settings["root"]) / self.instance_id
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.launched_at = time.monotonic()
+        self.run_names: Dict[str, str] = {}  # training config path -> run name
+
+    def _local(self, remote_path: str) -> Path:
+        """Map an absolute remote path into the sandbox"""
+        return self.root / remote_path.lstrip("/")
+
+    def _sleep(self, seconds: float):
+        time.sleep(seconds * self.settings["time_scale"])
+
+    def _transfer(self, size_bytes: int):
+        """Simulate network transfer time for size_bytes"""
+        self._sleep(size_bytes * 8 / (self.settings["transfer_mbps"] * 1_000_000))
+
+    def _run_for(
+        self,
+        seconds: float,
+        total_timeout: Optional[float],
+        emit: Optional[Callable[[float], None]] = None,
+        ticks: int = 20,
+    ):
+        """Sleep for seconds in ticks, honouring the command's total timeout"""
+        budget = seconds
+        if total_timeout is not None and seconds > total_timeout:
+            budget = total_timeout
+
+        for tick in range(1, ticks + 1):
+            self._sleep(budget / ticks)
+            if emit:
+                emit(min(tick * budget / seconds, 1.0) if seconds else 1.0)
+
+        if budget < seconds:
+            raise RemoteCommandTimeout(
+                f"Command exceeded total timeout of {total_timeout}s"
+            )
+
+    def _train(self, command: str, total_timeout: Optional[float], emit):
+        workspace = re.search(r"cd\s+(\S+)", command)
+        config_path = re.search(r"run\.py\s+(\S+)", command)
+        name = (
+            self.run_names.get(config_path.group(1), "model")
+            if config_path
+            else "model"
+        )
+        steps = self.settings["training_steps"]
+        duration = sample_duration(self.settings["training_duration"], self.rng)
+
+        def progress(fraction: float):
+            step = int(steps * fraction)
+            emit(f"{name}: {int(fraction * 100)}%| {step}/{steps} [sim, loss: 0.1]")
+
+        self._run_for(duration, total_timeout, progress)
+        if self.rng.random() < self.settings["training_failure_rate"]:
+            raise RemoteCommandError("Simulated training failure", exit_code=1)
+
+        base = workspace.group(1) if workspace else "/home/ubuntu/ai-toolkit"
+        weights = self._local(f"{base}/output/{name}/{name}.safetensors")
+        weights.parent.mkdir(parents=True, exist_ok=True)
+        with open(weights, "wb") as f:
+            f.truncate(int(self.settings["weights_size_mb"] * 1024 * 1024))
+
+    def _generate(self, command: str, total_timeout: Optional[float], emit):
+        manifest_path = re.search(r'MANIFEST_PATH="([^"]+)"', command)
+        if not manifest_path:
+            raise RemoteCommandError("Simulated generation needs a manifest", 2)
+        manifest = json.loads(self._local(manifest_path.group(1)).read_text())
+
+        total = sum(len(theme["prompts"]) for theme in manifest["themes"])
+        started = time.monotonic()
+        done = 0
+        size = self.settings["image_size"]
+
+        for theme in manifest["themes"]:
+            output_dir = self._local(theme["output_dir"])
+            output_dir.mkdir(parents=True, exist_ok=True)
+            for index, prompt in enumerate(theme["prompts"]):
+                self._sleep(sample_duration(self.settings["image_duration"], self.rng))
+                elapsed = (time.monotonic() - started) / self.settings["time_scale"]
+                if total_timeout is not None and elapsed > total_timeout:
+                    raise RemoteCommandTimeout(
+                        f"Command exceeded total timeout of {total_timeout}s"
+                    )
+
+                # Stable across processes, unlike hash() under PYTHONHASHSEED
+                color = tuple(
+                    hashlib.sha256(
+                        json.dumps([theme["name"], prompt, index]).encode()
+                    ).digest()[:3]
+                )
+                Image.new("RGB", (size, size), color).save(
+                    output_dir / f"gen_{index:03d}.png"
+                )
+                done += 1
+                emit(f"generating: {done}/{total} [sim]")
+
+        if self.rng.random() < self.settings["generation_failure_rate"]:
+            raise RemoteCommandError("Simulated generation failure", exit_code=1)
+
+    def run_command(
+        self,
+        command: str,
+        idle_timeout: Optional[float] = None,
+        total_timeout: Optional[float] = None,
+        on_line: Optional[Callable[[str], None]] = None,
+        keep_output: bool = True,
+    ) -> Dict[str, Any]:
+        """Simulate a remote command and return its output like LambdaInstance"""
+        output: List[str] = []
+
+        def emit(line: str):
+            if keep_output or len(output) < 200:
+                output.append(line)
+            if on_line:
+                on_line(line)
+
+        # Training configs are written with sed ... name: "X" ... > config.yaml
+        for name, config_path in re.findall(
+            r'name: "([^".*]+)".*?>\s*(\S+\.yaml)', command, re.S
+        ):
+            self.run_names[config_path] = name
+
+        if "run.py" in command:
+            self._train(command, total_timeout, emit)
+        elif "generate_batch.py" in command:
+            self._generate(command, total_timeout, emit)
+        elif "pip install" in command:
+            duration = sample_duration(self.settings["setup_duration"], self.rng)
+            self._run_for(duration, total_timeout, ticks=1)
+
+        return {"output": "\n".join(output), "exit_code": 0, "status": []}
+
+    def execute_command(
+        self,
+        command: str,
+        idle_timeout: Optional[float] = 300,
+        total_timeout: Optional[float] = 1800,
+    ) -> str:
+        return self.run_command(command, idle_timeout, total_timeout)["output"]
+
+    def upload_file(self, local_path: str, remote_path: str):
+        target = self._local(remote_path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(local_path, target)
+        self._transfer(target.stat().st_size)
+
+    def download_file(self, remote_path: str, local_path: str):
+        source = self._local(remote_path)
+        if not source.exists():
+            raise LambdaAPIException(f"SCP download failed: {remote_path} not found")
+        self._transfer(source.stat().st_size)
+        shutil.copyfile(source, local_path)
+
+    def download_dir(
+        self,
+        remote_dir: str,
+        local_dir: Path,
+        on_file: Optional[Callable[[Path], None]] = None,
+    ) -> List[Path]:
+        source_dir = self._local(remote_dir)
+        if not source_dir.is_dir():
+            raise LambdaAPIException(f"Directory download failed: {remote_dir}")
+
+        local_paths = []
+        for source in sorted(p for p in source_dir.rglob("*") if p.is_file()):
+            target = Path(local_dir) / source.relative_to(source_dir)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            self._transfer(source.stat().st_size)
+            shutil.copyfile(source, target)
+            local_paths.append(target)
+            if on_file:
+                on_file(target)
+        return local_paths
+
+
+class SimulatedBackend(ComputeBackend):
+    """
+    Offline stand-in for the GPU provider, used to load-test the worker,
+    queue and storage pipeline without renting GPUs.
+
+    Launch latency, capacity errors, training time and generation time are
+    drawn from the distributions in SIMULATOR_CONFIG. All sleeps are multiplied
+    by time_scale, so 0.01 replays a realistic load 100x faster.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.settings = {
+            **DEFAULT_SIMULATOR_CONFIG,
+            **(config.get("SIMULATOR_CONFIG") or {}),
+        }
+        if self.settings["time_scale"] <= 0:
+            raise ValueError("Simulator time_scale must be positive")
+
+        self.rng = random.Random(self.settings["seed"])
+        self.lock = threading.Lock()
+        self.stats = {
+            "launches": 0,
+            "capacity_errors": 0,
+            "active_instances": 0,
+            "peak_instances": 0,
+            "gpu_seconds": 0.0,
+        }
+
+    def _instance_rng(self) -> random.Random:
+        with self.lock:
+            return random.Random(self.rng.random())
+
+    def launch(self, max_passes: Optional[int] = None) -> SimulatedInstance:
+        rng = self._instance_rng()
+
+        passes = 0
+        while rng.random() < self.settings["capacity_error_rate"]:
+            with self.lock:
+                self.stats["capacity_errors"] += 1
+            passes += 1
+            if max_passes is not None and passes >= max_passes:
+                raise RuntimeError(f"Simulated insufficient capacity {passes} times")
+            logger.info("Simulated insufficient capacity, retrying")
+            delay = sample_duration(self.settings["capacity_retry_delay"], rng)
+            time.sleep(delay * self.settings["time_scale"])
+
+        latency = sample_duration(self.settings["launch_latency"], rng)
+        time.sleep(latency * self.settings["time_scale"])
+
+        instance = SimulatedInstance(self, rng)
+        with self.lock:
+            self.stats["launches"] += 1
+            self.stats["active_instances"] += 1
+            self.stats["peak_instances"] = max(
+                self.stats["peak_instances"], self.stats["active_instances"]
+            )
+        logger.info(f"Simulated instance {instance.instance_id} is active")
+        return instance
+
+    def terminate(self, instance: SimulatedInstance):
+        elapsed = time.monotonic() - instance.launched_at
+        with self.lock:
+            self.stats["active_instances"] -= 1
+            self.stats["gpu_seconds"] += (
+                instance.gpu_count * elapsed / self.settings["time_scale"]
+            )
+        shutil.rmtree(instance.root, ignore_errors=True)
+        logger.info(f"Terminated simulated instance {instance.instance_id}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters for benchmark runs (gpu_seconds is in simulated time)"""
+        with self.lock:
+            return dict(self.stats)
@@ -0,0 +1,77 @@
+# server/services/derivatives.py
+
+import io
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Optional
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Variant name -> longest side in pixels
+DEFAULT_DERIVATIVE_SIZES = {"thumb": 320, "medium": 1024}
+
+
+def render_derivatives(
+    image_data: bytes, sizes: Dict[str, int], quality: int
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Downsized WebP copies of an image, keyed by variant name.
+
+    Each variant is scaled so its longer side is at most the given size; a
+    variant at least as large as the original is encoded at full size.
+    """
+    derivatives = {}
+    with Image.open(io.BytesIO(image_data)) as original:
+        img = original.convert("RGBA" if "A" in original.getbands() else "RGB")
+        for variant, size in sizes.items():
+            resized = img
+            if max(img.size) > size:
+                scale = size / max(img.size)
+                resized = img.resize(
+                    (
+                        max(1, round(img.width * scale)),
+                        max(1, round(img.height * scale)),
+                    ),
+                    Image.Resampling.LANCZOS,
+                )
+            buffer = io.BytesIO()
+            resized.save(buffer, format="WEBP", quality=quality, method=4)
+            derivatives[variant] = {
+                "data": buffer.getvalue(),
+                "width": resized.width,
+                "height": resized.height,
+            }
+    return derivatives
+
+
+class DerivativeRenderer:
+    """Render image derivatives off the request and worker threads"""
+
+    def __init__(self, config: Dict[str, Any]):
+        self.sizes = config.get("IMAGE_DERIVATIVE_SIZES", DEFAULT_DERIVATIVE_SIZES)
+        self.quality = config.get("IMAGE_DERIVATIVE_QUALITY", 80)
+        self.max_workers = config.get("DERIVATIVE_WORKERS", 2)
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.lock = threading.Lock()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        """
+        Shared thread pool, started on first use. PIL releases the GIL while
+        resizing and encoding, and forking the threaded web server or worker
+        could leave a child stuck on a lock held by another thread.
+        """
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="derivatives"
+                )
+            return self.executor
+
+    def submit(self, image_data: bytes) -> Future:
+        """Start rendering every variant of an image"""
+        return self._executor().submit(
+            render_derivatives, image_data, self.sizes, self.quality
+        )
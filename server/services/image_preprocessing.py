@@ -0,0 +1,142 @@
+# server/services/image_preprocessing.py
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+CROP_MODES = ("none", "center", "face")
+
+
+def _face_box(img: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+    """Return (left, top, right, bottom) of the largest face, if any is found."""
+    try:
+        import cv2
+        import numpy as np
+    except ImportError:
+        logger.warning("OpenCV not installed, falling back to center crop")
+        return None
+
+    gray = np.asarray(img.convert("L"))
+    cascade = cv2.CascadeClassifier(
+        cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+    )
+    faces = cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+    if len(faces) == 0:
+        return None
+
+    x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+    return int(x), int(y), int(x + w), int(y + h)
+
+
+def _square_crop(img: Image.Image, crop: str) -> Image.Image:
+    """Crop to a square, centered on the image or on the largest face."""
+    width, height = img.size
+    side = min(width, height)
+    center_x, center_y = width / 2, height / 2
+
+    if crop == "face":
+        box = _face_box(img)
+        if box:
+            left, top, right, bottom = box
+            center_x, center_y = (left + right) / 2, (top + bottom) / 2
+            # Keep head and shoulders in frame rather than a tight face crop
+            side = min(side, max(int(2.5 * max(right - left, bottom - top)), 1))
+
+    left = int(min(max(center_x - side / 2, 0), width - side))
+    top = int(min(max(center_y - side / 2, 0), height - side))
+    return img.crop((left, top, left + side, top + side))
+
+
+def preprocess_image(
+    source: str, destination: str, resolution: int, crop: str, quality: int
+) -> Dict[str, Any]:
+    """
+    Normalize one training image and write it as JPEG.
+
+    Applies EXIF orientation, flattens transparency onto white, optionally
+    crops to a square, downsizes so the longer side is at most resolution and
+    re-encodes without metadata, so the same input always yields the same bytes.
+    """
+    with Image.open(source) as original:
+        img = ImageOps.exif_transpose(original)
+
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        if crop in ("center", "face"):
+            img = _square_crop(img, crop)
+
+        if max(img.size) > resolution:
+            scale = resolution / max(img.size)
+            size = (
+                max(1, round(img.width * scale)),
+                max(1, round(img.height * scale)),
+            )
+            img = img.resize(size, Image.Resampling.LANCZOS)
+
+        img.save(destination, format="JPEG", quality=quality, optimize=True)
+
+        return {
+            "path": destination,
+            "width": img.width,
+            "height": img.height,
+            "file_size": Path(destination).stat().st_size,
+        }
+
+
+class ImagePreprocessor:
+    """Prepare training images on the worker host before they are uploaded"""
+
+    def __init__(self, config: Dict[str, Any]):
+        self.resolution = config.get("TRAINING_IMAGE_RESOLUTION", 1024)
+        self.crop = config.get("TRAINING_IMAGE_CROP", "none")
+        self.quality = config.get("TRAINING_IMAGE_QUALITY", 95)
+        self.max_workers = config.get("PREPROCESS_WORKERS", 4)
+
+        if self.crop not in CROP_MODES:
+            raise ValueError(f"Invalid crop mode: {self.crop}")
+
+    def _executor(self, jobs: int) -> ThreadPoolExecutor:
+        """
+        Thread pool sized for the batch. PIL and OpenCV release the GIL while
+        decoding, resizing and encoding, and forking the multithreaded worker
+        could leave a child stuck on a lock held by another thread.
+        """
+        return ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, jobs)))
+
+    def process_images(self, pairs: List[Tuple[Path, Path]]) -> List[Dict[str, Any]]:
+        """Preprocess (source, destination) pairs in parallel, keeping order"""
+        if not pairs:
+            return []
+
+        sources = [str(source) for source, _ in pairs]
+        destinations = [str(destination) for _, destination in pairs]
+
+        with self._executor(len(pairs)) as executor:
+            results = list(
+                executor.map(
+                    preprocess_image,
+                    sources,
+                    destinations,
+                    repeat(self.resolution),
+                    repeat(self.crop),
+                    repeat(self.quality),
+                )
+            )
+
+        total_bytes = sum(result["file_size"] for result in results)
+        logger.info(
+            f"Preprocessed {len(results)} training images ({total_bytes} bytes)"
+        )
+        return results
@@ -0,0 +1,461 @@
+# server/services/lambda_client.py
+
+import email.utils
+import logging
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future
+from typing import Dict, Any, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+LAMBDA_API_URL = "https://cloud.lambdalabs.com/api/v1"
+
+# Instance ids are collapsed so metrics group by endpoint, not by instance
+ENDPOINT_ID_PATTERN = re.compile(r"^instances/[^/]+")
+
+
+class LambdaAPIException(Exception):
+    """Custom exception for Lambda API errors."""
+
+    pass
+
+
+class LambdaHTTPError(LambdaAPIException):
+    """Lambda API answered with an error status."""
+
+    def __init__(self, message: str, status_code: int, error: Optional[Dict] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error = error or {}  # e.g. {"code": "...", "message": "..."}
+
+    @property
+    def code(self) -> str:
+        return self.error.get("code", "")
+
+
+class LambdaTimeout(LambdaAPIException):
+    """Lambda API request timed out."""
+
+    pass
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at rate tokens per second, up to burst.
+
+    reserve() takes a token, possibly one that will only exist in the future,
+    and returns how long the caller must wait before using it, so it works the
+    same for threads (time.sleep) and coroutines (asyncio.sleep).
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds: float):
+        """Hold every caller back for seconds, e.g. after a 429"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class LambdaClient:
+    """
+    Lambda Cloud API client shared by every instance and backend in a process.
+
+    Requests go through one keep-alive session and one token bucket, so
+    concurrent workers spend a common request budget and all back off
+    together when the API answers 429 (honouring Retry-After). GET responses
+    are cached for a few seconds, which lets callers polling the same
+    instance share a lookup. Latency and error counts are kept per endpoint.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.base_url = LAMBDA_API_URL
+        self.api_key = config["LAMBDA_API_KEY"]
+        self.timeout = config.get("LAMBDA_API_TIMEOUT", 30)
+        self.max_retries = config.get("LAMBDA_API_MAX_RETRIES", 3)
+        self.cache_ttl = config.get("LAMBDA_API_CACHE_TTL", 2.0)
+
+        self.session = requests.Session()
+        self.session.headers.update(
+            {
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json",
+            }
+        )
+        pool_size = config.get("LAMBDA_API_POOL_SIZE", 20)
+        self.session.mount(
+            "https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        )
+
+        self.rate_limiter = TokenBucket(
+            config.get("LAMBDA_API_RATE_LIMIT", 1.0),
+            config.get("LAMBDA_API_BURST", 5),
+        )
+
+        self.lock = threading.Lock()
+        self.cache: Dict[str, Tuple[float, Dict]] = {}  # endpoint -> (expiry, body)
+        self.metrics: Dict[str, Dict[str, Any]] = defaultdict(
+            lambda: {
+                "requests": 0,
+                "errors": 0,
+                "rate_limited": 0,
+                "cache_hits": 0,
+                "latencies_ms": deque(maxlen=200),
+            }
+        )
+
+    @staticmethod
+    def endpoint_key(method: str, endpoint: str) -> str:
+        return f"{method.upper()} {ENDPOINT_ID_PATTERN.sub('instances/{id}', endpoint)}"
+
+    def cached(self, method: str, endpoint: str) -> Optional[Dict]:
+        """Fresh cached body for an idempotent request, if any"""
+        if method.upper() != "GET" or self.cache_ttl <= 0:
+            return None
+        with self.lock:
+            entry = self.cache.get(endpoint)
+            if entry and entry[0] > time.monotonic():
+                self.metrics[self.endpoint_key(method, endpoint)]["cache_hits"] += 1
+                return entry[1]
+        return None
+
+    def store(self, method: str, endpoint: str, body: Dict):
+        """Cache a GET body; anything else changes state, so drop the cache"""
+        with self.lock:
+            if method.upper() == "GET":
+                if self.cache_ttl > 0:
+                    self.cache[endpoint] = (time.monotonic() + self.cache_ttl, body)
+            else:
+                self.cache.clear()
+
+    def record(
+        self,
+        method: str,
+        endpoint: str,
+        started: float,
+        status: Optional[int],
+    ):
+        """Record one request's latency and outcome (status None on timeout)"""
+        elapsed_ms = (time.monotonic() - started) * 1000
+        key = self.endpoint_key(method, endpoint)
+        with self.lock:
+            metrics = self.metrics[key]
+            metrics["requests"] += 1
+            metrics["latencies_ms"].append(elapsed_ms)
+            if status is None or status >= 400:
+                metrics["errors"] += 1
+            if status == 429:
+                metrics["rate_limited"] += 1
+        logger.debug(f"Lambda API {key} -> {status} in {elapsed_ms:.0f}ms")
+
+    def rate_limited(self, retry_after: Optional[str], attempt: int) -> float:
+        """Back every caller off after a 429 and return the delay to wait"""
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            delay = 2.0 ** (attempt + 1)
+        self.rate_limiter.pause(delay)
+        logger.warning(f"Lambda API rate limited, backing off {delay:.1f}s")
+        return delay
+
+    def request(
+        self,
+        method: str,
+        endpoint: str,
+        data: Optional[Dict] = None,
+        timeout: Optional[float] = None,
+        use_cache: bool = True,
+    ) -> Dict:
+        """
+        Make a rate-limited request to the Lambda API and return its JSON body.
+
+        429s are retried up to LAMBDA_API_MAX_RETRIES times. Other error
+        statuses raise LambdaHTTPError carrying the API's error object.
+        """
+        if use_cache:
+            body = self.cached(method, endpoint)
+            if body is not None:
+                return body
+
+        url = f"{self.base_url}/{endpoint}"
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self.rate_limiter.reserve())
+
+            started = time.monotonic()
+            try:
+                response = self.session.request(
+                    method, url, json=data, timeout=timeout or self.timeout
+                )
+            except requests.exceptions.Timeout:
+                self.record(method, endpoint, started, None)
+                logger.error(f"Lambda API request {method} {endpoint} timed out")
+                raise LambdaTimeout("Request timed out")
+            except requests.exceptions.RequestException as e:
+                self.record(method, endpoint, started, None)
+                logger.error(f"Lambda API request failed: {str(e)}")
+                raise LambdaAPIException(f"Request failed: {str(e)}")
+
+            self.record(method, endpoint, started, response.status_code)
+
+            if response.status_code == 429 and attempt < self.max_retries:
+                time.sleep(
+                    self.rate_limited(response.headers.get("Retry-After"), attempt)
+                )
+                continue
+
+            if response.status_code >= 400:
+                try:
+                    error = response.json().get("error", {})
+                except ValueError:
+                    error = {}
+                if response.status_code == 429:
+                    self.rate_limited(response.headers.get("Retry-After"), attempt)
+                raise LambdaHTTPError(
+                    f"HTTP error {response.status_code} for {method} {endpoint}: {error}",
+                    response.status_code,
+                    error,
+                )
+
+            body = response.json()
+            self.store(method, endpoint, body)
+            return body
+
+    def get(self, endpoint: str, **kwargs) -> Dict:
+        return self.request("GET", endpoint, **kwargs)
+
+    def post(self, endpoint: str, data: Optional[Dict] = None, **kwargs) -> Dict:
+        return self.request("POST", endpoint, data, **kwargs)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-endpoint request counts and latency percentiles in ms"""
+        stats = {}
+        with self.lock:
+            for key, metrics in self.metrics.items():
+                latencies = sorted(metrics["latencies_ms"])
+                stats[key] = {
+                    "requests": metrics["requests"],
+                    "errors": metrics["errors"],
+                    "rate_limited": metrics["rate_limited"],
+                    "cache_hits": metrics["cache_hits"],
+                    "p50_ms": (
+                        round(latencies[len(latencies) // 2], 1) if latencies else None
+                    ),
+                    "p95_ms": (
+                        round(latencies[int(len(latencies) * 0.95)], 1)
+                        if latencies
+                        else None
+                    ),
+                    "max_ms": round(latencies[-1], 1) if latencies else None,
+                }
+        return stats
+
+
+class InstanceWatcher:
+    """
+    Waits for launched instances to become active with one list call per
+    poll for all of them, instead of a lookup loop per waiting worker.
+
+    watch() returns a Future resolved with the instance's API record once it
+    is active, or failed with LambdaAPIException. A single daemon thread
+    polls while anything is pending: every fast_interval seconds while some
+    instance is inside its usual boot window, every slow_interval seconds
+    once they all have outlived it.
+    """
+
+    FAILED_STATUSES = ("error", "failed", "terminating", "terminated")
+
+    def __init__(self, client: LambdaClient, config: Dict[str, Any]):
+        self.client = client
+        self.fast_interval = config.get("LAMBDA_POLL_FAST_INTERVAL", 3.0)
+        self.slow_interval = config.get("LAMBDA_POLL_SLOW_INTERVAL", 15.0)
+        self.boot_window = config.get("LAMBDA_BOOT_WINDOW", 300)
+        self.max_poll_failures = config.get("LAMBDA_POLL_MAX_FAILURES", 5)
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pending: Dict[str, Dict[str, Any]] = {}  # instance id -> watch
+        self.thread: Optional[threading.Thread] = None
+        self.stats = {"polls": 0, "poll_failures": 0, "resolved": 0, "failed": 0}
+
+    def watch(self, instance_id: str, timeout: float = 3600) -> Future:
+        """Future for an instance becoming active within timeout seconds"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.pending.get(instance_id)
+            if entry is None or entry["future"].done():
+                entry = {
+                    "future": Future(),
+                    "started": now,
+                    "deadline": now + timeout,
+                }
+                self.pending[instance_id] = entry
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+        return entry["future"]
+
+    def _interval(self) -> float:
+        """Fast while any pending instance is still in its boot window (lock held)"""
+        now = time.monotonic()
+        booting = any(
+            now - entry["started"] < self.boot_window for entry in self.pending.values()
+        )
+        return self.fast_interval if booting else self.slow_interval
+
+    def _resolve(self, instance_id: str, result=None, error: Exception = None):
+        with self.lock:
+            entry = self.pending.pop(instance_id, None)
+        # A waiter that timed out or was cancelled has already settled the
+        # future; claiming it first also stops a cancel racing the result
+        if entry is None or entry["future"].done():
+            return
+        if not entry["future"].set_running_or_notify_cancel():
+            return
+        if error:
+            self.stats["failed"] += 1
+            entry["future"].set_exception(error)
+        else:
+            self.stats["resolved"] += 1
+            entry["future"].set_result(result)
+
+    def _poll(self):
+        """Match one list-instances response against every pending watch"""
+        response = self.client.request("GET", "instances")
+        self.stats["polls"] += 1
+        instances = {item.get("id"): item for item in response.get("data", [])}
+
+        with self.lock:
+            pending = list(self.pending.items())
+
+        now = time.monotonic()
+        for instance_id, entry in pending:
+            data = instances.get(instance_id)
+            status = (data or {}).get("status", "").strip().lower()
+
+            if status == "active":
+                if data.get("ip"):
+                    logger.info(f"Instance {instance_id} is active at {data['ip']}")
+                    self._resolve(instance_id, data)
+                else:
+                    self._resolve(
+                        instance_id, error=LambdaAPIException("Instance IP not found")
+                    )
+            elif status in self.FAILED_STATUSES:
+                self._resolve(
+                    instance_id,
+                    error=LambdaAPIException(f"Instance failed with status: {status}"),
+                )
+            elif now > entry["deadline"]:
+                self._resolve(
+                    instance_id, error=LambdaAPIException("Instance startup timeout")
+                )
+
+    def _run(self):
+        try:
+            self._poll_loop()
+        except Exception as e:
+            # Never leave waiters hanging on a poll thread that has died
+            logger.error(f"Instance watcher stopped: {str(e)}")
+            error = LambdaAPIException(f"Instance watcher stopped: {str(e)}")
+            with self.lock:
+                waiting = list(self.pending)
+                self.thread = None
+            for instance_id in waiting:
+                self._resolve(instance_id, error=error)
+
+    def _poll_loop(self):
+        failures = 0
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.thread = None
+                    return
+                interval = self._interval()
+
+            try:
+                self._poll()
+                failures = 0
+            except Exception as e:
+                if not isinstance(e, LambdaAPIException):
+                    e = LambdaAPIException(f"Instance status poll failed: {str(e)}")
+                failures += 1
+                self.stats["poll_failures"] += 1
+                logger.warning(f"Instance status poll failed ({failures}): {str(e)}")
+                if failures >= self.max_poll_failures:
+                    with self.lock:
+                        waiting = list(self.pending)
+                    for instance_id in waiting:
+                        self._resolve(instance_id, error=e)
+                    failures = 0
+                    continue
+
+            # New watches wake the loop so a fresh launch is checked promptly
+            self.wakeup.wait(interval)
+            self.wakeup.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {**self.stats, "pending": len(self.pending)}
+
+
+_clients: Dict[str, LambdaClient] = {}
+_watchers: Dict[str, InstanceWatcher] = {}
+_clients_lock = threading.Lock()
+
+
+def get_lambda_client(config: Dict[str, Any]) -> LambdaClient:
+    """Process-wide client for the configured API key"""
+    with _clients_lock:
+        client = _clients.get(config["LAMBDA_API_KEY"])
+        if client is None:
+            client = LambdaClient(config)
+            _clients[config["LAMBDA_API_KEY"]] = client
+        return client
+
+
+def get_instance_watcher(config: Dict[str, Any]) -> InstanceWatcher:
+    """Process-wide instance watcher for the configured API key"""
+    client = get_lambda_client(config)
+    with _clients_lock:
+        watcher = _watchers.get(config["LAMBDA_API_KEY"])
+        if watcher is None:
+            watcher = InstanceWatcher(client, config)
+            _watchers[config["LAMBDA_API_KEY"]] = watcher
+        return watcher
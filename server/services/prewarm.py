@@ -0,0 +1,208 @@
+# server/services/prewarm.py
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+from .compute import ComputeBackend, ComputeInstance
+
+logger = logging.getLogger(__name__)
+
+
+class PrewarmPool(ComputeBackend):
+    """
+    Speculatively launched instances that training jobs can claim.
+
+    Wraps the real backend. request() is called when a training is likely to
+    follow, e.g. as soon as an upload starts, and launches an instance in the
+    background so the job does not pay the launch latency. launch() hands out
+    a warm instance if there is one, waits for a speculative launch already in
+    flight, and only then launches normally. Besides explicit requests, the
+    pool keeps enough instances warm to cover the recent request rate over
+    the average launch time. Instances nobody claims within PREWARM_IDLE_TIMEOUT
+    seconds are terminated, and the forecast is then ignored until a warm
+    instance is claimed again, so an over-forecast does not keep launching
+    and expiring billed instances. The pool only tops up on request() and
+    claim(), never from the reaper.
+    """
+
+    def __init__(self, config: Dict[str, Any], backend: ComputeBackend):
+        self.backend = backend
+        self.max_instances = config.get("PREWARM_MAX_INSTANCES", 2)
+        self.idle_timeout = config.get("PREWARM_IDLE_TIMEOUT", 600)
+        self.forecast_window = config.get("PREWARM_FORECAST_WINDOW", 3600)
+        self.claim_wait = config.get("PREWARM_CLAIM_WAIT", 30)
+        self.launch_attempts = max(1, config.get("PREWARM_LAUNCH_ATTEMPTS", 3))
+        self.launch_backoff = config.get("PREWARM_LAUNCH_BACKOFF", 60)
+
+        self.condition = threading.Condition()
+        self.ready: List[Tuple[ComputeInstance, float]] = []  # (instance, ready_at)
+        self.launching = 0
+        self.requests: deque = deque()  # request times within forecast_window
+        self.unclaimed_requests = 0
+        self.requesters: Dict[Any, float] = {}  # key -> last request time
+        self.launch_seconds = 180.0  # moving average, seeded with a typical boot
+        self.forecast_suspended = False  # set by an expiry, cleared by a claim
+        self.stats = {
+            "requested": 0,
+            "launched": 0,
+            "claimed": 0,
+            "expired": 0,
+            "launch_failures": 0,
+        }
+
+        self.reaper = threading.Thread(target=self._reaper_loop, daemon=True)
+        self.reaper.start()
+
+    def _forecast(self, now: float) -> int:
+        """Instances to keep warm for the recent request rate (lock held)"""
+        if not self.forecast_window or self.forecast_suspended:
+            return 0
+        while self.requests and now - self.requests[0] > self.forecast_window:
+            self.requests.popleft()
+        rate = len(self.requests) / self.forecast_window
+        return int(rate * self.launch_seconds + 0.5)
+
+    def _top_up(self):
+        """Launch until the pool covers expected demand (lock held)"""
+        warm = len(self.ready) + self.launching
+        wanted = min(
+            self.max_instances,
+            max(self.unclaimed_requests, self._forecast(time.monotonic())),
+        )
+        for _ in range(wanted - warm):
+            self.launching += 1
+            threading.Thread(target=self._launch_one, daemon=True).start()
+
+    def _launch_one(self):
+        """
+        Speculative launch, a single pass over the backend's capacity per
+        attempt. Gives up after PREWARM_LAUNCH_ATTEMPTS, backing off between
+        attempts, rather than holding a launch slot until capacity returns.
+        """
+        instance = None
+        for attempt in range(self.launch_attempts):
+            if attempt:
+                time.sleep(self.launch_backoff * 2 ** (attempt - 1))
+            started = time.monotonic()
+            try:
+                instance = self.backend.launch(max_passes=1)
+                elapsed = time.monotonic() - started
+                logger.info(
+                    f"Prewarmed instance {instance.instance_id} in {elapsed:.0f}s"
+                )
+                break
+            except Exception as e:
+                logger.warning(
+                    f"Speculative launch attempt {attempt + 1}/"
+                    f"{self.launch_attempts} failed: {str(e)}"
+                )
+        if not instance:
+            logger.error("Giving up on speculative launch")
+
+        with self.condition:
+            self.launching -= 1
+            if instance:
+                self.launch_seconds = 0.8 * self.launch_seconds + 0.2 * elapsed
+                self.ready.append((instance, time.monotonic()))
+                self.stats["launched"] += 1
+            else:
+                self.stats["launch_failures"] += 1
+            self.condition.notify_all()
+
+    def request(self, reason: str = "upload", key: Any = None):
+        """
+        Signal that a training job is about to be queued. Repeated requests
+        with the same key (e.g. a user id) within the idle timeout count once.
+        """
+        with self.condition:
+            now = time.monotonic()
+            if key is not None:
+                last = self.requesters.get(key)
+                self.requesters[key] = now
+                if last is not None and now - last <= self.idle_timeout:
+                    return
+            self.stats["requested"] += 1
+            self.requests.append(now)
+            self.unclaimed_requests += 1
+            logger.info(f"Prewarm requested ({reason})")
+            self._top_up()
+
+    def claim(self) -> Optional[ComputeInstance]:
+        """
+        Take a warm instance, waiting up to PREWARM_CLAIM_WAIT seconds for an
+        in-flight speculative launch that is likely further along than a new
+        one. None if the pool has nothing by then, and the caller launches.
+        """
+        deadline = time.monotonic() + self.claim_wait
+        with self.condition:
+            while not self.ready and self.launching:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            self.unclaimed_requests = max(0, self.unclaimed_requests - 1)
+            if not self.ready:
+                return None
+            instance, _ = self.ready.pop()
+            self.stats["claimed"] += 1
+            self.forecast_suspended = False
+            self._top_up()
+        logger.info(f"Claimed prewarmed instance {instance.instance_id}")
+        return instance
+
+    def launch(self, max_passes: Optional[int] = None) -> ComputeInstance:
+        return self.claim() or self.backend.launch(max_passes)
+
+    def terminate(self, instance: ComputeInstance):
+        self.backend.terminate(instance)
+
+    def _reaper_loop(self):
+        """Release instances left unclaimed past the idle timeout"""
+        while True:
+            time.sleep(min(30, self.idle_timeout))
+            now = time.monotonic()
+            with self.condition:
+                expired = [
+                    instance
+                    for instance, ready_at in self.ready
+                    if now - ready_at > self.idle_timeout
+                ]
+                self.ready = [
+                    (instance, ready_at)
+                    for instance, ready_at in self.ready
+                    if now - ready_at <= self.idle_timeout
+                ]
+                self.requesters = {
+                    key: last
+                    for key, last in self.requesters.items()
+                    if now - last <= self.idle_timeout
+                }
+                if expired:
+                    # Requests that never turned into jobs stop counting, and
+                    # the forecast overshot, so stop acting on it for now
+                    self.unclaimed_requests = max(
+                        0, self.unclaimed_requests - len(expired)
+                    )
+                    self.forecast_suspended = True
+                self.stats["expired"] += len(expired)
+
+            for instance in expired:
+                logger.info(f"Releasing unclaimed instance {instance.instance_id}")
+                try:
+                    self.backend.terminate(instance)
+                except Exception as e:
+                    logger.error(f"Failed to terminate idle instance: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.condition:
+            prewarm = {
+                **self.stats,
+                "ready": len(self.ready),
+                "launching": self.launching,
+                "avg_launch_seconds": round(self.launch_seconds, 1),
+            }
+        stats = self.backend.get_stats() if hasattr(self.backend, "get_stats") else {}
+        return {**stats, "prewarm": prewarm}
@@ -31,6 +31,9 @@ class JobQueue:
         
         # Status hash
         self.job_status_hash = 'job_statuses'
+        # Progress lives apart from the job data so progress updates can
+        # never overwrite a status change made at the same time
+        self.job_progress_hash = 'job_progress'
 
     def enqueue_job(self, job_type: JobType, user_id: int, payload: Dict[str, Any]) -> str:
         try:
@@ -68,33 +71,90 @@ class JobQueue:
             logger.error(f"Error enqueuing job: {str(e)}")
             raise
 
+    def _processing_list(self, queue_name: str) -> str:
+        """List holding job IDs between being popped and being loaded"""
+        return f'{queue_name}:processing'
+
+    def _claim_job(self, queue_name: str, job_id: bytes) -> Optional[Dict[str, Any]]:
+        """
+        Load a job moved onto the processing list, then drop it from there.
+        If loading fails the job goes back to the head of its queue.
+        """
+        processing = self._processing_list(queue_name)
+        try:
+            job_data = self.redis_client.hget(self.job_status_hash, job_id.decode('utf-8'))
+        except Exception:
+            self.redis_client.lrem(processing, 1, job_id)
+            self.redis_client.lpush(queue_name, job_id)
+            raise
+
+        self.redis_client.lrem(processing, 1, job_id)
+        return json.loads(job_data) if job_data else None
+
     def dequeue_job(self, queue_name: str) -> Optional[Dict[str, Any]]:
         """Get next job from queue"""
         try:
-            # Get job ID using blocking pop (waits for new jobs)
-            result = self.redis_client.blpop(queue_name, timeout=1)
-            if not result:
-                return None
-                
-            _, job_id = result
-            job_id = job_id.decode('utf-8')
-            
-            # Get job data
-            job_data = self.redis_client.hget(self.job_status_hash, job_id)
-            if not job_data:
+            # Get job ID using blocking move (waits for new jobs). The ID sits
+            # on the processing list until the job is loaded, so a crash in
+            # between leaves it there for recover_jobs() instead of losing it
+            job_id = self.redis_client.blmove(
+                queue_name, self._processing_list(queue_name), 1, 'LEFT', 'RIGHT'
+            )
+            if not job_id:
                 return None
-                
-            return json.loads(job_data)
-            
+
+            return self._claim_job(queue_name, job_id)
+
         except Exception as e:
             logger.error(f"Error dequeuing job: {str(e)}")
             return None
-        
+
+    def dequeue_jobs(self, queue_name: str, max_jobs: int) -> List[Dict[str, Any]]:
+        """Get up to max_jobs jobs from queue, waiting only for the first"""
+        jobs = []
+        try:
+            job = self.dequeue_job(queue_name)
+            if not job:
+                return jobs
+            jobs.append(job)
+
+            # Take whatever else is already waiting, without blocking
+            while len(jobs) < max_jobs:
+                job_id = self.redis_client.lmove(
+                    queue_name, self._processing_list(queue_name), 'LEFT', 'RIGHT'
+                )
+                if not job_id:
+                    break
+
+                job = self._claim_job(queue_name, job_id)
+                if job:
+                    jobs.append(job)
+
+            return jobs
+
+        except Exception as e:
+            logger.error(f"Error dequeuing jobs: {str(e)}")
+            return jobs
+
+    def recover_jobs(self) -> int:
+        """Put jobs left on processing lists by a crashed worker back in their queues"""
+        recovered = 0
+        try:
+            for queue_name in (self.training_queue, self.photobook_queue, self.generation_queue):
+                processing = self._processing_list(queue_name)
+                while self.redis_client.lmove(processing, queue_name, 'RIGHT', 'LEFT'):
+                    recovered += 1
+            if recovered:
+                logger.info(f"Recovered {recovered} jobs from processing lists")
+        except Exception as e:
+            logger.error(f"Error recovering jobs: {str(e)}")
+        return recovered
+
     def get_all_jobs(self) -> List[Dict[str, Any]]:
         """Retrieve all jobs from the job_status_hash."""
         try:
             all_jobs = self.redis_client.hgetall(self.job_status_hash)
-            return [json.loads(job_data) for job_data in all_jobs.values()]
+            return self._with_progress(all_jobs)
         except Exception as e:
             logger.error(f"Error getting all jobs: {str(e)}")
             return [] 
@@ -128,11 +188,34 @@ class JobQueue:
             logger.error(f"Error updating job status: {str(e)}")
             return False
 
+    def update_job_progress(self, job_id: str, progress: Dict[str, Any]) -> bool:
+        """Record progress of a running job without touching its status"""
+        try:
+            if not self.redis_client.hexists(self.job_status_hash, job_id):
+                return False
+
+            self.redis_client.hset(
+                self.job_progress_hash,
+                job_id,
+                json.dumps({
+                    **progress,
+                    'updated_at': datetime.utcnow().isoformat()
+                })
+            )
+
+            return True
+
+        except Exception as e:
+            logger.error(f"Error updating job progress: {str(e)}")
+            return False
+
     def get_job_status(self, job_id: str) -> Optional[Dict[str, Any]]:
         """Get job status and data"""
         try:
             job_data = self.redis_client.hget(self.job_status_hash, job_id)
-            return json.loads(job_data) if job_data else None
+            if not job_data:
+                return None
+            return self._with_progress({job_id: job_data})[0]
         except Exception as e:
             logger.error(f"Error getting job status: {str(e)}")
             return None
@@ -189,6 +272,7 @@ class JobQueue:
                 job_id,
                 json.dumps(job)
             )
+            self.redis_client.hdel(self.job_progress_hash, job_id)
             
             # Re-queue job
             queue = self.training_queue if job['job_type'] == JobType.MODEL_TRAINING.value else self.generation_queue
@@ -203,11 +287,11 @@ class JobQueue:
         """Retrieve all jobs for a specific user."""
         try:
             all_jobs = self.redis_client.hgetall(self.job_status_hash)
-            user_jobs = [
-                json.loads(job_data) for job_data in all_jobs.values()
+            user_jobs = {
+                job_id: job_data for job_id, job_data in all_jobs.items()
                 if job_data and json.loads(job_data).get('user_id') == user_id
-            ]
-            return user_jobs
+            }
+            return self._with_progress(user_jobs)
         except Exception as e:
             logger.error(f"Error getting jobs for user {user_id}: {str(e)}")
             return [] 
@@ -216,6 +300,7 @@ class JobQueue:
         """Remove a job from the status hash"""
         try:
             # Delete job from status hash
+            self.redis_client.hdel(self.job_progress_hash, job_id)
             return self.redis_client.hdel(self.job_status_hash, job_id) > 0
         except Exception as e:
             logger.error(f"Error removing job {job_id}: {str(e)}")
@@ -226,10 +311,13 @@ class JobQueue:
         try:
             # Clear job status hash
             self.redis_client.delete(self.job_status_hash)
+            self.redis_client.delete(self.job_progress_hash)
             # Clear all queues
             self.redis_client.delete(self.training_queue)
             self.redis_client.delete(self.generation_queue)
             self.redis_client.delete(self.photobook_queue)
+            for queue_name in (self.training_queue, self.generation_queue, self.photobook_queue):
+                self.redis_client.delete(self._processing_list(queue_name))
             logger.info("All job statuses and queues reset successfully")
             return True
         except Exception as e:
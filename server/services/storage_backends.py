@@ -0,0 +1,578 @@
+# server/services/storage_backends.py
+
+import base64
+import hashlib
+import hmac
+import io
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Dict, Any, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+import boto3
+
+from models import StorageType
+
+logger = logging.getLogger(__name__)
+
+# Read size for streams written to local disk
+LOCAL_CHUNK_SIZE = 1024 * 1024
+
+# Chunk size of streamed reads
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# Most keys S3 accepts in one DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+
+
+class StorageBackend(ABC):
+    """Object store holding the files that StorageLocation records point at"""
+
+    storage_type: StorageType
+    bucket: str
+
+    @abstractmethod
+    def put_bytes(
+        self,
+        path: str,
+        data: bytes,
+        content_type: str,
+        public: bool = False,
+        metadata: Optional[Dict[str, str]] = None,
+    ):
+        """Store a small object held in memory"""
+
+    @abstractmethod
+    def put_stream(
+        self, file_obj: BinaryIO, path: str, content_type: str, public: bool = False
+    ) -> Tuple[int, str]:
+        """Store a stream in one read pass, returning its size and SHA256"""
+
+    @abstractmethod
+    def delete(self, bucket: str, path: str):
+        """Remove an object"""
+
+    def delete_many(self, bucket: str, paths: List[str]) -> List[str]:
+        """Remove several objects, returning the paths that could not be removed"""
+        failed = []
+        for path in paths:
+            try:
+                self.delete(bucket, path)
+            except Exception as e:
+                logger.error(f"Failed to delete {bucket}/{path}: {str(e)}")
+                failed.append(path)
+        return failed
+
+    @abstractmethod
+    def read(self, bucket: str, path: str) -> bytes:
+        """Whole contents of an object"""
+
+    @abstractmethod
+    def stream(
+        self,
+        bucket: str,
+        path: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> Iterator[bytes]:
+        """Chunks of an object, or of its inclusive byte range start-end"""
+
+    @abstractmethod
+    def download_to_path(self, bucket: str, path: str, local_path: str):
+        """Copy an object to a local file without holding it in memory"""
+
+    @abstractmethod
+    def size(self, bucket: str, path: str) -> int:
+        """Size of an object in bytes"""
+
+    @abstractmethod
+    def presign(self, bucket: str, path: str, expires_in: int) -> str:
+        """URL that lets anyone holding it read a private object for a while"""
+
+    @abstractmethod
+    def public_url(self, bucket: str, path: str) -> str:
+        """Permanent URL of an object stored with public=True"""
+
+    @abstractmethod
+    def presign_post(
+        self, path: str, content_type: str, max_size: int, expires_in: int
+    ) -> Dict[str, Any]:
+        """
+        Form upload target ({"url", "fields"}) that lets a client store one
+        private object of at most max_size bytes without going through the app
+        """
+
+
+class SpacesBackend(StorageBackend):
+    """DigitalOcean Spaces (or any S3-compatible store) through boto3"""
+
+    storage_type = StorageType.DO_SPACES
+
+    def __init__(self, config: Dict[str, Any]):
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=config["STORAGE_ENDPOINT"],
+            aws_access_key_id=config["STORAGE_ACCESS_KEY"],
+            aws_secret_access_key=config["STORAGE_SECRET_KEY"],
+            region_name=config.get("STORAGE_REGION", "nyc3"),
+        )
+        self.bucket = config["STORAGE_BUCKET"]
+        self.cdn_endpoint = config.get(
+            "DO_SPACES_CDN_ENDPOINT", config["STORAGE_ENDPOINT"]
+        ).rstrip("/")
+
+        # Multipart uploads: S3 parts must be at least 5 MB
+        self.part_size = max(
+            5 * 1024 * 1024, config.get("STORAGE_MULTIPART_PART_SIZE", 16 * 1024 * 1024)
+        )
+        self.upload_concurrency = max(1, config.get("STORAGE_MULTIPART_CONCURRENCY", 8))
+        self.download_concurrency = max(
+            1, config.get("STORAGE_DOWNLOAD_CONCURRENCY", 8)
+        )
+
+    @staticmethod
+    def _content_md5(data: bytes) -> Tuple[str, str]:
+        """MD5 of data as (hex, base64), the forms of ETag and Content-MD5"""
+        digest = hashlib.md5(data).digest()
+        return digest.hex(), base64.b64encode(digest).decode()
+
+    @staticmethod
+    def _extra_args(content_type: str, public: bool) -> Dict[str, Any]:
+        return {
+            "ContentType": content_type,
+            "ACL": "public-read" if public else "private",
+        }
+
+    def put_bytes(
+        self,
+        path: str,
+        data: bytes,
+        content_type: str,
+        public: bool = False,
+        metadata: Optional[Dict[str, str]] = None,
+    ):
+        extra_args = self._extra_args(content_type, public)
+        if metadata is not None:
+            extra_args["Metadata"] = metadata
+        self.client.upload_fileobj(
+            io.BytesIO(data), self.bucket, path, ExtraArgs=extra_args
+        )
+
+    def _upload_part(
+        self,
+        destination: str,
+        upload_id: str,
+        part_number: int,
+        data: bytes,
+        slots: threading.BoundedSemaphore,
+    ) -> Dict[str, Any]:
+        """Upload one part and check the ETag the store computed for it"""
+        try:
+            md5_hex, md5_b64 = self._content_md5(data)
+            response = self.client.upload_part(
+                Bucket=self.bucket,
+                Key=destination,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=data,
+                ContentMD5=md5_b64,
+            )
+            etag = response["ETag"].strip('"')
+            if etag != md5_hex:
+                raise IOError(
+                    f"Part {part_number} of {destination} failed verification: "
+                    f"ETag {etag}, expected {md5_hex}"
+                )
+            return {"PartNumber": part_number, "ETag": response["ETag"]}
+        finally:
+            slots.release()
+
+    def put_stream(
+        self, file_obj: BinaryIO, path: str, content_type: str, public: bool = False
+    ) -> Tuple[int, str]:
+        """
+        Upload a stream in a single read pass, returning its size and SHA256.
+
+        The stream is read in part_size blocks that are hashed as they are read
+        and uploaded as multipart parts on upload_concurrency threads, holding
+        at most that many parts in memory. Each part is sent with Content-MD5 so
+        the store rejects corrupted parts. Streams smaller than one part go up
+        with a single put_object.
+        """
+        extra_args = self._extra_args(content_type, public)
+        sha256_hash = hashlib.sha256()
+        data = file_obj.read(self.part_size)
+        sha256_hash.update(data)
+
+        if len(data) < self.part_size:
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=path,
+                Body=data,
+                ContentMD5=self._content_md5(data)[1],
+                **extra_args,
+            )
+            return len(data), sha256_hash.hexdigest()
+
+        upload_id = self.client.create_multipart_upload(
+            Bucket=self.bucket, Key=path, **extra_args
+        )["UploadId"]
+        slots = threading.BoundedSemaphore(self.upload_concurrency)
+        file_size = 0
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.upload_concurrency) as executor:
+                futures = []
+                part_number = 1
+                while data:
+                    slots.acquire()
+                    file_size += len(data)
+                    futures.append(
+                        executor.submit(
+                            self._upload_part, path, upload_id, part_number, data, slots
+                        )
+                    )
+                    # Stop reading once any part has failed
+                    if any(f.done() and f.exception() for f in futures):
+                        break
+                    data = file_obj.read(self.part_size)
+                    sha256_hash.update(data)
+                    part_number += 1
+
+                parts: List[Dict[str, Any]] = [f.result() for f in futures]
+
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=path,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+            logger.debug(f"Uploaded {path} in {len(parts)} parts ({file_size} bytes)")
+            return file_size, sha256_hash.hexdigest()
+
+        except Exception as e:
+            logger.error(f"Multipart upload of {path} failed: {str(e)}")
+            try:
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=path, UploadId=upload_id
+                )
+            except Exception as abort_error:
+                logger.error(
+                    f"Failed to abort multipart upload {upload_id}: {str(abort_error)}"
+                )
+            raise
+
+    def delete(self, bucket: str, path: str):
+        self.client.delete_object(Bucket=bucket, Key=path)
+
+    def delete_many(self, bucket: str, paths: List[str]) -> List[str]:
+        """Multi-object delete, DELETE_BATCH_SIZE keys per request"""
+        failed = []
+        for start in range(0, len(paths), DELETE_BATCH_SIZE):
+            batch = paths[start : start + DELETE_BATCH_SIZE]
+            response = self.client.delete_objects(
+                Bucket=bucket,
+                Delete={"Objects": [{"Key": path} for path in batch], "Quiet": True},
+            )
+            for error in response.get("Errors", []):
+                logger.error(
+                    f"Failed to delete {bucket}/{error['Key']}: "
+                    f"{error.get('Code')} {error.get('Message')}"
+                )
+                failed.append(error["Key"])
+        return failed
+
+    def read(self, bucket: str, path: str) -> bytes:
+        return self.client.get_object(Bucket=bucket, Key=path)["Body"].read()
+
+    def _stream(
+        self,
+        bucket: str,
+        path: str,
+        start: int,
+        end: Optional[int],
+        chunk_size: int,
+        etag: Optional[str] = None,
+    ) -> Iterator[bytes]:
+        kwargs: Dict[str, Any] = {}
+        if start or end is not None:
+            kwargs["Range"] = f"bytes={start}-{'' if end is None else end}"
+        if etag:
+            # Every range of one download must come from the same object
+            kwargs["IfMatch"] = etag
+        body = self.client.get_object(Bucket=bucket, Key=path, **kwargs)["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def stream(
+        self,
+        bucket: str,
+        path: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> Iterator[bytes]:
+        return self._stream(bucket, path, start, end, chunk_size)
+
+    def _download_range(
+        self, bucket: str, path: str, etag: str, fd: int, start: int, end: int
+    ):
+        """Write one byte range of an object at its offset in an open file"""
+        offset = start
+        for chunk in self._stream(bucket, path, start, end, STREAM_CHUNK_SIZE, etag):
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+        if offset != end + 1:
+            raise IOError(
+                f"Short read of {path} bytes {start}-{end}: got {offset - start}"
+            )
+
+    def download_to_path(self, bucket: str, path: str, local_path: str):
+        """
+        Download with parallel ranged GETs of part_size bytes, each streamed
+        to its offset in the file, so memory stays at one chunk per thread.
+        """
+        head = self.client.head_object(Bucket=bucket, Key=path)
+        size, etag = head["ContentLength"], head["ETag"]
+        ranges = [
+            (start, min(start + self.part_size, size) - 1)
+            for start in range(0, size, self.part_size)
+        ]
+
+        fd = os.open(local_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            workers = max(1, min(self.download_concurrency, len(ranges)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(
+                        self._download_range, bucket, path, etag, fd, start, end
+                    )
+                    for start, end in ranges
+                ]
+                for future in futures:
+                    future.result()
+        finally:
+            os.close(fd)
+        logger.debug(f"Downloaded {path} in {len(ranges)} ranges ({size} bytes)")
+
+    def size(self, bucket: str, path: str) -> int:
+        return self.client.head_object(Bucket=bucket, Key=path)["ContentLength"]
+
+    def presign(self, bucket: str, path: str, expires_in: int) -> str:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": bucket, "Key": path},
+            ExpiresIn=expires_in,
+        )
+
+    def public_url(self, bucket: str, path: str) -> str:
+        return f"{self.cdn_endpoint}/{path}"
+
+    def presign_post(
+        self, path: str, content_type: str, max_size: int, expires_in: int
+    ) -> Dict[str, Any]:
+        return self.client.generate_presigned_post(
+            Bucket=self.bucket,
+            Key=path,
+            Fields={"Content-Type": content_type, "acl": "private"},
+            Conditions=[
+                {"Content-Type": content_type},
+                {"acl": "private"},
+                ["content-length-range", 1, max_size],
+            ],
+            ExpiresIn=expires_in,
+        )
+
+
+class LocalBackend(StorageBackend):
+    """
+    Files on the server's own disk, for single-node deployments and benchmarks.
+
+    Objects live under LOCAL_STORAGE_ROOT/<bucket>/<aa>/<bb>/<path>, where aa/bb
+    come from a hash of the path so no directory grows unbounded even though
+    every path starts with users/. Writes go to a temporary file in the target
+    directory and are renamed into place, so readers never see a partial file.
+    URLs point at the /api/files route with an HMAC signature (keyed with
+    SECRET_KEY) in place of S3 presigning; public URLs are signed without an
+    expiry.
+    """
+
+    storage_type = StorageType.LOCAL
+
+    def __init__(self, config: Dict[str, Any]):
+        self.root = Path(config.get("LOCAL_STORAGE_ROOT", "storage")).resolve()
+        self.bucket = config.get("LOCAL_STORAGE_BUCKET", "local")
+        self.base_url = config.get("LOCAL_STORAGE_URL", "/api/files").rstrip("/")
+        self.secret = config["SECRET_KEY"].encode()
+
+    def file_path(self, bucket: str, path: str) -> Path:
+        """Location of an object on disk"""
+        parts = PurePosixPath(path).parts
+        if not parts or path.startswith("/") or ".." in parts or "/" in bucket:
+            raise ValueError(f"Invalid storage path: {bucket}/{path}")
+        shard = hashlib.sha1(path.encode()).hexdigest()
+        return self.root / bucket / shard[:2] / shard[2:4] / path
+
+    def _write(self, path: str, chunks: Iterable[bytes]) -> Tuple[int, str]:
+        """Write chunks to a temporary file, then rename it over the target"""
+        target = self.file_path(self.bucket, path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=target.parent, prefix=".tmp-")
+        sha256_hash = hashlib.sha256()
+        file_size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    sha256_hash.update(chunk)
+                    file_size += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, target)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        return file_size, sha256_hash.hexdigest()
+
+    def put_bytes(
+        self,
+        path: str,
+        data: bytes,
+        content_type: str,
+        public: bool = False,
+        metadata: Optional[Dict[str, str]] = None,
+    ):
+        # Content type and metadata are kept on the StorageLocation record
+        self._write(path, [data])
+
+    def put_stream(
+        self, file_obj: BinaryIO, path: str, content_type: str, public: bool = False
+    ) -> Tuple[int, str]:
+        return self._write(path, iter(lambda: file_obj.read(LOCAL_CHUNK_SIZE), b""))
+
+    def delete(self, bucket: str, path: str):
+        try:
+            self.file_path(bucket, path).unlink()
+        except FileNotFoundError:
+            pass
+
+    def read(self, bucket: str, path: str) -> bytes:
+        return self.file_path(bucket, path).read_bytes()
+
+    def stream(
+        self,
+        bucket: str,
+        path: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> Iterator[bytes]:
+        with open(self.file_path(bucket, path), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(
+                    chunk_size if remaining is None else min(chunk_size, remaining)
+                )
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def download_to_path(self, bucket: str, path: str, local_path: str):
+        # copyfile uses sendfile on Linux, so the data never enters Python
+        shutil.copyfile(self.file_path(bucket, path), local_path)
+
+    def size(self, bucket: str, path: str) -> int:
+        return self.file_path(bucket, path).stat().st_size
+
+    def _signature(self, bucket: str, path: str, expires: int) -> str:
+        message = f"{bucket}/{path}:{expires}".encode()
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def _url(self, bucket: str, path: str, expires: int) -> str:
+        query = urlencode(
+            {"expires": expires, "signature": self._signature(bucket, path, expires)}
+        )
+        return f"{self.base_url}/{quote(bucket)}/{quote(path)}?{query}"
+
+    def verify(self, bucket: str, path: str, expires: int, signature: str) -> bool:
+        """Whether a URL's signature is genuine and has not expired"""
+        expected = self._signature(bucket, path, expires)
+        if not hmac.compare_digest(expected, signature):
+            return False
+        return expires == 0 or expires > time.time()
+
+    def presign(self, bucket: str, path: str, expires_in: int) -> str:
+        return self._url(bucket, path, int(time.time()) + expires_in)
+
+    def public_url(self, bucket: str, path: str) -> str:
+        return self._url(bucket, path, 0)
+
+    def _upload_signature(
+        self, bucket: str, path: str, expires: int, max_size: int, content_type: str
+    ) -> str:
+        message = f"upload:{bucket}/{path}:{expires}:{max_size}:{content_type}"
+        return hmac.new(self.secret, message.encode(), hashlib.sha256).hexdigest()
+
+    def presign_post(
+        self, path: str, content_type: str, max_size: int, expires_in: int
+    ) -> Dict[str, Any]:
+        expires = int(time.time()) + expires_in
+        # The policy rides in the query string so the upload route can check
+        # it, and the declared length, before it reads the request body
+        policy = urlencode(
+            {
+                "Content-Type": content_type,
+                "expires": expires,
+                "max_size": max_size,
+                "signature": self._upload_signature(
+                    self.bucket, path, expires, max_size, content_type
+                ),
+            }
+        )
+        return {
+            "url": f"{self.base_url}/{quote(self.bucket)}/{quote(path)}?{policy}",
+            "fields": {"Content-Type": content_type},
+        }
+
+    def verify_upload(
+        self,
+        bucket: str,
+        path: str,
+        expires: int,
+        max_size: int,
+        content_type: str,
+        signature: str,
+    ) -> bool:
+        """Whether an upload form was issued by presign_post and is still valid"""
+        expected = self._upload_signature(bucket, path, expires, max_size, content_type)
+        return hmac.compare_digest(expected, signature) and expires > time.time()
+
+
+def create_storage_backend(config: Dict[str, Any]) -> StorageBackend:
+    """Build the backend selected by STORAGE_BACKEND"""
+    backend = config.get("STORAGE_BACKEND", "spaces")
+
+    if backend == "spaces":
+        return SpacesBackend(config)
+    elif backend == "local":
+        return LocalBackend(config)
+    else:
+        raise ValueError(f"Invalid storage backend: {backend}")
@@ -0,0 +1,160 @@
+# server/services/theme_catalog.py
+
+import logging
+import re
+import threading
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Placeholders allowed in theme prompts, e.g. "{AGE} {GENDER_NOUN}"
+PLACEHOLDERS = ("AGE", "GENDER_NOUN", "PRONOUN")
+PLACEHOLDER_PATTERN = re.compile(r"\{(%s)\}" % "|".join(PLACEHOLDERS))
+
+GENDER_TERMS = {
+    "M": {"GENDER_NOUN": "boy", "PRONOUN": "he"},
+    "F": {"GENDER_NOUN": "girl", "PRONOUN": "she"},
+}
+NEUTRAL_TERMS = {"GENDER_NOUN": "child", "PRONOUN": "they"}
+
+
+class CompiledPrompt(NamedTuple):
+    base_prompt: str
+    template: str  # str.format template with every other brace escaped
+    count: int
+
+
+class CompiledTheme(NamedTuple):
+    name: str
+    gender: str
+    age_min: float
+    age_max: float
+    description: str
+    prompts: Tuple[CompiledPrompt, ...]
+    base_prompts: Tuple[str, ...]  # one per generated image, in output order
+
+
+class ManifestEntry(NamedTuple):
+    prompt: str
+    base_prompt: str
+
+
+def compile_template(base_prompt: str) -> str:
+    """Turn a prompt with {PLACEHOLDER}s into a str.format template"""
+    parts = []
+    last = 0
+    for match in PLACEHOLDER_PATTERN.finditer(base_prompt):
+        literal = base_prompt[last : match.start()]
+        parts.append(literal.replace("{", "{{").replace("}", "}}"))
+        parts.append(match.group(0))
+        last = match.end()
+    parts.append(base_prompt[last:].replace("{", "{{").replace("}", "}}"))
+    return "".join(parts)
+
+
+class ThemeCatalog:
+    """
+    PHOTOSHOOT_THEMES compiled once into an index by gender and age band.
+
+    Age bands are whole years; a band holds every theme whose range overlaps
+    it, and the exact bounds are checked on lookup.
+    """
+
+    def __init__(self, themes: Dict[str, Dict[str, Any]]):
+        self.themes: Dict[str, CompiledTheme] = {}
+        for name, data in themes.items():
+            prompts = tuple(
+                CompiledPrompt(
+                    item["prompt"], compile_template(item["prompt"]), item["count"]
+                )
+                for item in data["prompts"]
+            )
+            self.themes[name] = CompiledTheme(
+                name=name,
+                gender=data["gender"],
+                age_min=data["age_min"],
+                age_max=data["age_max"],
+                description=data.get("description", ""),
+                prompts=prompts,
+                base_prompts=tuple(
+                    prompt.base_prompt
+                    for prompt in prompts
+                    for _ in range(prompt.count)
+                ),
+            )
+
+        # gender -> age band -> themes, in config order
+        self._index: Dict[str, Dict[int, Tuple[CompiledTheme, ...]]] = {}
+        for gender in (*GENDER_TERMS, "U"):
+            bands: Dict[int, List[CompiledTheme]] = {}
+            for theme in self.themes.values():
+                if theme.gender != "U" and theme.gender != gender:
+                    continue
+                for band in range(int(theme.age_min), int(theme.age_max) + 1):
+                    bands.setdefault(band, []).append(theme)
+            self._index[gender] = {band: tuple(items) for band, items in bands.items()}
+
+    def get(self, theme_name: str) -> Optional[CompiledTheme]:
+        return self.themes.get(theme_name)
+
+    def eligible_themes(self, sex: str, age_years: float) -> List[CompiledTheme]:
+        """Themes matching the subject's gender and age"""
+        bands = self._index.get(sex if sex in GENDER_TERMS else "U", {})
+        return [
+            theme
+            for theme in bands.get(int(age_years), ())
+            if theme.age_min <= age_years <= theme.age_max
+        ]
+
+    @staticmethod
+    def subject_terms(sex: str, age_years: float) -> Dict[str, str]:
+        """Values for the prompt placeholders"""
+        return {
+            **GENDER_TERMS.get(sex, NEUTRAL_TERMS),
+            "AGE": f"{age_years:.2f} y.o.",
+        }
+
+    def format_prompt(self, base_prompt: str, sex: str, age_years: float) -> str:
+        """Fill one prompt's placeholders for a subject"""
+        return compile_template(base_prompt).format_map(
+            self.subject_terms(sex, age_years)
+        )
+
+    def build_manifest(
+        self, sex: str, age_years: float
+    ) -> Dict[str, List[ManifestEntry]]:
+        """
+        Full generation manifest for a subject: every eligible theme mapped to
+        one entry per image to generate, in output order.
+        """
+        terms = self.subject_terms(sex, age_years)
+        manifest: Dict[str, List[ManifestEntry]] = {}
+        for theme in self.eligible_themes(sex, age_years):
+            entries: List[ManifestEntry] = []
+            for prompt in theme.prompts:
+                entry = ManifestEntry(
+                    prompt.template.format_map(terms), prompt.base_prompt
+                )
+                entries.extend([entry] * prompt.count)
+            manifest[theme.name] = entries
+        return manifest
+
+
+_catalogs: Dict[int, Tuple[Dict[str, Any], ThemeCatalog]] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_theme_catalog(themes: Optional[Dict[str, Any]] = None) -> ThemeCatalog:
+    """Compiled catalog for a themes dict (Config.PHOTOSHOOT_THEMES by default)"""
+    if themes is None:
+        themes = Config.PHOTOSHOOT_THEMES
+
+    with _catalogs_lock:
+        cached = _catalogs.get(id(themes))
+        if cached is None or cached[0] is not themes:
+            cached = (themes, ThemeCatalog(themes))
+            _catalogs[id(themes)] = cached
+            logger.info(f"Compiled theme catalog with {len(themes)} themes")
+        return cached[1]
@@ -0,0 +1,237 @@
+# server/services/upload_sessions.py
+
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class UploadSessionError(Exception):
+    """A chunk or session request that cannot be accepted"""
+
+
+class UploadSessionStore:
+    """
+    Resumable uploads of a set of files, sent as fixed-size chunks.
+
+    A session records the files (name, size, optional SHA256) in Redis and
+    preallocates each one in the job's temp directory. Every chunk names its
+    offset and carries its own SHA256; verified chunks are written in place
+    and remembered in a Redis set per file, so after a dropped connection
+    the client asks which offsets are missing and sends only those. Sessions
+    expire after UPLOAD_SESSION_TTL seconds without activity; a sorted set of
+    expiry times lets cleanup_expired() remove their temp dirs afterwards.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.redis_client = redis.Redis(
+            host=config.get("REDIS_HOST", "localhost"),
+            port=config.get("REDIS_PORT", 6379),
+            db=config.get("REDIS_UPLOAD_DB", 3),
+        )
+        self.chunk_size = config.get("UPLOAD_CHUNK_SIZE", 5 * 1024 * 1024)
+        self.ttl = config.get("UPLOAD_SESSION_TTL", 12 * 3600)
+        self.max_files = config.get("TRAINING_UPLOAD_MAX_FILES", 50)
+        self.max_file_size = config.get("TRAINING_UPLOAD_MAX_BYTES", 50 * 1024**2)
+        self.prefix = "upload_session:"
+        self.expiry_key = "upload_sessions:expiry"
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}"
+
+    def _chunks_key(self, session_id: str, index: int) -> str:
+        return f"{self.prefix}{session_id}:chunks:{index}"
+
+    @staticmethod
+    def _expiry_member(session: Dict[str, Any]) -> str:
+        return json.dumps([session["session_id"], session["temp_dir"]])
+
+    @staticmethod
+    def _part_path(session: Dict[str, Any], index: int) -> Path:
+        return Path(session["temp_dir"]) / f".{session['files'][index]['name']}.part"
+
+    def chunk_count(self, file: Dict[str, Any]) -> int:
+        return max(1, math.ceil(file["size"] / self.chunk_size))
+
+    def create(
+        self, user_id: int, files: List[Dict[str, Any]], temp_dir: Path
+    ) -> Dict[str, Any]:
+        """
+        Open a session for files ({"name", "size", "sha256"?}) that will be
+        assembled in temp_dir
+        """
+        self.cleanup_expired()
+        if not files or len(files) > self.max_files:
+            raise UploadSessionError(f"Between 1 and {self.max_files} files allowed")
+        for file in files:
+            if not 0 < file["size"] <= self.max_file_size:
+                raise UploadSessionError(f"File size not allowed: {file['name']}")
+
+        session = {
+            "session_id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "temp_dir": str(temp_dir),
+            "chunk_size": self.chunk_size,
+            "files": files,
+        }
+        for index, file in enumerate(files):
+            with open(self._part_path(session, index), "wb") as f:
+                f.truncate(file["size"])
+
+        pipe = self.redis_client.pipeline()
+        pipe.setex(self._key(session["session_id"]), self.ttl, json.dumps(session))
+        pipe.zadd(
+            self.expiry_key, {self._expiry_member(session): time.time() + self.ttl}
+        )
+        pipe.execute()
+        logger.info(
+            f"Opened upload session {session['session_id']} for user {user_id} "
+            f"({len(files)} files)"
+        )
+        return session
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        data = self.redis_client.get(self._key(session_id))
+        return json.loads(data) if data else None
+
+    def write_chunk(
+        self,
+        session: Dict[str, Any],
+        index: int,
+        offset: int,
+        data: bytes,
+        checksum: str,
+    ) -> int:
+        """Verify and store one chunk, returning how many chunks the file has"""
+        if not 0 <= index < len(session["files"]):
+            raise UploadSessionError(f"No file {index} in this session")
+        file = session["files"][index]
+        chunk_size = session["chunk_size"]
+
+        if offset % chunk_size or not 0 <= offset < file["size"]:
+            raise UploadSessionError(f"Invalid chunk offset {offset}")
+        expected_length = min(chunk_size, file["size"] - offset)
+        if len(data) != expected_length:
+            raise UploadSessionError(
+                f"Chunk at {offset} has {len(data)} bytes, expected {expected_length}"
+            )
+        if hashlib.sha256(data).hexdigest() != (checksum or "").lower():
+            raise UploadSessionError(f"Checksum mismatch for chunk at {offset}")
+
+        fd = os.open(self._part_path(session, index), os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
+
+        session_id = session["session_id"]
+        chunks_key = self._chunks_key(session_id, index)
+        pipe = self.redis_client.pipeline()
+        pipe.sadd(chunks_key, offset // chunk_size)
+        pipe.expire(chunks_key, self.ttl)
+        pipe.expire(self._key(session_id), self.ttl)
+        pipe.zadd(
+            self.expiry_key, {self._expiry_member(session): time.time() + self.ttl}
+        )
+        pipe.scard(chunks_key)
+        return pipe.execute()[-1]
+
+    def missing_chunks(self, session: Dict[str, Any]) -> Dict[int, List[int]]:
+        """Offsets not yet received, per file index (files complete are left out)"""
+        pipe = self.redis_client.pipeline()
+        for index in range(len(session["files"])):
+            pipe.smembers(self._chunks_key(session["session_id"], index))
+        received = pipe.execute()
+
+        missing = {}
+        for index, (file, chunks) in enumerate(zip(session["files"], received)):
+            have = {int(chunk) for chunk in chunks}
+            offsets = [
+                chunk * session["chunk_size"]
+                for chunk in range(self.chunk_count(file))
+                if chunk not in have
+            ]
+            if offsets:
+                missing[index] = offsets
+        return missing
+
+    def verify(self, session: Dict[str, Any]) -> List[Path]:
+        """
+        Check that every chunk arrived and that whole files match the
+        checksums the client gave, returning the received files. The session
+        stays open, so a failed check can still be fixed by resending.
+        """
+        if self.missing_chunks(session):
+            raise UploadSessionError("Upload is incomplete")
+
+        parts = []
+        for index, file in enumerate(session["files"]):
+            part = self._part_path(session, index)
+            if file.get("sha256"):
+                sha256_hash = hashlib.sha256()
+                with open(part, "rb") as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b""):
+                        sha256_hash.update(block)
+                if sha256_hash.hexdigest() != file["sha256"].lower():
+                    raise UploadSessionError(f"Checksum mismatch for {file['name']}")
+            parts.append(part)
+        return parts
+
+    def final_paths(self, session: Dict[str, Any]) -> List[Path]:
+        """Where complete() puts each file"""
+        return [Path(session["temp_dir"]) / file["name"] for file in session["files"]]
+
+    def complete(self, session: Dict[str, Any]) -> List[Path]:
+        """
+        End a verified session, moving its files to their final names. The
+        temp dir now belongs to the caller.
+        """
+        paths = self.final_paths(session)
+        for index, path in enumerate(paths):
+            os.replace(self._part_path(session, index), path)
+        self._forget(session)
+        return paths
+
+    def _forget(self, session: Dict[str, Any]):
+        session_id = session["session_id"]
+        pipe = self.redis_client.pipeline()
+        pipe.delete(
+            self._key(session_id),
+            *[
+                self._chunks_key(session_id, index)
+                for index in range(len(session["files"]))
+            ],
+        )
+        pipe.zrem(self.expiry_key, self._expiry_member(session))
+        pipe.execute()
+
+    def delete(self, session: Dict[str, Any]):
+        """Abandon a session along with everything uploaded to it"""
+        self._forget(session)
+        shutil.rmtree(session["temp_dir"], ignore_errors=True)
+
+    def cleanup_expired(self) -> int:
+        """Remove the temp dirs of sessions that expired, returning how many"""
+        removed = 0
+        now = time.time()
+        for member in self.redis_client.zrangebyscore(self.expiry_key, 0, now):
+            session_id, temp_dir = json.loads(member)
+            if self.redis_client.exists(self._key(session_id)):
+                continue  # Written to since its score was read
+            # Only the process whose zrem succeeds removes the files
+            if self.redis_client.zrem(self.expiry_key, member):
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                removed += 1
+        if removed:
+            logger.info(f"Removed {removed} expired upload sessions")
+        return removed
@@ -0,0 +1,146 @@
+# server/services/url_cache.py
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, Optional, Set, Tuple
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str, int]  # (bucket, path, expires_in)
+
+
+class PresignedURLCache:
+    """
+    Presigned URLs reused until shortly before they expire.
+
+    Entries are keyed by storage path and the requested expiry, so a URL
+    signed for one hour is never handed out for a request asking for a day.
+    A URL is served from cache while it has more than the refresh margin of
+    validity left; after that it is re-signed. The in-process LRU is always
+    on. With PRESIGNED_URL_REDIS_ENABLED the URLs are also shared through
+    Redis so every worker process benefits from a signature made by one.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.max_entries = config.get("PRESIGNED_URL_CACHE_SIZE", 10000)
+        self.refresh_margin = config.get("PRESIGNED_URL_REFRESH_MARGIN", 300)
+        self.prefix = "presigned_url:"
+
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[CacheKey, Tuple[str, float]]" = OrderedDict()
+        self.expiries: Set[int] = set()  # expires_in values ever cached
+        self.stats = {"hits": 0, "redis_hits": 0, "misses": 0, "redis_errors": 0}
+
+        self.redis_client = None
+        if config.get("PRESIGNED_URL_REDIS_ENABLED"):
+            self.redis_client = redis.Redis(
+                host=config.get("REDIS_HOST", "localhost"),
+                port=config.get("REDIS_PORT", 6379),
+                db=config.get("REDIS_URL_CACHE_DB", 2),
+                socket_timeout=0.5,
+            )
+
+    def _redis_key(self, key: CacheKey) -> str:
+        bucket, path, expires_in = key
+        return f"{self.prefix}{expires_in}:{bucket}/{path}"
+
+    def _usable_for(self, expires_in: int) -> float:
+        """Seconds a fresh URL can be served before it is re-signed"""
+        return max(0, expires_in - min(self.refresh_margin, expires_in // 2))
+
+    def get_many(self, keys: Iterable[CacheKey]) -> Dict[CacheKey, str]:
+        """Cached URLs for the keys that still have enough validity left"""
+        found = {}
+        missing = []
+        now = time.time()
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry and entry[1] > now:
+                    self.entries.move_to_end(key)
+                    found[key] = entry[0]
+                else:
+                    if entry:
+                        del self.entries[key]
+                    missing.append(key)
+            self.stats["hits"] += len(found)
+
+        if missing and self.redis_client:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for key in missing:
+                    pipe.get(self._redis_key(key))
+                    pipe.ttl(self._redis_key(key))
+                results = pipe.execute()
+            except redis.RedisError as e:
+                logger.warning(f"Presigned URL cache lookup failed: {str(e)}")
+                self.stats["redis_errors"] += 1
+                results = []
+
+            shared = {}
+            for i, key in enumerate(missing if results else []):
+                url, ttl = results[2 * i], results[2 * i + 1]
+                if url and ttl and ttl > 0:
+                    shared[key] = (url.decode(), now + ttl)
+            if shared:
+                with self.lock:
+                    for key, entry in shared.items():
+                        self._remember(key, entry)
+                    self.stats["redis_hits"] += len(shared)
+                found.update({key: entry[0] for key, entry in shared.items()})
+            missing = [key for key in missing if key not in shared]
+
+        with self.lock:
+            self.stats["misses"] += len(missing)
+        return found
+
+    def _remember(self, key: CacheKey, entry: Tuple[str, float]):
+        """Store an entry, evicting the least recently used (lock held)"""
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def put_many(self, urls: Dict[CacheKey, str], signed_at: Optional[float] = None):
+        """Cache freshly signed URLs"""
+        if not urls:
+            return
+        signed_at = signed_at or time.time()
+        with self.lock:
+            for key, url in urls.items():
+                self.expiries.add(key[2])
+                self._remember(key, (url, signed_at + self._usable_for(key[2])))
+
+        if self.redis_client:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for key, url in urls.items():
+                    usable = int(self._usable_for(key[2]))
+                    if usable > 0:
+                        pipe.setex(self._redis_key(key), usable, url)
+                pipe.execute()
+            except redis.RedisError as e:
+                logger.warning(f"Presigned URL cache store failed: {str(e)}")
+                self.stats["redis_errors"] += 1
+
+    def invalidate(self, bucket: str, path: str):
+        """Forget every cached URL for an object, e.g. after deleting it"""
+        with self.lock:
+            keys = [(bucket, path, expires_in) for expires_in in self.expiries]
+            for key in keys:
+                self.entries.pop(key, None)
+
+        if self.redis_client and keys:
+            try:
+                self.redis_client.delete(*[self._redis_key(key) for key in keys])
+            except redis.RedisError as e:
+                logger.warning(f"Presigned URL cache invalidation failed: {str(e)}")
+                self.stats["redis_errors"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {**self.stats, "entries": len(self.entries)}
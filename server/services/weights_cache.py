@@ -0,0 +1,230 @@
+# server/services/weights_cache.py
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Any, Iterator, Tuple
+
+if TYPE_CHECKING:
+    from models import StorageLocation
+
+logger = logging.getLogger(__name__)
+
+
+def file_checksum(path: Path) -> str:
+    """SHA256 of a file, read in 1 MB blocks"""
+    sha256_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256_hash.update(block)
+    return sha256_hash.hexdigest()
+
+
+class WeightsCacheError(Exception):
+    """Raised when cached or downloaded weights fail verification"""
+
+    pass
+
+
+class WeightsCache:
+    """
+    Size-bounded on-disk LRU cache of model weights on a worker host.
+
+    Entries are keyed by the StorageLocation checksum, so a model is fetched
+    from storage once and then served locally. A file is hashed against its
+    checksum the first time this process reads it and again whenever its size
+    or mtime changes. Concurrent requests for the same weights share one
+    download, and entries in use are never evicted."""
+
+    def __init__(self, config: Dict[str, Any], storage_service):
+        self.storage_service = storage_service
+        self.root = Path(config.get("WEIGHTS_CACHE_DIR", "/tmp/weights_cache"))
+        self.max_bytes = config.get("WEIGHTS_CACHE_MAX_BYTES", 50 * 1024**3)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size, LRU first
+        self.in_use: Dict[str, int] = {}
+        self.verified: Dict[str, Tuple[int, int]] = {}  # key -> (size, mtime_ns)
+        self.downloads: Dict[str, Future] = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "verify_failures": 0}
+
+        self._load_entries()
+
+    def _load_entries(self):
+        """Pick up weights cached by earlier runs, oldest access first"""
+        for part in self.root.glob(".*.part"):
+            part.unlink(missing_ok=True)
+
+        files = sorted(
+            self.root.glob("*.safetensors"), key=lambda path: path.stat().st_mtime
+        )
+        for path in files:
+            self.entries[path.stem] = path.stat().st_size
+        if files:
+            logger.info(
+                f"Weights cache has {len(files)} entries ({self.total_bytes} bytes)"
+            )
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self.entries.values())
+
+    @staticmethod
+    def _key(location: "StorageLocation") -> str:
+        """Cache key: the checksum, or a digest of the path for legacy rows"""
+        if location.checksum:
+            return location.checksum
+        return (
+            "path-"
+            + hashlib.sha256(f"{location.bucket}/{location.path}".encode()).hexdigest()
+        )
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.safetensors"
+
+    def _verify(self, key: str, path: Path, checksum: str):
+        """Hash the file unless it was verified and has not changed since"""
+        stat = path.stat()
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        if not checksum or self.verified.get(key) == stamp:
+            return
+
+        actual = file_checksum(path)
+        if actual != checksum:
+            self.stats["verify_failures"] += 1
+            raise WeightsCacheError(
+                f"Checksum mismatch for {path.name}: expected {checksum}, got {actual}"
+            )
+        self.verified[key] = stamp
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits (lock held)"""
+        for key in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if self.in_use.get(key):
+                continue
+            self._path(key).unlink(missing_ok=True)
+            self.entries.pop(key)
+            self.verified.pop(key, None)
+            self.stats["evictions"] += 1
+            logger.info(f"Evicted weights {key} from cache")
+
+    def _admit(self, key: str, path: Path):
+        """Record a new entry as most recently used and make room (lock held)"""
+        self.entries[key] = path.stat().st_size
+        self.entries.move_to_end(key)
+        self._evict()
+
+    def _download(self, key: str, location: "StorageLocation"):
+        """Fetch weights from storage into the cache and verify them"""
+        target = self._path(key)
+        part = self.root / f".{key}.part"
+        try:
+            logger.info(f"Downloading weights {location.path} into cache")
+            self.storage_service.download_to_path(location, str(part))
+            self._verify(key, part, location.checksum)
+            os.replace(part, target)
+            self.verified[key] = (target.stat().st_size, target.stat().st_mtime_ns)
+        finally:
+            part.unlink(missing_ok=True)
+
+    def _fetch(self, key: str, location: "StorageLocation") -> Path:
+        """Return a verified local copy, downloading at most once per key"""
+        path = self._path(key)
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                download = None
+            else:
+                download = self.downloads.get(key)
+                owner = download is None
+                if owner:
+                    download = Future()
+                    self.downloads[key] = download
+                    self.stats["misses"] += 1
+
+        if download is None:
+            try:
+                self._verify(key, path, location.checksum)
+                os.utime(path)  # Keeps LRU order across restarts
+                return path
+            except (WeightsCacheError, FileNotFoundError) as e:
+                logger.warning(f"Dropping cached weights {key}: {str(e)}")
+                with self.lock:
+                    self.entries.pop(key, None)
+                    self.verified.pop(key, None)
+                path.unlink(missing_ok=True)
+                return self._fetch(key, location)
+
+        if not owner:
+            download.result()
+            return path
+
+        try:
+            self._download(key, location)
+            with self.lock:
+                self._admit(key, path)
+            download.set_result(path)
+            return path
+        except Exception as e:
+            logger.error(f"Failed to cache weights {location.path}: {str(e)}")
+            download.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.downloads.pop(key, None)
+
+    @contextmanager
+    def use(self, location: "StorageLocation") -> Iterator[Path]:
+        """Local path to a location's weights, protected from eviction while in use"""
+        key = self._key(location)
+        with self.lock:
+            self.in_use[key] = self.in_use.get(key, 0) + 1
+        try:
+            yield self._fetch(key, location)
+        finally:
+            with self.lock:
+                self.in_use[key] -= 1
+                if not self.in_use[key]:
+                    del self.in_use[key]
+                self._evict()
+
+    def put(self, location: "StorageLocation", local_path: str) -> bool:
+        """
+        Move freshly trained weights into the cache after they are uploaded.
+        The location's checksum was computed from this very file, so it is
+        trusted without hashing again.
+        """
+        key = self._key(location)
+        path = self._path(key)
+        try:
+            with self.lock:
+                if key in self.entries:
+                    return False
+            shutil.move(local_path, path)
+            with self.lock:
+                self.verified[key] = (path.stat().st_size, path.stat().st_mtime_ns)
+                self._admit(key, path)
+            return True
+        except Exception as e:
+            logger.warning(f"Could not cache weights {location.path}: {str(e)}")
+            return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                **self.stats,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+            }
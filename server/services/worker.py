@@ -1,30 +1,201 @@
 # server/services/worker.py
 
+import asyncio
 import threading
 import logging
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple, Callable
 import time
 from datetime import datetime
 import signal
 import shutil
 from pathlib import Path
 from queue import Queue
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, Future, wait
 
 from flask import Flask
+from PIL import Image
 from app import db
 from models import JobStatus, TrainedModel, GeneratedImage, PhotoBook, User, CreditType
 from .queue import JobQueue
 from .ai_service import AIService
+from .ai_service_async import AsyncAIService
+from .compute import create_compute_backend
+from .prewarm import PrewarmPool
+from .weights_cache import WeightsCache
+from .theme_catalog import ThemeCatalog, get_theme_catalog
 from .credits import CreditService
 
 logger = logging.getLogger(__name__)
 
 
+class NonRetryableJobError(Exception):
+    """A job failure retrying cannot fix, such as an invalid upload"""
+
+
+class InitialPhotobookUploader:
+    """
+    Persist initial photobook images while the rest are still downloading.
+
+    Each image handed to submit() is uploaded to storage and recorded in the
+    database on a small thread pool, so download, upload and DB writes
+    overlap instead of running as three sequential phases.
+    """
+
+    def __init__(
+        self,
+        app: Flask,
+        storage_service,
+        user_id: int,
+        model_id: int,
+        theme_catalog: ThemeCatalog,
+        max_workers: int = 4,
+    ):
+        self.app = app
+        self.storage_service = storage_service
+        self.user_id = user_id
+        self.model_id = model_id
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"photobook-{model_id}"
+        )
+        self.photobook_ids: Dict[str, int] = {}
+        self.finished: set = set()
+        self.futures: Dict[str, List[Future]] = defaultdict(list)
+        self.lock = threading.Lock()
+        self.theme_catalog = theme_catalog
+
+    def submit(self, theme_name: str, index: int, image_path: str):
+        """Queue one downloaded image for upload and persistence"""
+        photobook_id = self._get_photobook_id(theme_name)
+        theme = self.theme_catalog.get(theme_name)
+        prompts = theme.base_prompts if theme else ()
+        prompt = prompts[index] if index < len(prompts) else None
+        future = self.executor.submit(
+            self._persist_image, photobook_id, index, image_path, prompt
+        )
+        with self.lock:
+            self.futures[theme_name].append(future)
+
+    def _get_photobook_id(self, theme_name: str) -> int:
+        """Create the theme's photobook on its first image"""
+        with self.lock:
+            if theme_name not in self.photobook_ids:
+                with self.app.app_context():
+                    photobook = PhotoBook(
+                        user_id=self.user_id,
+                        model_id=self.model_id,
+                        name=theme_name,
+                        theme_name=theme_name,
+                        status=JobStatus.PROCESSING,
+                        is_unlocked=False,
+                    )
+                    db.session.add(photobook)
+                    db.session.commit()
+                    self.photobook_ids[theme_name] = photobook.id
+            return self.photobook_ids[theme_name]
+
+    def _persist_image(
+        self, photobook_id: int, index: int, image_path: str, prompt: Optional[str]
+    ):
+        """Upload a single image and record it against its photobook"""
+        with self.app.app_context():
+            try:
+                with open(image_path, "rb") as f:
+                    image_data = f.read()
+
+                location = self.storage_service.save_photobook_image(
+                    user_id=self.user_id,
+                    photobook_id=photobook_id,
+                    image_data=image_data,
+                    image_number=index + 1,
+                    prompt=prompt,
+                )
+                db.session.flush()
+
+                db.session.add(
+                    GeneratedImage(
+                        user_id=self.user_id,
+                        model_id=self.model_id,
+                        photobook_id=photobook_id,
+                        storage_location_id=location.id,
+                        prompt=prompt,
+                    )
+                )
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(
+                    f"Failed to save image {index} of photobook {photobook_id}: {str(e)}"
+                )
+                raise
+            finally:
+                Path(image_path).unlink(missing_ok=True)
+
+    def finish(self) -> Dict[str, int]:
+        """Wait for pending uploads and close out every photobook"""
+        with self.lock:
+            futures = {theme: list(items) for theme, items in self.futures.items()}
+
+        saved: Dict[str, int] = {}
+        for theme_name, theme_futures in futures.items():
+            wait(theme_futures)
+            saved[theme_name] = sum(1 for f in theme_futures if f.exception() is None)
+
+            with self.app.app_context():
+                try:
+                    photobook = PhotoBook.query.get(self.photobook_ids[theme_name])
+                    photobook.status = (
+                        JobStatus.COMPLETED if saved[theme_name] else JobStatus.FAILED
+                    )
+                    db.session.commit()
+                    self.finished.add(theme_name)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(
+                        f"Failed to finalize photobook for theme {theme_name}: {str(e)}"
+                    )
+
+            logger.info(
+                f"Saved {saved[theme_name]}/{len(theme_futures)} images for theme {theme_name}"
+            )
+
+        self.executor.shutdown(wait=True)
+        return saved
+
+    def shutdown(self):
+        """
+        Drop any uploads that have not started yet and mark photobooks that
+        were never finished as failed
+        """
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+        with self.lock:
+            unfinished = [
+                photobook_id
+                for theme_name, photobook_id in self.photobook_ids.items()
+                if theme_name not in self.finished
+            ]
+        if not unfinished:
+            return
+
+        with self.app.app_context():
+            try:
+                PhotoBook.query.filter(PhotoBook.id.in_(unfinished)).update(
+                    {PhotoBook.status: JobStatus.FAILED}, synchronize_session=False
+                )
+                db.session.commit()
+                logger.info(f"Marked unfinished photobooks {unfinished} as failed")
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Failed to mark photobooks {unfinished} failed: {str(e)}")
+
+
 class WorkerService:
     def __init__(self, config: Dict[str, Any], app: Flask):
         self.config = config
         self.app = app
         self.job_queue = JobQueue(config)
+        self.job_queue.recover_jobs()
         self.should_stop = False
         self.workers: List[threading.Thread] = []
 
@@ -39,12 +210,41 @@ class WorkerService:
         # Retry settings
         self.max_retries = config.get("JOB_MAX_RETRIES", 3)
 
+        # Training jobs claimed per GPU instance (1 disables batching)
+        self.training_batch_size = max(1, config.get("TRAINING_BATCH_SIZE", 1))
+
         # Alert queue
         self.alert_queue = Queue()
         self.alert_handlers = []
 
-        # Store PHOTOSHOOT_THEMES from the config
-        self.photoshoot_themes = config["PHOTOSHOOT_THEMES"]
+        # One GPU provider shared by every job this worker runs, behind a pool
+        # of speculatively launched instances when PREWARM_ENABLED
+        self.compute_backend = create_compute_backend(config)
+        self.prewarm_pool = None
+        if config.get("PREWARM_ENABLED"):
+            self.prewarm_pool = PrewarmPool(config, self.compute_backend)
+            self.compute_backend = self.prewarm_pool
+
+        # Model weights kept on this host for repeat generations
+        self.weights_cache = WeightsCache(config, config.get("storage_service"))
+
+        # PHOTOSHOOT_THEMES compiled once for eligibility and prompt lookups
+        self.theme_catalog = get_theme_catalog(config["PHOTOSHOOT_THEMES"])
+
+        # In asyncio mode trainings run as tasks on one event loop thread
+        # instead of holding a worker thread each
+        self.worker_mode = config.get("WORKER_MODE", "threads")
+        self.async_max_training_jobs = config.get("ASYNC_MAX_TRAINING_JOBS", 100)
+        self.async_training_jobs: Dict[str, asyncio.Task] = {}
+        self.training_loop = None
+        if self.worker_mode == "asyncio":
+            self.async_ai_service = AsyncAIService(
+                config, prewarm_pool=self.prewarm_pool
+            )
+            self.training_loop = threading.Thread(
+                target=self._run_async_training_loop, daemon=True
+            )
+            self.training_loop.start()
 
         # Start supervisor thread
         self.supervisor = threading.Thread(target=self._supervisor_loop, daemon=True)
@@ -67,6 +267,9 @@ class WorkerService:
             if self.supervisor.is_alive():
                 self.supervisor.join(timeout=shutdown_timeout)
 
+            if self.training_loop and self.training_loop.is_alive():
+                self.training_loop.join(timeout=shutdown_timeout)
+
             # Stop all workers with timeout
             for worker in self.workers:
                 if worker.is_alive():
@@ -121,6 +324,7 @@ class WorkerService:
             try:
                 self._check_scaling()
                 self._check_stuck_jobs()
+                self._cleanup_upload_sessions()
                 self._process_alerts()
                 time.sleep(30)
             except Exception as e:
@@ -159,6 +363,16 @@ class WorkerService:
         except Exception as e:
             logger.error(f"Scaling error: {str(e)}")
 
+    def _cleanup_upload_sessions(self):
+        """Remove the temp dirs of resumable uploads that were abandoned"""
+        upload_sessions = self.config.get("upload_sessions")
+        if not upload_sessions:
+            return
+        try:
+            upload_sessions.cleanup_expired()
+        except Exception as e:
+            logger.error(f"Upload session cleanup error: {str(e)}")
+
     def _check_stuck_jobs(self):
         """Check for stuck jobs and retry if needed"""
         try:
@@ -193,6 +407,23 @@ class WorkerService:
                     (self.job_queue.generation_queue, self._process_generation_job),
                     (self.job_queue.photobook_queue, self._process_photobook_job),
                 ]:
+                    if (
+                        queue_name == self.job_queue.training_queue
+                        and self.worker_mode == "asyncio"
+                    ):
+                        continue  # Handled by the training loop
+                    if (
+                        queue_name == self.job_queue.training_queue
+                        and self.training_batch_size > 1
+                    ):
+                        jobs = self.job_queue.dequeue_jobs(
+                            queue_name, self.training_batch_size
+                        )
+                        if jobs:
+                            self._process_training_batch(jobs)
+                            break
+                        continue
+
                     job = self.job_queue.dequeue_job(queue_name)
                     if job:
                         self._process_job(job, processor)
@@ -222,11 +453,21 @@ class WorkerService:
 
     def get_status(self) -> Dict[str, Any]:
         """Get worker service status"""
-        return {
+        status = {
             "active_workers": len([w for w in self.workers if w.is_alive()]),
             "worker_status": self.worker_status,
             "queue_size": self.job_queue.get_queue_size(),
         }
+        if hasattr(self.compute_backend, "get_stats"):
+            status["compute"] = self.compute_backend.get_stats()
+        status["weights_cache"] = self.weights_cache.get_stats()
+        if self.worker_mode == "asyncio":
+            status["async_training_jobs"] = {
+                "active": len(self.async_training_jobs),
+                "max": self.async_max_training_jobs,
+                "job_ids": list(self.async_training_jobs),
+            }
+        return status
 
     def _process_job(self, job: Dict[str, Any], processor):
         """Process job with error handling"""
@@ -240,109 +481,96 @@ class WorkerService:
                 processor(job)
             self.worker_status[thread_id]["jobs_processed"] += 1
         except Exception as e:
-            logger.error(f"Job processing error: {str(e)}")
-            if job.get("retries", 0) < self.max_retries:
-                self.job_queue.retry_job(job_id)
-            else:
-                self._send_alert(
-                    {"type": "job_failed", "job_id": job_id, "error": str(e)}
-                )
+            self._handle_job_failure(job, e)
+        finally:
+            self.worker_status[thread_id]["current_job"] = None
+
+    def _handle_job_failure(self, job: Dict[str, Any], error: Exception):
+        """
+        Retry a failed job, or alert once it is out of retries. Jobs failed
+        with NonRetryableJobError stay FAILED; their credit was already
+        refunded by _fail_training_job.
+        """
+        job_id = job["job_id"]
+        logger.error(f"Job processing error: {str(error)}")
+        if isinstance(error, NonRetryableJobError):
+            logger.info(f"Not retrying job {job_id}")
+        elif job.get("retries", 0) < self.max_retries:
+            self.job_queue.retry_job(job_id)
+        else:
+            self._send_alert(
+                {"type": "job_failed", "job_id": job_id, "error": str(error)}
+            )
+
+    def _process_training_batch(self, jobs: List[Dict[str, Any]]):
+        """Process several training jobs on one GPU instance"""
+        thread_id = threading.current_thread().ident
+        self.worker_status[thread_id]["current_job"] = ", ".join(
+            job["job_id"] for job in jobs
+        )
+
+        try:
+            # Run within application context
+            with self.app.app_context():
+                errors = self._run_training_jobs(jobs)
+
+            for job in jobs:
+                error = errors.get(job["job_id"])
+                if error:
+                    self._handle_job_failure(job, error)
+                else:
+                    self.worker_status[thread_id]["jobs_processed"] += 1
         finally:
             self.worker_status[thread_id]["current_job"] = None
 
-    def _get_trained_model_weights(
-        self, model_id: int, training_config: Dict
-    ) -> Tuple[str, Dict[str, List[str]]]:
-        """Get the path to trained model weights and theme images using AI service"""
+    def _get_trained_models_weights(
+        self, training_jobs: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """Train models on one instance using AI service, one result per job"""
         try:
             # Initialize AI service with config
-            ai_service = AIService(self.config)
+            ai_service = AIService(self.config, backend=self.compute_backend)
 
-            # Run training and get the local weights file path and theme images
-            return ai_service.train_model(
-                model_id=model_id,
-                user_id=training_config["user_id"],
-                training_config=training_config,
-            )
+            # Run training; each result carries weights, theme images or error
+            return ai_service.train_models(training_jobs)
 
         except Exception as e:
             logger.error(f"Training error: {str(e)}")
-            raise
+            return [{"model_id": job["model_id"], "error": e} for job in training_jobs]
 
-    def _save_initial_photobook(
-        self, user_id: int, model_id: int, theme_name: str, image_paths: List[str]
-    ) -> None:
-        """Helper function to save initial photobook and its images"""
+    def _publish_model_weights(
+        self, user_id: int, model_id: int, weights_file_path: str
+    ) -> int:
+        """Upload trained weights and mark the model ready for generation"""
         storage_service = self.config["storage_service"]
-        theme_data = self.photoshoot_themes[
-            theme_name
-        ]  # dict with { "gender", "description", "prompts": [...] }
-        prompt_items = theme_data["prompts"]
 
-        try:
-            # Create photobook entry
-            photobook = PhotoBook(
-                user_id=user_id,
-                model_id=model_id,
-                name=theme_name,
-                theme_name=theme_name,
-                status=JobStatus.COMPLETED,
-                is_unlocked=False,
-            )
-            db.session.add(photobook)
+        # Runs on the weights download thread, so it needs its own context
+        with self.app.app_context():
+            logger.info(f"Uploading model weights for model {model_id}")
+            with open(weights_file_path, "rb") as f:
+                weights_location = storage_service.upload_model_weights(
+                    user_id=user_id, model_id=model_id, weights_file=f, version="1.0"
+                )
+            db.session.add(weights_location)
             db.session.commit()
 
-            index_pointer = 0
-
-            # Each item is { "prompt": "...", "count": 4 }
-            for item in prompt_items:
-                base_prompt = item["prompt"]
-                count_for_prompt = item["count"]
-
-                for _ in range(count_for_prompt):
-                    if index_pointer >= len(image_paths):
-                        # Safety check if there's a mismatch
-                        logger.warning(
-                            "Ran out of image_paths while saving photobook images."
-                        )
-                        break
-
-                    image_path = image_paths[index_pointer]
-                    index_pointer += 1
-
-                    # Save to storage
-                    with open(image_path, "rb") as f:
-                        image_data = f.read()
-
-                    location = storage_service.save_photobook_image(
-                        user_id=user_id,
-                        photobook_id=photobook.id,
-                        image_data=image_data,
-                        image_number=index_pointer,
-                        prompt=base_prompt,
-                    )
-                    db.session.add(location)
-                    db.session.commit()
+            if weights_location.id is None:
+                logger.error(
+                    "Failed to get weights storage location ID after committing."
+                )
+                raise Exception("Weights storage location ID is None after commit.")
 
-                    # Now create the GeneratedImage record
-                    gen_image = GeneratedImage(
-                        user_id=user_id,
-                        model_id=model_id,
-                        photobook_id=photobook.id,
-                        storage_location_id=location.id,
-                        prompt=base_prompt,
-                    )
-                    db.session.add(gen_image)
-                    db.session.commit()
+            # Seed this host's cache so the first generations skip the download
+            self.weights_cache.put(weights_location, weights_file_path)
 
-            logger.info(f"Successfully saved initial photobook for theme {theme_name}")
+            model = TrainedModel.query.get(model_id)
+            model.status = JobStatus.COMPLETED
+            model.weights_location_id = weights_location.id
+            model.training_completed_at = datetime.utcnow()
+            db.session.commit()
 
-        except Exception as e:
-            db.session.rollback()
-            logger.error(
-                f"Failed to save initial photobook for theme {theme_name}: {str(e)}"
-            )
-            raise
+            logger.info(f"Model {model_id} is ready, initial photobooks continue")
+            return weights_location.id
 
     def _get_generated_images(
         self, model_id: int, generation_config: Dict
@@ -350,7 +578,7 @@ class WorkerService:
         """Get generated images using AI service"""
         try:
             # Initialize AI service with config
-            ai_service = AIService(self.config)
+            ai_service = AIService(self.config, backend=self.compute_backend)
 
             # Handle both single prompt and multiple prompts cases
             if "prompts" in generation_config:
@@ -362,13 +590,19 @@ class WorkerService:
             else:
                 raise ValueError("No prompts provided in generation config")
 
-            # Generate images and get the local paths
-            image_paths = ai_service.generate_images(
-                model_id=model_id,
-                user_id=generation_config["user_id"],
-                model_path=generation_config["model_weights_path"],
-                prompts=prompts,
-            )
+            model = TrainedModel.query.get(model_id)
+            if not model or not model.weights_location:
+                raise ValueError(f"Model {model_id} has no stored weights")
+
+            # Weights come from the local cache, downloading only on a miss
+            with self.weights_cache.use(model.weights_location) as weights_path:
+                # Generate images and get the local paths
+                image_paths = ai_service.generate_images(
+                    model_id=model_id,
+                    user_id=generation_config["user_id"],
+                    model_path=str(weights_path),
+                    prompts=prompts,
+                )
             return image_paths
 
         except Exception as e:
@@ -377,153 +611,291 @@ class WorkerService:
 
     def _process_training_job(self, job: Dict[str, Any]):
         """Process model training job."""
-        job_id = job["job_id"]
-        logger.info(f"Processing training job {job_id}")
+        error = self._run_training_jobs([job])[job["job_id"]]
+        if error:
+            raise error
+
+    def _run_training_jobs(
+        self, jobs: List[Dict[str, Any]]
+    ) -> Dict[str, Optional[Exception]]:
+        """
+        Train jobs on a shared GPU instance, returning each job's error, or
+        None for jobs that succeeded or must not be retried
+        """
+        errors: Dict[str, Optional[Exception]] = {}
+        runs = []
+
+        for job in jobs:
+            run = self._new_training_run(job)
+            try:
+                runs.append((run, self._start_training_job(run)))
+            except Exception as e:
+                errors[job["job_id"]] = e if self._fail_training_job(run, e) else None
+                self._cleanup_training_job(run)
 
-        model = None
-        temp_dir = None
-        theme_images_dir = None
+        if not runs:
+            return errors
 
-        try:
-            # Mark the job as PROCESSING in Redis
-            self.job_queue.update_job_status(job_id, JobStatus.PROCESSING)
+        if len(runs) > 1:
+            logger.info(f"Training {len(runs)} models on one instance")
+        results = self._get_trained_models_weights(
+            [training_job for _, training_job in runs]
+        )
 
-            # Extract top-level data
-            user_id = job["user_id"]
-            payload = job["payload"]
-            model_id = payload["model_id"]
-            file_info = payload["file_info"]
-            name = payload["name"]
-            config = payload["config"]
-            temp_dir = Path(payload["temp_dir"])
+        for (run, _), result in zip(runs, results):
+            job_id = run["job"]["job_id"]
+            try:
+                if result["error"]:
+                    raise result["error"]
+                self._complete_training_job(run, result["theme_images"])
+                errors[job_id] = None
+            except Exception as e:
+                errors[job_id] = e if self._fail_training_job(run, e) else None
+            finally:
+                self._cleanup_training_job(run)
 
-            # Mark model as PROCESSING in DB
-            with db.session.begin_nested():
-                model = TrainedModel.query.get(model_id)
-                model.training_started_at = datetime.utcnow()
-                model.status = JobStatus.PROCESSING
-                db.session.add(model)
-            db.session.commit()
+        return errors
 
-            # 1) Run training using AI service
-            logger.info(f"Starting model training for model_id {model_id}")
-            weights_file_path, theme_images = self._get_trained_model_weights(
-                model_id=model_id,
-                training_config={
-                    "user_id": user_id,
-                    "file_info": file_info,
-                    "name": name,
-                    "sex": config.get("sex"),
-                    "age_years": config.get("age_years"),
-                    "age_months": config.get("age_months"),
-                },
-            )
+    @staticmethod
+    def _new_training_run(job: Dict[str, Any]) -> Dict[str, Any]:
+        """State shared by the steps of one training job"""
+        return {
+            "job": job,
+            "model_id": None,
+            "uploader": None,
+            "published": {},
+            "temp_dir": None,
+            "theme_images_dir": None,
+        }
 
-            # 2) Upload model weights to storage
-            logger.info(f"Uploading model weights for model {model_id}")
-            storage_service = self.config["storage_service"]
-            with open(weights_file_path, "rb") as f:
-                weights_location = storage_service.upload_model_weights(
-                    user_id=user_id, model_id=model_id, weights_file=f, version="1.0"
+    def _start_training_job(self, run: Dict[str, Any]) -> Dict[str, Any]:
+        """Mark a training job as started and build its AI service job"""
+        job = run["job"]
+        job_id = job["job_id"]
+        logger.info(f"Processing training job {job_id}")
+
+        # Mark the job as PROCESSING in Redis
+        self.job_queue.update_job_status(job_id, JobStatus.PROCESSING)
+
+        # Extract top-level data
+        user_id = job["user_id"]
+        payload = job["payload"]
+        model_id = payload["model_id"]
+        name = payload["name"]
+        config = payload["config"]
+        run["temp_dir"] = Path(payload["temp_dir"])
+
+        # Mark model as PROCESSING in DB
+        with db.session.begin_nested():
+            model = TrainedModel.query.get(model_id)
+            model.training_started_at = datetime.utcnow()
+            model.status = JobStatus.PROCESSING
+            db.session.add(model)
+        db.session.commit()
+        run["model_id"] = model_id
+
+        if "uploads" in payload:
+            # Uploaded straight to storage; fetched and checked here instead
+            # of in the request, after run["model_id"] is set so a bad upload
+            # fails the model
+            file_info = self._fetch_training_uploads(
+                payload["uploads"], run["temp_dir"]
+            )
+        else:
+            # Only their headers were read in the request
+            file_info = payload["file_info"]
+            for info in file_info:
+                self._verify_training_image(info["path"], info["original_filename"])
+
+        # 1) Initial photobook images are uploaded and persisted as they come
+        # off the GPU instance
+        run["uploader"] = InitialPhotobookUploader(
+            app=self.app,
+            storage_service=self.config["storage_service"],
+            user_id=user_id,
+            model_id=model_id,
+            theme_catalog=self.theme_catalog,
+        )
+
+        # 2) Model weights are uploaded and the model marked COMPLETED as
+        # soon as they are downloaded, while photobooks are still generating
+        published = run["published"]
+
+        def publish_weights(weights_file_path: str):
+            try:
+                published["weights_location_id"] = self._publish_model_weights(
+                    user_id, model_id, weights_file_path
                 )
-                db.session.add(weights_location)
-                db.session.commit()
+            finally:
+                Path(weights_file_path).unlink(missing_ok=True)
 
-                if weights_location.id is None:
-                    logger.error(
-                        "Failed to get weights storage location ID after committing."
-                    )
-                    raise Exception("Weights storage location ID is None after commit.")
+        logger.info(f"Starting model training for model_id {model_id}")
+        return {
+            "model_id": model_id,
+            "user_id": user_id,
+            "training_config": {
+                "user_id": user_id,
+                "file_info": file_info,
+                "name": name,
+                "sex": config.get("sex"),
+                "age_years": config.get("age_years"),
+                "age_months": config.get("age_months"),
+            },
+            "on_image": run["uploader"].submit,
+            "on_progress": lambda progress: self.job_queue.update_job_progress(
+                job_id, progress
+            ),
+            "on_weights": publish_weights,
+        }
 
-            # Cleanup local weights file
-            if Path(weights_file_path).exists():
-                Path(weights_file_path).unlink()
+    def _fetch_training_uploads(
+        self, uploads: List[Dict[str, str]], temp_dir: Path
+    ) -> List[Dict[str, Any]]:
+        """Download directly uploaded training images and validate them"""
+        storage_service = self.config["storage_service"]
+        temp_dir.mkdir(parents=True, exist_ok=True)
+        local_paths = storage_service.fetch_uploads(
+            [upload["path"] for upload in uploads], str(temp_dir)
+        )
+
+        file_info = []
+        for upload, local_path in zip(uploads, local_paths):
+            self._verify_training_image(local_path, upload["original_filename"])
+            with Image.open(local_path) as img:
+                file_info.append(
+                    {
+                        "path": local_path,
+                        "original_filename": upload["original_filename"],
+                        "width": img.width,
+                        "height": img.height,
+                        "format": img.format,
+                    }
+                )
+        return file_info
 
-            # 3) Save initial photobooks from the generated theme_images
-            n_themes = len(theme_images)
-            logger.info(
-                f"Processing {n_themes} initial photobooks for model {model_id}"
+    @staticmethod
+    def _verify_training_image(path: str, original_filename: str):
+        """Check a whole training image decodes, failing the job for good if not"""
+        try:
+            with Image.open(path) as img:
+                img.verify()
+        except Exception as e:
+            raise NonRetryableJobError(
+                f"Invalid training image {original_filename}: {str(e)}"
             )
 
-            for theme_name, image_paths in theme_images.items():
-                try:
-                    if not image_paths:
-                        logger.warning(f"Empty image paths for theme {theme_name}")
-                        continue
+    def _complete_training_job(
+        self, run: Dict[str, Any], theme_images: Dict[str, List[str]]
+    ):
+        """Finish a trained job once its initial photobooks are saved"""
+        job_id = run["job"]["job_id"]
+        model_id = run["model_id"]
+        weights_location_id = run["published"]["weights_location_id"]
 
-                    logger.info(
-                        f"Saving photobook for theme {theme_name} with {len(image_paths)} images"
-                    )
-                    # Typically the parent directory of the first image's parent is the "theme_images" folder
-                    theme_images_dir = (
-                        Path(image_paths[0]).parent.parent if image_paths else None
-                    )
+        # 3) Wait for the initial photobook uploads still in flight
+        saved = run["uploader"].finish()
+        logger.info(f"Saved {len(saved)} initial photobooks for model {model_id}")
 
-                    self._save_initial_photobook(
-                        user_id=user_id,
-                        model_id=model_id,
-                        theme_name=theme_name,
-                        image_paths=image_paths,
-                    )
-                except Exception as theme_error:
-                    logger.error(
-                        f"Failed to save theme {theme_name}: {str(theme_error)}",
-                        exc_info=True,
-                    )
-                    continue
+        # Typically the parent directory of the first image's parent is the "theme_images" folder
+        first_paths = next((p for p in theme_images.values() if p), None)
+        run["theme_images_dir"] = (
+            Path(first_paths[0]).parent.parent if first_paths else None
+        )
 
-            # 4) Mark model as COMPLETED in DB
-            with db.session.begin_nested():
-                model.status = JobStatus.COMPLETED
-                model.weights_location_id = weights_location.id
-                model.training_completed_at = datetime.utcnow()
-                db.session.add(model)
-            db.session.commit()
+        # 4) The model was completed by another session; reload it
+        model = TrainedModel.query.get(model_id)
 
-            # (Optional) Send email
-            try:
-                email_service = self.config.get("email_service")
-                if email_service and model and model.user:
-                    user = model.user
-                    email_service.send_training_complete(
-                        user_email=user.email, user_name=user.username, success=True
-                    )
-            except Exception as ex:
-                logger.error(
-                    f"Failed to send training completion email: {ex}", exc_info=True
+        # (Optional) Send email
+        try:
+            email_service = self.config.get("email_service")
+            if email_service and model and model.user:
+                user = model.user
+                email_service.send_training_complete(
+                    user_email=user.email, user_name=user.username, success=True
                 )
-
-            # 5) Update job queue status
-            self.job_queue.update_job_status(
-                job_id,
-                JobStatus.COMPLETED,
-                {"model_id": model_id, "weights_location_id": weights_location.id},
+        except Exception as ex:
+            logger.error(
+                f"Failed to send training completion email: {ex}", exc_info=True
             )
 
-        except Exception as e:
-            db.session.rollback()
-            logger.error(f"Training error: {str(e)}")
+        # Direct uploads are kept for retries until the training succeeds
+        self._discard_training_uploads(run["job"])
+
+        # 5) Update job queue status
+        self.job_queue.update_job_status(
+            job_id,
+            JobStatus.COMPLETED,
+            {"model_id": model_id, "weights_location_id": weights_location_id},
+        )
+
+    def _discard_training_uploads(self, job: Dict[str, Any]):
+        """Remove a job's direct uploads from storage, if it had any"""
+        uploads = job["payload"].get("uploads")
+        if not uploads:
+            return
+        try:
+            self.config["storage_service"].discard_uploads(
+                [upload["path"] for upload in uploads]
+            )
+        except Exception as ex:
+            logger.error(f"Failed to remove training uploads: {str(ex)}")
+
+    def _fail_training_job(self, run: Dict[str, Any], error: Exception) -> bool:
+        """
+        Record a training failure on the model and job, refunding if final.
+        Returns whether the failure goes on to _handle_job_failure: once the
+        weights are published the model is COMPLETED and the user keeps it,
+        so the job is recorded as partially completed and neither retried nor
+        refunded.
+        """
+        job = run["job"]
+        job_id = job["job_id"]
 
-            # Mark the model as FAILED
-            if model:
-                try:
-                    with db.session.begin_nested():
-                        model.status = JobStatus.FAILED
-                        model.error_message = str(e)
-                        db.session.add(model)
-                    db.session.commit()
-                except Exception as ex:
-                    logger.error(f"Failed to update model status to FAILED: {str(ex)}")
+        db.session.rollback()
+        logger.error(f"Training error: {str(error)}")
 
-            # Mark the job as FAILED in Redis
+        weights_location_id = run["published"].get("weights_location_id")
+        if weights_location_id:
+            logger.warning(
+                f"Model {run['model_id']} was published before job {job_id} failed; "
+                "not retrying"
+            )
             self.job_queue.update_job_status(
-                job_id, JobStatus.FAILED, {"error": str(e)}
+                job_id,
+                JobStatus.COMPLETED,
+                {
+                    "model_id": run["model_id"],
+                    "weights_location_id": weights_location_id,
+                    "partial": True,
+                    "error": str(error),
+                },
             )
+            self._discard_training_uploads(job)
+            return False
 
-            # Refund credits if the job has reached maximum retries
-            job_data = self.job_queue.get_job_status(job_id)
-            retries = job_data.get("retries", 0) if job_data else 0
-            if retries >= self.max_retries:
+        # Mark the model as FAILED
+        if run["model_id"]:
+            try:
+                with db.session.begin_nested():
+                    model = TrainedModel.query.get(run["model_id"])
+                    model.status = JobStatus.FAILED
+                    model.error_message = str(error)
+                    db.session.add(model)
+                db.session.commit()
+            except Exception as ex:
+                logger.error(f"Failed to update model status to FAILED: {str(ex)}")
+
+        # Mark the job as FAILED in Redis
+        self.job_queue.update_job_status(
+            job_id, JobStatus.FAILED, {"error": str(error)}
+        )
+
+        # Refund credits if the job has reached maximum retries, or right
+        # away when it will not be retried at all
+        job_data = self.job_queue.get_job_status(job_id)
+        retries = job_data.get("retries", 0) if job_data else 0
+        if retries >= self.max_retries or isinstance(error, NonRetryableJobError):
+            try:
                 credit_service = CreditService(self.config)
                 user = User.query.get(job["user_id"])
                 if user and credit_service:
@@ -531,24 +903,136 @@ class WorkerService:
                         f"Refunding MODEL credit for user {user.id} due to failed training job."
                     )
                     credit_service.refund_credits(user, CreditType.MODEL, amount=1)
+            except Exception as ex:
+                logger.error(f"Failed to refund credits for job {job_id}: {str(ex)}")
 
-            raise
+            # No retry will read the direct uploads any more
+            self._discard_training_uploads(job)
 
+        return True
+
+    def _cleanup_training_job(self, run: Dict[str, Any]):
+        """Stop pending uploads and remove a job's local directories"""
+        if run["uploader"]:
+            run["uploader"].shutdown()
+
+        # 6) Cleanup local directories
+        cleanup_paths = [run["temp_dir"], run["theme_images_dir"]]
+        for path in cleanup_paths:
+            if path and path.exists():
+                try:
+                    shutil.rmtree(path)
+                except Exception as cleanup_error:
+                    logger.error(f"Failed to cleanup {path}: {cleanup_error}")
+
+    def _in_app_context(self, func: Callable, *args):
+        with self.app.app_context():
+            return func(*args)
+
+    def _run_async_training_loop(self):
+        asyncio.run(self._async_training_loop())
+
+    async def _async_training_loop(self):
+        """Claim training jobs and supervise each as a task on this loop"""
+        logger.info(
+            f"Starting asyncio training loop (up to {self.async_max_training_jobs} jobs)"
+        )
+        slots = asyncio.Semaphore(self.async_max_training_jobs)
+
+        def release(job_id: str):
+            self.async_training_jobs.pop(job_id, None)
+            slots.release()
+
+        try:
+            while not self.should_stop:
+                await slots.acquire()
+                try:
+                    job = await asyncio.to_thread(
+                        self.job_queue.dequeue_job, self.job_queue.training_queue
+                    )
+                except Exception as e:
+                    logger.error(f"Training loop error: {str(e)}")
+                    job = None
+
+                if not job:
+                    slots.release()
+                    await asyncio.sleep(1)
+                    continue
+
+                job_id = job["job_id"]
+                task = asyncio.create_task(self._process_training_job_async(job))
+                self.async_training_jobs[job_id] = task
+                task.add_done_callback(lambda _, job_id=job_id: release(job_id))
         finally:
-            # 6) Cleanup local directories
-            cleanup_paths = [temp_dir, theme_images_dir]
-            for path in cleanup_paths:
-                if path and path.exists():
-                    try:
-                        shutil.rmtree(path)
-                    except Exception as cleanup_error:
-                        logger.error(f"Failed to cleanup {path}: {cleanup_error}")
+            # Cancel jobs still running and let them terminate their instances
+            # before the backend's session goes away
+            tasks = list(self.async_training_jobs.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.async_ai_service.backend.close()
+
+    def _async_progress(self, job_id: str) -> Callable[[Dict[str, Any]], None]:
+        """
+        on_progress for the training loop. Redis writes run on a thread, one
+        at a time, and only the newest progress is written when they lag.
+        Safe to call from the loop thread or from a worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        state: Dict[str, Any] = {"latest": None, "task": None}
+
+        async def flush():
+            while state["latest"] is not None:
+                progress, state["latest"] = state["latest"], None
+                await asyncio.to_thread(
+                    self.job_queue.update_job_progress, job_id, progress
+                )
+
+        def schedule(progress: Dict[str, Any]):
+            state["latest"] = progress
+            if state["task"] is None or state["task"].done():
+                state["task"] = loop.create_task(flush())
+
+        return lambda progress: loop.call_soon_threadsafe(schedule, progress)
+
+    async def _process_training_job_async(self, job: Dict[str, Any]):
+        """Process model training job on the training loop"""
+        run = self._new_training_run(job)
+        try:
+            training_job = await asyncio.to_thread(
+                self._in_app_context, self._start_training_job, run
+            )
+            training_job["on_progress"] = self._async_progress(job["job_id"])
+            _, theme_images = await self.async_ai_service.train_model(**training_job)
+            await asyncio.to_thread(
+                self._in_app_context, self._complete_training_job, run, theme_images
+            )
+        except Exception as e:
+            retry = "weights_location_id" not in run["published"]
+            try:
+                retry = await asyncio.to_thread(
+                    self._in_app_context, self._fail_training_job, run, e
+                )
+            except Exception as ex:
+                logger.error(f"Failed to record training failure: {str(ex)}")
+            if retry:
+                await asyncio.to_thread(self._handle_job_failure, job, e)
+        finally:
+            await asyncio.to_thread(self._cleanup_training_job, run)
+
+    @staticmethod
+    def _discard_generated_images(image_paths: List[str]):
+        """Remove the local run directory generated images were downloaded to"""
+        if image_paths:
+            # <run>/generated/<image>
+            shutil.rmtree(Path(image_paths[0]).parent.parent, ignore_errors=True)
 
     def _process_photobook_job(self, job: Dict[str, Any]):
         """Process themed photoshoot generation"""
         job_id = job["job_id"]
         logger.info(f"Processing photobook job {job_id}")
         photobook = None
+        image_paths: List[str] = []
 
         try:
             self.job_queue.update_job_status(job_id, JobStatus.PROCESSING)
@@ -558,7 +1042,6 @@ class WorkerService:
             model_id = job["payload"]["model_id"]
             user_id = job["user_id"]
             prompts = job["payload"]["prompts"]  # Use prompts directly from payload
-            model_weights_path = job["payload"]["model_weights_path"]
 
             # Get storage service
             storage_service = self.config["storage_service"]
@@ -578,7 +1061,6 @@ class WorkerService:
                 model_id=model_id,
                 generation_config={
                     "user_id": user_id,
-                    "model_weights_path": model_weights_path,
                     "prompts": themed_prompts,
                 },
             )
@@ -651,11 +1133,14 @@ class WorkerService:
             self.job_queue.update_job_status(
                 job_id, JobStatus.FAILED, {"error": str(e)}
             )
+        finally:
+            self._discard_generated_images(image_paths)
 
     def _process_generation_job(self, job: Dict[str, Any]):
         """Process single image generation job"""
         job_id = job["job_id"]
         logger.info(f"Processing generation job {job_id}")
+        image_paths: List[str] = []
 
         try:
             self.job_queue.update_job_status(job_id, JobStatus.PROCESSING)
@@ -667,7 +1152,6 @@ class WorkerService:
             # Prepare generation config
             generation_config = {
                 "user_id": user_id,
-                "model_weights_path": job["payload"]["model_weights_path"],
                 "prompt": job["payload"]["prompt"],
                 "parameters": job["payload"].get("parameters", {}),
             }
@@ -727,3 +1211,5 @@ class WorkerService:
             self.job_queue.update_job_status(
                 job_id, JobStatus.FAILED, {"error": str(e)}
             )
+        finally:
+            self._discard_generated_images(image_paths)
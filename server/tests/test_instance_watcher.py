@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from services.lambda_client import InstanceWatcher, LambdaAPIException
+
+FAST_POLLS = {"LAMBDA_POLL_FAST_INTERVAL": 0.01, "LAMBDA_POLL_SLOW_INTERVAL": 0.01}
+
+
+class FakeClient:
+    def __init__(self):
+        self.instances = {}
+
+    def request(self, method, endpoint):
+        return {"data": list(self.instances.values())}
+
+    def boot(self, instance_id, status="booting"):
+        self.instances[instance_id] = {
+            "id": instance_id,
+            "status": status,
+            "ip": "10.0.0.1" if status == "active" else None,
+        }
+
+
+def test_cancelled_waiter_does_not_break_other_watches():
+    client = FakeClient()
+    client.boot("a")
+    client.boot("b")
+    watcher = InstanceWatcher(client, FAST_POLLS)
+
+    cancelled = watcher.watch("a")
+    waiting = watcher.watch("b")
+    assert cancelled.cancel()
+
+    client.boot("a", "active")
+    client.boot("b", "active")
+
+    assert waiting.result(timeout=2)["ip"] == "10.0.0.1"
+    assert cancelled.cancelled()
+    stats = watcher.get_stats()
+    assert stats["pending"] == 0
+    assert stats["poll_failures"] == 0
+
+
+def test_timed_out_async_waiter_then_poll_again():
+    client = FakeClient()
+    client.boot("a")
+    client.boot("b")
+    watcher = InstanceWatcher(client, FAST_POLLS)
+
+    async def wait(instance_id, timeout):
+        return await asyncio.wait_for(
+            asyncio.wrap_future(watcher.watch(instance_id)), timeout
+        )
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await wait("a", 0.05)
+
+        waiting = asyncio.ensure_future(wait("b", 2))
+        client.boot("a", "active")
+        client.boot("b", "active")
+        return await waiting
+
+    assert asyncio.run(scenario())["ip"] == "10.0.0.1"
+    assert watcher.get_stats()["poll_failures"] == 0
+
+
+def test_watch_after_cancel_gets_a_fresh_future():
+    client = FakeClient()
+    client.boot("a")
+    watcher = InstanceWatcher(client, FAST_POLLS)
+
+    watcher.watch("a").cancel()
+    retry = watcher.watch("a")
+    client.boot("a", "failed")
+
+    with pytest.raises(LambdaAPIException):
+        retry.result(timeout=2)
@@ -0,0 +1,65 @@
+import hashlib
+from types import SimpleNamespace
+
+from services.weights_cache import WeightsCache
+
+WEIGHTS = b"lora weights" * 1024
+
+
+class FakeStorage:
+    def __init__(self):
+        self.downloads = 0
+
+    def download_to_path(self, location, path):
+        self.downloads += 1
+        with open(path, "wb") as f:
+            f.write(WEIGHTS)
+        return path
+
+
+def weights_location():
+    return SimpleNamespace(
+        bucket="bucket",
+        path="users/1/models/model.safetensors",
+        checksum=hashlib.sha256(WEIGHTS).hexdigest(),
+    )
+
+
+def test_second_job_reuses_cached_weights(tmp_path):
+    storage = FakeStorage()
+    cache = WeightsCache({"WEIGHTS_CACHE_DIR": tmp_path}, storage)
+    location = weights_location()
+
+    with cache.use(location) as first:
+        assert first.read_bytes() == WEIGHTS
+    with cache.use(location) as second:
+        assert second == first
+
+    assert storage.downloads == 1
+    assert cache.get_stats()["hits"] == 1
+
+
+def test_published_weights_are_served_without_download(tmp_path):
+    storage = FakeStorage()
+    cache = WeightsCache({"WEIGHTS_CACHE_DIR": tmp_path / "cache"}, storage)
+    location = weights_location()
+    trained = tmp_path / "trained.safetensors"
+    trained.write_bytes(WEIGHTS)
+
+    assert cache.put(location, str(trained))
+    with cache.use(location) as path:
+        assert path.read_bytes() == WEIGHTS
+
+    assert storage.downloads == 0
+
+
+def test_cache_survives_restart(tmp_path):
+    storage = FakeStorage()
+    location = weights_location()
+    with WeightsCache({"WEIGHTS_CACHE_DIR": tmp_path}, storage).use(location):
+        pass
+
+    with WeightsCache({"WEIGHTS_CACHE_DIR": tmp_path}, storage).use(location) as path:
+        assert path.read_bytes() == WEIGHTS
+
+    assert storage.downloads == 1